@@ -7,8 +7,17 @@
 
 """The cron module allows doing nightly tasks."""
 
+from typing import Callable
+from typing import Deque
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+import collections
+import concurrent.futures
 import configparser
 import datetime
+import http.client
 import logging
 import os
 import time
@@ -17,6 +26,7 @@ import urllib.error
 
 import helpers
 import overpass_query
+import stats
 import util
 
 
@@ -30,94 +40,288 @@ def overpass_sleep() -> None:
         time.sleep(sleep)
 
 
+# Used as the last download time of relations without an OSM stamp.
+OSM_EPOCH = "1970-01-01T00:00:00Z"
+
+
 def should_retry(retry: int) -> bool:
     """Decides if we should retry a query or not."""
     return retry < 20
 
 
-def update_streets(relations: helpers.Relations) -> None:
-    """Update the existing street list of all relations."""
-    for relation_name in relations.get_active_names():
-        logging.info("update_streets: start: %s", relation_name)
-        relation = relations.get_relation(relation_name)
-        retry = 0
-        while should_retry(retry):
-            if retry > 0:
-                logging.info("update_streets: try #%s", retry)
-            retry += 1
-            try:
-                overpass_sleep()
-                query = relation.get_osm_streets_query()
-                relation.get_files().write_osm_streets(overpass_query.overpass_query(query))
-                break
-            except urllib.error.HTTPError as http_error:
-                logging.info("update_streets: http error: %s", str(http_error))
-        logging.info("update_streets: end: %s", relation_name)
-
-
-def update_street_housenumbers(relations: helpers.Relations) -> None:
-    """Update the existing OSM street housenumber list of all relations."""
-    for relation_name in relations.get_active_names():
-        logging.info("update_street_housenumbers: start: %s", relation_name)
-        retry = 0
-        while should_retry(retry):
-            if retry > 0:
-                logging.info("update_street_housenumbers: try #%s", retry)
-            retry += 1
-            try:
-                overpass_sleep()
-                relation = relations.get_relation(relation_name)
-                query = relation.get_osm_housenumbers_query()
-                relation.get_files().write_osm_housenumbers(overpass_query.overpass_query(query))
-                break
-            except urllib.error.HTTPError as http_error:
-                logging.info("update_street_housenumbers: http error: %s", str(http_error))
-        logging.info("update_street_housenumbers: end: %s", relation_name)
+def finish_queries(
+        task: str,
+        in_flight: Dict["concurrent.futures.Future[None]", Tuple[str, int]],
+        pending: Deque[Tuple[str, int]],
+        succeeded: List[str]
+) -> None:
+    """Waits for at least one of the queries in flight to finish, failed queries go back to
+    pending while should_retry() allows it."""
+    done, _not_done = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+    for future in done:
+        relation_name, retry = in_flight.pop(future)
+        try:
+            future.result()
+            succeeded.append(relation_name)
+        except urllib.error.HTTPError as http_error:
+            logging.info("%s: http error: %s", task, str(http_error))
+            if should_retry(retry + 1):
+                pending.append((relation_name, retry + 1))
+                continue
+        except (OSError, http.client.HTTPException, ValueError) as error:
+            # E.g. a timeout or a truncated result: give up on this relation, but not on the others.
+            logging.info("%s: failed: %s: %s", task, relation_name, repr(error))
+        logging.info("%s: end: %s", task, relation_name)
+
+
+def run_queries(
+        task: str,
+        relations: helpers.Relations,
+        relation_names: List[str],
+        fetch: Callable[[helpers.Relation], None]
+) -> List[str]:
+    """
+    Runs an overpass query for the given relations, keeping as many queries in flight as the
+    overpass API has free slots for us. Returns the names of the relations where the query
+    succeeded.
+    """
+    pending = collections.deque([(name, 0) for name in relation_names])
+    succeeded = []  # type: List[str]
+    max_workers = max(overpass_query.overpass_query_slots()[0], 1)
+    in_flight = {}  # type: Dict[concurrent.futures.Future[None], Tuple[str, int]]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or in_flight:
+            if pending:
+                slots = overpass_query.overpass_query_slots()[1]
+                if not slots and not in_flight:
+                    overpass_sleep()
+                    slots = 1
+                slots = min(slots, max_workers - len(in_flight), len(pending))
+                for _ in range(slots):
+                    relation_name, retry = pending.popleft()
+                    if retry > 0:
+                        logging.info("%s: try #%s: %s", task, retry, relation_name)
+                    else:
+                        logging.info("%s: start: %s", task, relation_name)
+                    relation = relations.get_relation(relation_name)
+                    in_flight[executor.submit(fetch, relation)] = (relation_name, retry)
+            finish_queries(task, in_flight, pending, succeeded)
+    return succeeded
+
+
+def check_osm_changes(relations: helpers.Relations, relation_names: List[str]) -> Dict[str, Optional[Tuple[str, int]]]:
+    """
+    Runs the cheap change detection query for the given relations. Returns the relations which
+    should be downloaded again, with their new OSM stamp (None if the check failed).
+    """
+    changed = {}  # type: Dict[str, Optional[Tuple[str, int]]]
+
+    def fetch(relation: helpers.Relation) -> None:
+        files = relation.get_files()
+        stamp = relation.get_stamps().read_osm_stamp()
+        timestamp = OSM_EPOCH
+        if stamp:
+            timestamp = stamp[0]
+        query = relation.get_queries().get_osm_changes_query(timestamp)
+        changes = overpass_query.parse_osm_changes(overpass_query.overpass_query(query))
+        if not changes:
+            logging.info("check_osm_changes: unexpected result, downloading: %s", relation.get_name())
+            changed[relation.get_name()] = None
+            return
+        new_timestamp, count, newer = changes
+        downloaded = files.exists(files.get_osm_streets_path()) and files.exists(files.get_osm_housenumbers_path())
+        if stamp and downloaded and count == stamp[1] and not newer:
+            logging.info("check_osm_changes: unchanged since %s: %s", timestamp, relation.get_name())
+            return
+        changed[relation.get_name()] = (new_timestamp, count)
+
+    succeeded = run_queries("check_osm_changes", relations, relation_names, fetch)
+    # Be safe and download the relations where the check failed.
+    for relation_name in relation_names:
+        if relation_name not in succeeded:
+            changed[relation_name] = None
+    return changed
+
+
+def update_streets(relations: helpers.Relations, relation_names: List[str]) -> List[str]:
+    """Update the existing street list of relations."""
+    def fetch(relation: helpers.Relation) -> None:
+        query = relation.get_queries().get_osm_streets_query()
+        with overpass_query.overpass_query_file(query) as result:
+            relation.get_files().write_osm_streets(result)
+    return run_queries("update_streets", relations, relation_names, fetch)
+
+
+def update_street_housenumbers(relations: helpers.Relations, relation_names: List[str]) -> List[str]:
+    """Update the existing OSM street housenumber list of relations."""
+    def fetch(relation: helpers.Relation) -> None:
+        query = relation.get_queries().get_osm_housenumbers_query()
+        with overpass_query.overpass_query_file(query) as result:
+            relation.get_files().write_osm_housenumbers(result)
+    return run_queries("update_street_housenumbers", relations, relation_names, fetch)
+
+
+def update_streets_housenumbers(relations: helpers.Relations, relation_names: List[str]) -> List[str]:
+    """Update the existing street and OSM street housenumber list of relations, using a single
+    query per relation."""
+    def fetch(relation: helpers.Relation) -> None:
+        query = relation.get_queries().get_osm_streets_housenumbers_query()
+        with overpass_query.overpass_query_file(query) as result:
+            relation.get_files().write_osm_streets_housenumbers(result)
+    return run_queries("update_streets_housenumbers", relations, relation_names, fetch)
+
+
+def update_osm(relations: helpers.Relations, config: configparser.ConfigParser) -> None:
+    """Updates the OSM streets and house numbers of the active relations. Unless disabled, only the
+    changed relations are downloaded again."""
+    relation_names = relations.get_active_names()
+    if config.has_option("wsgi", "conditional_queries") and not config.getboolean("wsgi", "conditional_queries"):
+        changed = {i: None for i in relation_names}  # type: Dict[str, Optional[Tuple[str, int]]]
+    else:
+        changed = check_osm_changes(relations, relation_names)
+        logging.info("update_osm: %s of %s relations changed", len(changed), len(relation_names))
+    relation_names = sorted(changed.keys())
+
+    if config.has_option("wsgi", "combined_queries") and config.getboolean("wsgi", "combined_queries"):
+        updated = update_streets_housenumbers(relations, relation_names)
+    else:
+        streets = update_streets(relations, relation_names)
+        updated = [i for i in update_street_housenumbers(relations, relation_names) if i in streets]
+
+    for relation_name in updated:
+        stamp = changed[relation_name]
+        if stamp:
+            relations.get_relation(relation_name).get_stamps().write_osm_stamp(stamp)
+
+
+def get_references(config: configparser.ConfigParser) -> List[str]:
+    """Gets the absolute paths of the reference house number TSVs."""
+    references = config.get('wsgi', 'reference_housenumbers').strip().split(' ')
+    return [util.get_abspath(i) for i in references]
 
 
 def update_street_housenumbers_ref(relations: helpers.Relations, config: configparser.ConfigParser) -> None:
-    """Update the existing reference street housenumber list of all relations."""
+    """Update the existing reference street housenumber list of all relations, if it's outdated."""
+    references = get_references(config)
     for relation_name in relations.get_active_names():
-        logging.info("update_street_housenumbers_ref: start: %s", relation_name)
         relation = relations.get_relation(relation_name)
-        reference = config.get('wsgi', 'reference_housenumbers').strip().split(' ')
-        relation.write_ref_housenumbers(reference)
+        files = relation.get_files()
+        if not relation.get_stamps().needs_update(files.get_ref_housenumbers_path(), references):
+            continue
+
+        logging.info("update_street_housenumbers_ref: start: %s", relation_name)
+        relation.write_ref_housenumbers(references, relations.get_refmegyes())
         logging.info("update_street_housenumbers_ref: end: %s", relation_name)
+    logging.info("update_street_housenumbers_ref: reference cache hits: %s, misses: %s",
+                 util.REFERENCE_CACHE_LRU.get_hits(), util.REFERENCE_CACHE_LRU.get_misses())
+
+
+def write_missing(relation: helpers.Relation, kind: str) -> float:
+    """Updates the house number ("housenumbers") or street ("streets") coverage stats of a relation,
+    returns the time it took."""
+    start = time.time()
+    if kind == "housenumbers":
+        stats.write_missing_housenumbers(relation)
+    else:
+        relation.write_missing_streets()
+    return time.time() - start
+
+
+# Relations of a worker process, built on first use, see write_missing_in_worker().
+WORKER_RELATIONS = {}  # type: Dict[Tuple[str, str, str], helpers.Relations]
+
 
+def write_missing_in_worker(datadir: str, workdir: str, storage_name: str, relation_name: str, kind: str) -> float:
+    """Runs write_missing() in a worker process. Only the files of relation_name are written, so
+    workers don't race each other in workdir."""
+    key = (datadir, workdir, storage_name)
+    if key not in WORKER_RELATIONS:
+        WORKER_RELATIONS[key] = helpers.Relations(datadir, workdir, storage_name)
+    return write_missing(WORKER_RELATIONS[key].get_relation(relation_name), kind)
 
-def update_missing_housenumbers(relations: helpers.Relations) -> None:
-    """Update the relation's house number coverage stats."""
+
+def get_workers(config: configparser.ConfigParser) -> int:
+    """Gets the number of worker processes for the coverage stats, 1 means no worker processes."""
+    if config.has_option("wsgi", "cron_workers"):
+        return max(config.getint("wsgi", "cron_workers"), 1)
+    return 1
+
+
+def run_missing(
+        task: str,
+        relations: helpers.Relations,
+        config: configparser.ConfigParser,
+        relation_names: List[str],
+        kind: str
+) -> None:
+    """Runs write_missing() for relations, in parallel if cron_workers in wsgi.ini allows it."""
+    workers = get_workers(config)
+    if workers == 1:
+        for relation_name in relation_names:
+            duration = write_missing(relations.get_relation(relation_name), kind)
+            logging.info("%s: %s: %.3f seconds", task, relation_name, duration)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {}  # type: Dict[concurrent.futures.Future[float], str]
+        for relation_name in relation_names:
+            future = executor.submit(write_missing_in_worker, relations.get_datadir(), relations.get_workdir(),
+                                     relations.get_storage_name(), relation_name, kind)
+            futures[future] = relation_name
+        for future in concurrent.futures.as_completed(futures):
+            logging.info("%s: %s: %.3f seconds", task, futures[future], future.result())
+
+
+def update_missing_housenumbers(relations: helpers.Relations, config: configparser.ConfigParser) -> None:
+    """Update the relation's house number coverage stats, if they're outdated."""
     logging.info("update_missing_housenumbers: start")
+    references = get_references(config)
+    relation_names = []
     for relation_name in relations.get_active_names():
         relation = relations.get_relation(relation_name)
         streets = relation.get_config().should_check_missing_streets()
         if streets == "only":
             continue
 
-        relation.write_missing_housenumbers()
+        files = relation.get_files()
+        if not relation.get_stamps().needs_update(files.get_housenumbers_percent_path(), references):
+            continue
+
+        relation_names.append(relation_name)
+    run_missing("update_missing_housenumbers", relations, config, relation_names, "housenumbers")
     logging.info("update_missing_housenumbers: end")
 
 
-def update_missing_streets_stats(relations: helpers.Relations) -> None:
-    """Update the relation's street coverage stats."""
+def update_missing_streets_stats(relations: helpers.Relations, config: configparser.ConfigParser) -> None:
+    """Update the relation's street coverage stats, if they're outdated."""
     logging.info("update_missing_streets_stats: start")
+    references = get_references(config)
+    relation_names = []
     for relation_name in relations.get_active_names():
         relation = relations.get_relation(relation_name)
         streets = relation.get_config().should_check_missing_streets()
         if streets == "no":
             continue
 
-        relation.write_missing_streets()
+        files = relation.get_files()
+        if not relation.get_stamps().needs_update(files.get_streets_percent_path(), references):
+            continue
+
+        relation_names.append(relation_name)
+    run_missing("update_missing_streets_stats", relations, config, relation_names, "streets")
     logging.info("update_missing_streets_stats: end")
 
 
 def our_main(relations: helpers.Relations, config: configparser.ConfigParser) -> None:
-    """Performs the actual nightly task."""
-    update_streets(relations)
-    update_street_housenumbers(relations)
+    """Performs the actual nightly task. The derived files of a relation are only built again if
+    one of their inputs changed, see helpers.RelationStamps.get_dependencies()."""
+    update_osm(relations, config)
     update_street_housenumbers_ref(relations, config)
-    update_missing_housenumbers(relations)
-    update_missing_streets_stats(relations)
+    update_missing_housenumbers(relations, config)
+    update_missing_streets_stats(relations, config)
+    # The main page is rendered from this, so it doesn't have to read the files of each relation.
+    stats.write_stats(relations)
+    logging.info("our_main: updated %s", stats.get_stats_path(relations))
 
 
 def main() -> None:
@@ -129,7 +333,7 @@ def main() -> None:
 
     datadir = util.get_abspath("data")
     workdir = helpers.get_workdir(config)
-    relations = helpers.Relations(datadir, workdir)
+    relations = helpers.Relations(datadir, workdir, helpers.get_storage_name(config))
     logpath = os.path.join(workdir, "cron.log")
     logging.basicConfig(filename=logpath,
                         level=logging.INFO,
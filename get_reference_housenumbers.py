@@ -27,7 +27,7 @@ def main() -> None:
     workdir = util.get_abspath(config.get('wsgi', 'workdir').strip())
     relations = helpers.Relations(datadir, workdir)
     relation = relations.get_relation(relation_name)
-    relation.write_ref_housenumbers(reference)
+    relation.write_ref_housenumbers(reference, relations.get_refmegyes())
 
 
 if __name__ == "__main__":
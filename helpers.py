@@ -7,29 +7,54 @@
 """The helpers module contains functionality shared between other modules."""
 
 import configparser
+import contextlib
 import re
 import os
+import tempfile
 from typing import Any
+from typing import Callable
 from typing import Dict
-from typing import Iterable
 from typing import List
+from typing import Optional
 from typing import TextIO
 from typing import Tuple
 from typing import cast
-import yaml
 import yattag  # type: ignore
 
 from i18n import translate as _
 import ranges
+import refcache
+import storage
 import util
 
+# A list of street name - house numbers pairs, see Relation.get_missing_housenumbers().
+StreetHouseNumbers = List[Tuple[str, List[util.HouseNumber]]]
+
+# Version of the code and format of derived files: bump it when e.g. normalization changes, so
+# existing derived files are built again, see RelationStamps.get_version_path().
+DERIVED_FILES_VERSION = 1
+
+# (Storage backend name, path) -> version of version stamps which are known to be up to date.
+VERSION_STAMPS = {}  # type: Dict[Tuple[str, str], int]
+
 
 class RelationFiles:
     """A relation's file interface provides access to files associated with a relation."""
-    def __init__(self, datadir: str, workdir: str, name: str):
+    def __init__(self, datadir: str, workdir: str, name: str, backend: Optional[storage.FileStorage] = None):
         self.__datadir = datadir
         self.__workdir = workdir
         self.__name = name
+        if backend is None:
+            backend = storage.get_storage("", workdir)
+        self.__storage = backend
+
+    def get_storage(self) -> storage.FileStorage:
+        """Gets the storage backend of the files in the workdir."""
+        return self.__storage
+
+    def exists(self, path: str) -> bool:
+        """Decides if a file of the relation exists."""
+        return self.__storage.exists(path)
 
     def get_ref_streets_path(self) -> str:
         """Build the file name of the reference street list of a relation."""
@@ -37,8 +62,7 @@ class RelationFiles:
 
     def get_ref_streets_stream(self, mode: str) -> TextIO:
         """Opens the reference street list of a relation."""
-        path = self.get_ref_streets_path()
-        return cast(TextIO, open(path, mode=mode))
+        return self.__storage.open(self.get_ref_streets_path(), mode)
 
     def get_osm_streets_path(self) -> str:
         """Build the file name of the OSM street list of a relation."""
@@ -46,14 +70,14 @@ class RelationFiles:
 
     def get_osm_streets_stream(self, mode: str) -> TextIO:
         """Opens the OSM street list of a relation."""
-        path = self.get_osm_streets_path()
-        return cast(TextIO, open(path, mode=mode))
+        return self.__storage.open(self.get_osm_streets_path(), mode)
 
-    def write_osm_streets(self, result_from_overpass: str) -> None:
-        """Writes the result for overpass of Relation.get_osm_streets_query()."""
-        result = sort_streets_csv(result_from_overpass)
-        with self.get_osm_streets_stream("w") as sock:
-            sock.write(result)
+    def write_osm_streets(self, result_from_overpass: TextIO) -> None:
+        """Writes the result for overpass of RelationQueries.get_osm_streets_query(), sorted with bounded
+        memory usage."""
+        def write(stream: TextIO) -> None:
+            util.sort_csv_stream(result_from_overpass, stream, util.split_street_line)
+        self.__storage.write_stream(self.get_osm_streets_path(), write)
 
     def get_osm_housenumbers_path(self) -> str:
         """Build the file name of the OSM house number list of a relation."""
@@ -61,14 +85,30 @@ class RelationFiles:
 
     def get_osm_housenumbers_stream(self, mode: str) -> TextIO:
         """Opens the OSM house number list of a relation."""
-        path = self.get_osm_housenumbers_path()
-        return cast(TextIO, open(path, mode=mode))
-
-    def write_osm_housenumbers(self, result_from_overpass: str) -> None:
-        """Writes the result for overpass of Relation.get_osm_housenumbers_query()."""
-        result = sort_housenumbers_csv(result_from_overpass)
-        with self.get_osm_housenumbers_stream(mode="w") as stream:
-            stream.write(result)
+        return self.__storage.open(self.get_osm_housenumbers_path(), mode)
+
+    def write_osm_housenumbers(self, result_from_overpass: TextIO) -> None:
+        """Writes the result for overpass of RelationQueries.get_osm_housenumbers_query(), sorted with
+        bounded memory usage."""
+        def write(stream: TextIO) -> None:
+            util.sort_csv_stream(result_from_overpass, stream, util.split_housenumber_line)
+        self.__storage.write_stream(self.get_osm_housenumbers_path(), write)
+
+    def write_osm_streets_housenumbers(self, result_from_overpass: TextIO) -> None:
+        """Writes the result for overpass of RelationQueries.get_osm_streets_housenumbers_query()."""
+        with contextlib.ExitStack() as stack:
+            streets, housenumbers = [stack.enter_context(tempfile.TemporaryFile("w+", encoding="utf-8", newline="\n"))
+                                     for _ in range(2)]
+            util.split_streets_housenumbers_csv(result_from_overpass, streets, housenumbers)
+            streets.seek(0)
+            housenumbers.seek(0)
+            with self.__storage.transaction():
+                self.write_osm_streets(streets)
+                self.write_osm_housenumbers(housenumbers)
+
+    def get_config_path(self) -> str:
+        """Builds the file name of the (optional) own config of a relation."""
+        return os.path.join(self.__datadir, "relation-%s.yaml" % self.__name)
 
     def get_ref_housenumbers_path(self) -> str:
         """Build the file name of the reference house number list of a relation."""
@@ -76,7 +116,13 @@ class RelationFiles:
 
     def get_ref_housenumbers_stream(self, mode: str) -> TextIO:
         """Opens the reference house number list of a relation."""
-        return cast(TextIO, open(self.get_ref_housenumbers_path(), mode=mode))
+        return self.__storage.open(self.get_ref_housenumbers_path(), mode)
+
+    def write_ref_housenumbers(self, lines: List[str]) -> None:
+        """Writes the reference house number list of a relation, see
+        Relation.write_ref_housenumbers()."""
+        content = "".join(line + "\n" for line in lines)
+        self.__storage.write(self.get_ref_housenumbers_path(), content, key=util.get_ref_housenumbers_streets)
 
     def get_housenumbers_percent_path(self) -> str:
         """Builds the file name of the house number percent file of a relation."""
@@ -84,7 +130,12 @@ class RelationFiles:
 
     def get_housenumbers_percent_stream(self, mode: str) -> TextIO:
         """Opens the house number percent file of a relation."""
-        return cast(TextIO, open(self.get_housenumbers_percent_path(), mode=mode))
+        return self.__storage.open(self.get_housenumbers_percent_path(), mode)
+
+    def get_housenumbers_cache_path(self) -> str:
+        """Builds the file name of the missing house numbers cache of a relation, see
+        stats.write_missing_housenumbers()."""
+        return os.path.join(self.__workdir, "%s-housenumbers.json" % self.__name)
 
     def get_streets_percent_path(self) -> str:
         """Builds the file name of the street percent file of a relation."""
@@ -92,7 +143,76 @@ class RelationFiles:
 
     def get_streets_percent_stream(self, mode: str) -> TextIO:
         """Opens the street percent file of a relation."""
-        return cast(TextIO, open(self.get_streets_percent_path(), mode=mode))
+        return self.__storage.open(self.get_streets_percent_path(), mode)
+
+
+class RelationStamps:
+    """A relation's stamps decide if its files are up to date: the OSM stamp of the last download
+    and the inputs of the derived files."""
+    def __init__(self, datadir: str, workdir: str, name: str, files: RelationFiles) -> None:
+        self.__datadir = datadir
+        self.__workdir = workdir
+        self.__name = name
+        self.__files = files
+
+    def get_osm_stamp_path(self) -> str:
+        """Builds the file name of the OSM stamp of a relation: the overpass timestamp and element
+        count of the last download, see RelationQueries.get_osm_changes_query()."""
+        return os.path.join(self.__workdir, "osm-stamp-%s.txt" % self.__name)
+
+    def read_osm_stamp(self) -> Optional[Tuple[str, int]]:
+        """Reads the OSM stamp of a relation, returns None if there is no usable stamp."""
+        path = self.get_osm_stamp_path()
+        if not self.__files.get_storage().exists(path):
+            return None
+        tokens = self.__files.get_storage().read(path).strip().split("\t")
+        if len(tokens) != 2 or not tokens[1].isdigit():
+            return None
+        return tokens[0], int(tokens[1])
+
+    def write_osm_stamp(self, stamp: Tuple[str, int]) -> None:
+        """Writes the OSM stamp of a relation, after its OSM streets and house numbers are
+        downloaded."""
+        self.__files.get_storage().write(self.get_osm_stamp_path(), "%s\t%s\n" % stamp)
+
+    def get_dependencies(self, references: List[str]) -> Dict[str, List[str]]:
+        """
+        Gets the derived files of a relation and the files they are built from, like a makefile.
+        references is the list of reference house number TSVs.
+        """
+        files = self.__files
+        configs = [os.path.join(self.__datadir, "relations.yaml"), files.get_config_path(), self.get_version_path()]
+        # Relation.get_osm_streets() reads both OSM lists.
+        osm = [files.get_osm_streets_path(), files.get_osm_housenumbers_path()]
+        return {
+            files.get_ref_housenumbers_path(): references + osm + configs,
+            files.get_housenumbers_percent_path(): osm + [files.get_ref_housenumbers_path()] + configs,
+            files.get_housenumbers_cache_path(): osm + [files.get_ref_housenumbers_path()] + configs,
+            files.get_streets_percent_path(): osm + [files.get_ref_streets_path()] + configs,
+        }
+
+    def get_version_path(self) -> str:
+        """Builds the file name of the version stamp of derived files in the workdir, which is
+        rewritten when DERIVED_FILES_VERSION changes."""
+        return os.path.join(self.__workdir, "derived-files-version.txt")
+
+    def update_version_stamp(self) -> None:
+        """Rewrites the version stamp if it doesn't match DERIVED_FILES_VERSION, which outdates all
+        derived files. Only checked once per process."""
+        backend = self.__files.get_storage()
+        path = self.get_version_path()
+        key = (backend.get_name(), path)
+        if VERSION_STAMPS.get(key) == DERIVED_FILES_VERSION:
+            return
+        version = str(DERIVED_FILES_VERSION)
+        if not backend.exists(path) or backend.read(path).strip() != version:
+            backend.write(path, version + "\n")
+        VERSION_STAMPS[key] = DERIVED_FILES_VERSION
+
+    def needs_update(self, path: str, references: List[str]) -> bool:
+        """Decides if the derived file at path has to be built again, see get_dependencies()."""
+        self.update_version_stamp()
+        return self.__files.get_storage().is_outdated(path, self.get_dependencies(references)[path])
 
 
 class RelationConfig:
@@ -193,19 +313,57 @@ class RelationConfig:
         return []
 
 
+class RelationQueries:
+    """A relation's queries get its streets and house numbers from overpass."""
+    def __init__(self, datadir: str, config: RelationConfig) -> None:
+        self.__datadir = datadir
+        self.__config = config
+
+    def get_osm_streets_query(self) -> str:
+        """Produces a query which lists streets in relation."""
+        with open(os.path.join(self.__datadir, "streets-template.txt")) as stream:
+            return util.process_template(stream.read(), self.__config.get_osmrelation())
+
+    def get_osm_housenumbers_query(self) -> str:
+        """Produces a query which lists house numbers in relation."""
+        with open(os.path.join(self.__datadir, "street-housenumbers-template.txt")) as stream:
+            return util.process_template(stream.read(), self.__config.get_osmrelation())
+
+    def get_osm_streets_housenumbers_query(self) -> str:
+        """Produces a query which lists both streets and house numbers in relation."""
+        with open(os.path.join(self.__datadir, "streets-housenumbers-template.txt")) as stream:
+            return util.process_template(stream.read(), self.__config.get_osmrelation())
+
+    def get_osm_changes_query(self, timestamp: str) -> str:
+        """Produces a query which counts the OSM streets and house numbers in relation, and the ones
+        changed since timestamp."""
+        with open(os.path.join(self.__datadir, "osm-changes-template.txt")) as stream:
+            query = util.process_template(stream.read(), self.__config.get_osmrelation())
+            return query.replace("@TIMESTAMP@", timestamp)
+
+
 class Relation:
     """A relation is a closed polygon on the map."""
-    def __init__(self, datadir: str, workdir: str, name: str, parent_config: Dict[str, Any]) -> None:
-        self.__datadir = datadir
-        self.__workdir = workdir
+    def __init__(
+            self,
+            datadir: str,
+            workdir: str,
+            name: str,
+            parent_config: Dict[str, Any],
+            backend: Optional[storage.FileStorage] = None
+    ) -> None:
         self.__name = name
         my_config = {}  # type: Dict[str, Any]
-        self.__file = RelationFiles(datadir, workdir, name)
-        relation_path = os.path.join(datadir, "relation-%s.yaml" % name)
+        self.__file = RelationFiles(datadir, workdir, name, backend)
+        relation_path = self.__file.get_config_path()
         if os.path.exists(relation_path):
-            with open(relation_path) as sock:
-                my_config = yaml.load(sock)
+            my_config = util.YAML_CACHE.load(relation_path)
         self.__config = RelationConfig(parent_config, my_config)
+        self.__stamps = RelationStamps(datadir, workdir, name, self.__file)
+        self.__queries = RelationQueries(datadir, self.__config)
+        # Street name -> house number list of the OSM house number list, see get_osm_housenumbers().
+        self.__osm_housenumbers = {}  # type: Dict[str, List[util.HouseNumber]]
+        self.__osm_housenumbers_mtime = -1.0
 
     def get_name(self) -> str:
         """Gets the name of the relation."""
@@ -219,6 +377,14 @@ class Relation:
         """Gets access to the config interface."""
         return self.__config
 
+    def get_stamps(self) -> RelationStamps:
+        """Gets access to the stamp interface."""
+        return self.__stamps
+
+    def get_queries(self) -> RelationQueries:
+        """Gets access to the query interface."""
+        return self.__queries
+
     def get_street_ranges(self) -> Dict[str, ranges.Ranges]:
         """Gets a street name -> ranges map, which allows silencing false positives."""
         filter_dict = {}  # type: Dict[str, ranges.Ranges]
@@ -263,19 +429,20 @@ class Relation:
         ret = []  # type: List[str]
         with self.get_files().get_osm_streets_stream("r") as sock:
             ret += util.get_nth_column(sock, 1)
-        if os.path.exists(self.get_files().get_osm_housenumbers_path()):
+        if self.get_files().exists(self.get_files().get_osm_housenumbers_path()):
             with self.get_files().get_osm_housenumbers_stream("r") as sock:
                 ret += util.get_nth_column(sock, 1)
         return sorted(set(ret))
 
-    def get_osm_streets_query(self) -> str:
-        """Produces a query which lists streets in relation."""
-        with open(os.path.join(self.__datadir, "streets-template.txt")) as stream:
-            return util.process_template(stream.read(), self.get_config().get_osmrelation())
+    def __get_osm_housenumbers_index(self) -> Dict[str, List[util.HouseNumber]]:
+        """Gets the OSM house number list of all streets, parsing the file in a single pass. The
+        result is cached till the file is not modified."""
+        mtime = self.get_files().get_storage().getmtime(self.get_files().get_osm_housenumbers_path())
+        if mtime == self.__osm_housenumbers_mtime:
+            return self.__osm_housenumbers
 
-    def get_osm_housenumbers(self, street_name: str) -> List[util.HouseNumber]:
-        """Gets the OSM house number list of a street."""
-        house_numbers = []  # type: List[util.HouseNumber]
+        # Street name -> raw house numbers, so each street is normalized in one batch.
+        raw_house_numbers = {}  # type: Dict[str, List[str]]
         with self.get_files().get_osm_housenumbers_stream(mode="r") as sock:
             first = True
             for line in sock.readlines():
@@ -285,10 +452,21 @@ class Relation:
                 tokens = line.strip().split('\t')
                 if len(tokens) < 3:
                     continue
-                if tokens[1] != street_name:
-                    continue
-                house_numbers += normalize(self, tokens[2], street_name, self.get_street_ranges())
-        return util.sort_numerically(set(house_numbers))
+                raw_house_numbers.setdefault(tokens[1], []).append(tokens[2])
+        street_ranges = self.get_street_ranges()
+        self.__osm_housenumbers = {
+            street_name: util.sort_numerically(set(normalize_many(self, value, street_name, street_ranges)))
+            for street_name, value in raw_house_numbers.items()
+        }
+        self.__osm_housenumbers_mtime = mtime
+        return self.__osm_housenumbers
+
+    def get_osm_housenumbers(self, street_name: str) -> List[util.HouseNumber]:
+        """Gets the OSM house number list of a street."""
+        house_numbers = self.__get_osm_housenumbers_index()
+        if street_name not in house_numbers:
+            return []
+        return list(house_numbers[street_name])
 
     def build_ref_streets(self, reference: Dict[str, Dict[str, List[str]]]) -> List[str]:
         """
@@ -321,7 +499,7 @@ class Relation:
 
     def build_ref_housenumbers(
             self,
-            reference: Dict[str, Dict[str, Dict[str, List[str]]]],
+            reference: refcache.ReferenceCache,
             street: str,
             suffix: str
     ) -> List[str]:
@@ -333,15 +511,8 @@ class Relation:
         street = self.get_ref_street_from_osm_street(street)
         ret = []  # type: List[str]
         for reftelepules in self.get_config().get_street_reftelepules(street):
-            if refmegye not in reference.keys():
-                continue
-            refmegye_dict = reference[refmegye]
-            if reftelepules not in refmegye_dict.keys():
-                continue
-            reftelepules_dict = refmegye_dict[reftelepules]
-            if street in reftelepules_dict.keys():
-                house_numbers = reference[refmegye][reftelepules][street]
-                ret += [street + " " + i + suffix for i in house_numbers]
+            house_numbers = reference.get_house_numbers(refmegye, reftelepules, street)
+            ret += [street + " " + i + suffix for i in house_numbers]
 
         return ret
 
@@ -353,59 +524,54 @@ class Relation:
 
         return "*"
 
-    def write_ref_housenumbers(self, references: List[str]) -> None:
+    def write_ref_housenumbers(self, references: List[str], refmegyes: Optional[List[str]] = None) -> None:
         """
         Writes known house numbers (not their coordinates) from a reference, based on street names
         from OSM. Uses build_reference_cache() to build an indexed reference, the result will be
-        used by __get_ref_housenumbers().
+        used by __get_ref_housenumbers(). refmegyes limits the indexed reference to the refmegyes
+        which are in use, see Relations.get_refmegyes().
         """
         # Convert relative paths to absolute ones.
         references = [util.get_abspath(reference) for reference in references]
 
-        memory_caches = util.build_reference_caches(references)
+        reference_caches = util.build_reference_caches(references, refmegyes)
 
         streets = self.get_osm_streets()
 
         lst = []  # type: List[str]
         for street in streets:
-            for index, memory_cache in enumerate(memory_caches):
+            for index, reference_cache in enumerate(reference_caches):
                 suffix = Relation.__get_ref_suffix(index)
-                lst += self.build_ref_housenumbers(memory_cache, street, suffix)
+                lst += self.build_ref_housenumbers(reference_cache, street, suffix)
 
-        lst = sorted(set(lst))
-        with self.get_files().get_ref_housenumbers_stream("w") as sock:
-            for line in lst:
-                sock.write(line + "\n")
+        self.get_files().write_ref_housenumbers(sorted(set(lst)))
 
     def __get_ref_housenumbers(self) -> Dict[str, List[util.HouseNumber]]:
         """Gets house numbers from reference, produced by write_ref_housenumbers()."""
         ret = {}  # type: Dict[str, List[util.HouseNumber]]
-        lines = []  # type: List[str]
-        with self.get_files().get_ref_housenumbers_stream("r") as sock:
-            for line in sock.readlines():
-                line = line.strip()
-                lines.append(line)
+        osm_street_names = self.get_osm_streets()
+        ref_street_names = sorted({self.get_ref_street_from_osm_street(i) for i in osm_street_names})
+        lines = self.get_files().get_storage().get_lines(self.get_files().get_ref_housenumbers_path(), ref_street_names,
+                                                         util.get_ref_housenumbers_streets)
         street_ranges = self.get_street_ranges()
         streets_invalid = self.get_street_invalid()
-        for osm_street_name in self.get_osm_streets():
-            house_numbers = []  # type: List[util.HouseNumber]
+        for osm_street_name in osm_street_names:
+            raw_house_numbers = []  # type: List[str]
             ref_street_name = self.get_ref_street_from_osm_street(osm_street_name)
             prefix = ref_street_name + " "
             street_invalid = []  # type: List[str]
             if osm_street_name in streets_invalid.keys():
                 street_invalid = streets_invalid[osm_street_name]
-            for line in lines:
-                if line.startswith(prefix):
-                    house_number = line.replace(prefix, '')
-                    if util.HouseNumber.is_invalid(house_number, street_invalid):
-                        continue
-                    house_numbers += normalize(self, house_number, osm_street_name, street_ranges)
+            for line in lines.get(ref_street_name, []):
+                house_number = line.replace(prefix, '')
+                if util.HouseNumber.is_invalid(house_number, street_invalid):
+                    continue
+                raw_house_numbers.append(house_number)
+            house_numbers = normalize_many(self, raw_house_numbers, osm_street_name, street_ranges)
             ret[osm_street_name] = util.sort_numerically(set(house_numbers))
         return ret
 
-    def get_missing_housenumbers(
-            self
-    ) -> Tuple[List[Tuple[str, List[util.HouseNumber]]], List[Tuple[str, List[util.HouseNumber]]]]:
+    def get_missing_housenumbers(self) -> Tuple[StreetHouseNumbers, StreetHouseNumbers]:
         """
         Compares ref and osm house numbers, prints the ones which are in ref, but not in osm.
         Return value is a pair of ongoing and done streets.
@@ -419,8 +585,7 @@ class Relation:
         for street_name in street_names:
             ref_house_numbers = all_ref_house_numbers[street_name]
             osm_house_numbers = self.get_osm_housenumbers(street_name)
-            only_in_reference = get_only_in_first(ref_house_numbers, osm_house_numbers)
-            in_both = get_in_both(ref_house_numbers, osm_house_numbers)
+            only_in_reference, in_both = get_only_in_first_and_in_both(ref_house_numbers, osm_house_numbers)
             if only_in_reference:
                 ongoing_streets.append((street_name, only_in_reference))
             if in_both:
@@ -430,13 +595,11 @@ class Relation:
 
         return ongoing_streets, done_streets
 
-    def write_missing_housenumbers(self) -> Tuple[int, int, int, str, List[List[yattag.Doc]]]:
-        """
-        Calculate a write stat for the house number coverage of a relation.
-        Returns a tuple of: todo street count, todo count, done count, percent and table.
-        """
-        ongoing_streets, done_streets = self.get_missing_housenumbers()
-
+    def format_missing_housenumbers(
+            self, ongoing_streets: StreetHouseNumbers, done_streets: StreetHouseNumbers
+    ) -> Tuple[int, int, int, str, List[List[yattag.Doc]]]:
+        """Builds the table and the counts of the result of get_missing_housenumbers(): todo street
+        count, todo count, done count, percent and table."""
         todo_count = 0
         table = []
         table.append([util.html_escape(_("Street name")),
@@ -470,10 +633,6 @@ class Relation:
         else:
             percent = "100.00"
 
-        # Write the bottom line to a file, so the index page show it fast.
-        with self.get_files().get_housenumbers_percent_stream("w") as stream:
-            stream.write(percent)
-
         return len(ongoing_streets), todo_count, done_count, percent, table
 
     def get_missing_streets(self) -> Tuple[List[str], List[str]]:
@@ -482,9 +641,8 @@ class Relation:
         street_blacklist = self.get_config().get_street_filters()
         osm_streets = [self.get_ref_street_from_osm_street(street) for street in self.get_osm_streets()]
 
-        only_in_reference = get_only_in_first(reference_streets, osm_streets)
+        only_in_reference, in_both = get_only_in_first_and_in_both(reference_streets, osm_streets)
         only_in_reference = [i for i in only_in_reference if i not in street_blacklist]
-        in_both = get_in_both(reference_streets, osm_streets)
 
         return only_in_reference, in_both
 
@@ -507,36 +665,75 @@ class Relation:
 
         return todo_count, done_count, percent, streets
 
-    def get_osm_housenumbers_query(self) -> str:
-        """Produces a query which lists house numbers in relation."""
-        with open(os.path.join(self.__datadir, "street-housenumbers-template.txt")) as stream:
-            return util.process_template(stream.read(), self.get_config().get_osmrelation())
+
+class RefNames:
+    """The UI names of the refmegye and reftelepules codes of the reference data."""
+    def __init__(self, datadir: str) -> None:
+        self.__refmegye_names = util.YAML_CACHE.load(os.path.join(datadir, "refmegye-names.yaml"))
+        self.__reftelepules_names = util.YAML_CACHE.load(os.path.join(datadir, "reftelepules-names.yaml"))
+
+    def refmegye_get_name(self, refmegye: str) -> str:
+        """Produces a UI name for a refmegye."""
+        if refmegye in self.__refmegye_names:
+            return cast(str, self.__refmegye_names[refmegye])
+
+        return ""
+
+    def refmegye_get_reftelepules_ids(self, refmegye_name: str) -> List[str]:
+        """Produces reftelepules IDs of a refmegye."""
+        if refmegye_name not in self.__reftelepules_names:
+            return []
+
+        refmegye = self.__reftelepules_names[refmegye_name]
+        return list(refmegye.keys())
+
+    def reftelepules_get_name(self, refmegye_name: str, reftelepules: str) -> str:
+        """Produces a UI name for a reftelepules in refmegye."""
+        if refmegye_name not in self.__reftelepules_names:
+            return ""
+
+        refmegye = self.__reftelepules_names[refmegye_name]
+        if reftelepules not in refmegye:
+            return ""
+
+        return cast(str, refmegye[reftelepules])
 
 
 class Relations:
     """A relations object is a container of named relation objects."""
-    def __init__(self, datadir: str, workdir: str) -> None:
+    def __init__(self, datadir: str, workdir: str, storage_name: str = "") -> None:
         self.__datadir = datadir
         self.__workdir = workdir
-        with open(os.path.join(datadir, "relations.yaml")) as sock:
-            self.__dict = yaml.load(sock)
+        self.__storage = storage.get_storage(storage_name, workdir)
+        # Copy, get_relation() may add new relations.
+        self.__dict = dict(util.YAML_CACHE.load(os.path.join(datadir, "relations.yaml")))
         self.__relations = {}  # type: Dict[str, Relation]
         self.__activate_all = False
-        with open(os.path.join(datadir, "refmegye-names.yaml")) as stream:
-            self.__refmegye_names = yaml.load(stream)
-        with open(os.path.join(datadir, "reftelepules-names.yaml")) as stream:
-            self.__reftelepules_names = yaml.load(stream)
+        self.__ref_names = RefNames(datadir)
 
     def get_workdir(self) -> str:
         """Gets the workdir directory path."""
         return self.__workdir
 
+    def get_datadir(self) -> str:
+        """Gets the datadir directory path."""
+        return self.__datadir
+
+    def get_storage_name(self) -> str:
+        """Gets the name of the storage backend."""
+        return self.__storage.get_name()
+
+    def get_storage(self) -> storage.FileStorage:
+        """Gets the storage backend of the files in the workdir."""
+        return self.__storage
+
     def get_relation(self, name: str) -> Relation:
         """Gets the relation that has the specified name."""
         if name not in self.__relations.keys():
             if name not in self.__dict.keys():
                 self.__dict[name] = {}
-            self.__relations[name] = Relation(self.__datadir, self.__workdir, name, self.__dict[name])
+            self.__relations[name] = Relation(self.__datadir, self.__workdir, name, self.__dict[name],
+                                              self.__storage)
         return self.__relations[name]
 
     def get_names(self) -> List[str]:
@@ -558,98 +755,59 @@ class Relations:
             ret.append(self.get_relation(name))
         return ret
 
+    def get_refmegyes(self) -> List[str]:
+        """Gets a sorted list of refmegyes used by at least one relation."""
+        return sorted({i["refmegye"] for i in self.__dict.values() if "refmegye" in i})
+
     def activate_all(self, flag: bool) -> None:
         """Sets if inactive=true is ignored or not."""
         self.__activate_all = flag
 
     def refmegye_get_name(self, refmegye: str) -> str:
         """Produces a UI name for a refmegye."""
-        if refmegye in self.__refmegye_names:
-            return cast(str, self.__refmegye_names[refmegye])
-
-        return ""
+        return self.__ref_names.refmegye_get_name(refmegye)
 
     def refmegye_get_reftelepules_ids(self, refmegye_name: str) -> List[str]:
         """Produces reftelepules IDs of a refmegye."""
-        if refmegye_name not in self.__reftelepules_names:
-            return []
-
-        refmegye = self.__reftelepules_names[refmegye_name]
-        return list(refmegye.keys())
+        return self.__ref_names.refmegye_get_reftelepules_ids(refmegye_name)
 
     def reftelepules_get_name(self, refmegye_name: str, reftelepules: str) -> str:
         """Produces a UI name for a reftelepules in refmegye."""
-        if refmegye_name not in self.__reftelepules_names:
-            return ""
+        return self.__ref_names.reftelepules_get_name(refmegye_name, reftelepules)
 
-        refmegye = self.__reftelepules_names[refmegye_name]
-        if reftelepules not in refmegye:
-            return ""
-
-        return cast(str, refmegye[reftelepules])
 
+def strip_ignored_suffix(house_number: str) -> str:
+    """Strips the suffix of a house number that is ignored during comparison."""
+    if house_number.endswith("*"):
+        return house_number[:-1]
+    return house_number
 
-def sort_streets_csv(data: str) -> str:
-    """
-    Sorts TSV Overpass street name result with visual partitioning.
-
-    See split_street_line for sorting rules.
-    """
-    return util.process_csv_body(sort_streets, data)
-
-
-def sort_streets(lines: Iterable[str]) -> List[str]:
-    """
-    Sorts the body of a TSV Overpass street name result with visual partitioning.
 
-    See split_street_line for sorting rules.
+def get_only_in_first_and_in_both(first: List[Any], second: List[Any]) -> Tuple[List[Any], List[Any]]:
     """
-    return sorted(lines, key=util.split_street_line)
-
-
-def sort_housenumbers_csv(data: str) -> str:
-    """
-    Sorts TSV Overpass house numbers result with visual partitioning.
-
-    See split_housenumber_line for sorting rules.
-    """
-    return util.process_csv_body(sort_housenumbers, data)
-
-
-def sort_housenumbers(lines: Iterable[str]) -> List[str]:
-    """
-    Sorts the body of a TSV Overpass house numbers result with visual partitioning.
-
-    See split_housenumber_line for sorting rules.
-    """
-    return sorted(lines, key=split_housenumber_line)
-
-
-def split_housenumber_line(line: str) -> Tuple[str, bool, bool, str, Tuple[int, str], str,
-                                               Tuple[int, str], Iterable[str], Tuple[int, str]]:
-    """
-    Augment TSV Overpass house numbers result lines to aid sorting.
-
-    It prepends two bools to indicate whether an entry is missing either a house number, a house name
-    or a conscription number.
-    Entries lacking either a house number or all of the above IDs come first.
-    The following fields are interpreted numerically: oid, house number, conscription number.
+    Returns a pair of items which are in first, but not in second; and items which are in both
+    first and second. Order of first is kept.
+    Any means util.HouseNumber or str.
     """
-    field = line.split('\t')
+    only_in_first = []  # type: List[Any]
+    in_both = []  # type: List[Any]
+    if not first:
+        return only_in_first, in_both
 
-    oid = util.get_array_nth(field, 0)
-    street = util.get_array_nth(field, 1)
-    housenumber = util.get_array_nth(field, 2)
-    postcode = util.get_array_nth(field, 3)
-    housename = util.get_array_nth(field, 4)
-    cons = util.get_array_nth(field, 5)
-    tail = field[6:] if len(field) > 6 else []
+    # Strip suffix that is ignored.
+    if isinstance(first[0], util.HouseNumber):
+        first_stripped = [strip_ignored_suffix(i.get_number()) for i in first]
+        second_stripped = {strip_ignored_suffix(i.get_number()) for i in second}
+    else:
+        first_stripped = [strip_ignored_suffix(i) for i in first]
+        second_stripped = {strip_ignored_suffix(i) for i in second}
 
-    have_housenumber = housenumber != ''
-    have_houseid = have_housenumber or housename != '' or cons != ''
-    return (postcode, have_houseid, have_housenumber, street,
-            util.split_house_number(housenumber),
-            housename, util.split_house_number(cons), tail, util.split_house_number(oid))
+    for index, item in enumerate(first_stripped):
+        if item in second_stripped:
+            in_both.append(first[index])
+        else:
+            only_in_first.append(first[index])
+    return only_in_first, in_both
 
 
 def get_only_in_first(first: List[Any], second: List[Any]) -> List[Any]:
@@ -657,22 +815,7 @@ def get_only_in_first(first: List[Any], second: List[Any]) -> List[Any]:
     Returns items which are in first, but not in second.
     Any means util.HouseNumber or str.
     """
-    # Strip suffix that is ignored.
-    if not first:
-        return []
-
-    if isinstance(first[0], util.HouseNumber):
-        first_stripped = [re.sub(r"\*$", "", i.get_number()) for i in first]
-        second_stripped = [re.sub(r"\*$", "", i.get_number()) for i in second]
-    else:
-        first_stripped = [re.sub(r"\*$", "", i) for i in first]
-        second_stripped = [re.sub(r"\*$", "", i) for i in second]
-
-    ret = []
-    for index, item in enumerate(first_stripped):
-        if item not in second_stripped:
-            ret.append(first[index])
-    return ret
+    return get_only_in_first_and_in_both(first, second)[0]
 
 
 def get_in_both(first: List[Any], second: List[Any]) -> List[Any]:
@@ -680,22 +823,7 @@ def get_in_both(first: List[Any], second: List[Any]) -> List[Any]:
     Returns items which are in both first and second.
     Any means util.HouseNumber or str.
     """
-    # Strip suffix that is ignored.
-    if not first:
-        return []
-
-    if isinstance(first[0], util.HouseNumber):
-        first_stripped = [re.sub(r"\*$", "", i.get_number()) for i in first]
-        second_stripped = [re.sub(r"\*$", "", i.get_number()) for i in second]
-    else:
-        first_stripped = [re.sub(r"\*$", "", i) for i in first]
-        second_stripped = [re.sub(r"\*$", "", i) for i in second]
-
-    ret = []
-    for index, item in enumerate(first_stripped):
-        if item in second_stripped:
-            ret.append(first[index])
-    return ret
+    return get_only_in_first_and_in_both(first, second)[1]
 
 
 def get_workdir(config: configparser.ConfigParser) -> str:
@@ -703,6 +831,11 @@ def get_workdir(config: configparser.ConfigParser) -> str:
     return util.get_abspath(config.get('wsgi', 'workdir').strip())
 
 
+def get_storage_name(config: configparser.ConfigParser) -> str:
+    """Gets the name of the storage backend of the workdir, empty for the default one."""
+    return config.get('wsgi', 'storage', fallback='').strip()
+
+
 def get_content(workdir: str, path: str = "") -> str:
     """Gets the content of a file in workdir."""
     ret = ""
@@ -715,10 +848,47 @@ def get_content(workdir: str, path: str = "") -> str:
     return ret
 
 
+# Default sanity checks of normalize(), for streets without a custom filter.
+DEFAULT_NORMALIZER = ranges.Ranges([ranges.Range(1, 999), ranges.Range(2, 998)])
+
+# Keeps the leading number of a house number (and what's before it).
+HOUSE_NUMBER_PREFIX = re.compile(r"([0-9]+).*")
+
+
 def normalize(relation: Relation, house_numbers: str, street_name: str,
               normalizers: Dict[str, ranges.Ranges]) -> List[util.HouseNumber]:
     """Strips down string input to bare minimum that can be interpreted as an
     actual number. Think about a/b, a-b, and so on."""
+    return normalize_many(relation, [house_numbers], street_name, normalizers)
+
+
+def normalize_many(relation: Relation, house_numbers_list: List[str], street_name: str,
+                   normalizers: Dict[str, ranges.Ranges]) -> List[util.HouseNumber]:
+    """Same as calling normalize() for each item of house_numbers_list and concatenating the
+    results, but the config of the street is only looked up once."""
+    if street_name in normalizers.keys():
+        # Have a custom filter.
+        normalizer = normalizers[street_name]
+    else:
+        normalizer = DEFAULT_NORMALIZER
+    contains = normalizer.__contains__
+
+    street_is_even_odd = relation.get_config().get_street_is_even_odd(street_name)
+    ret = []  # type: List[util.HouseNumber]
+    for house_numbers in house_numbers_list:
+        # Determine suffix which is not normalized away.
+        suffix = ""
+        if house_numbers.endswith("*"):
+            suffix = house_numbers[-1]
+
+        ret += [util.HouseNumber(str(number) + suffix, house_numbers)
+                for number in get_normalized_numbers(house_numbers, contains, street_is_even_odd)]
+    return ret
+
+
+def get_normalized_numbers(house_numbers: str, contains: Callable[[int], bool], street_is_even_odd: bool) -> List[int]:
+    """Parses and filters the numbers of a single house number string for normalize_many(),
+    contains() decides if a number passes the filter."""
     ret_numbers = []
     # Same as ret_numbers, but if the range is 2-6 and we filter for 2-4, then 6 would be lost, so
     # in-range 4 would not be detected, so this one does not drop 6.
@@ -728,47 +898,37 @@ def normalize(relation: Relation, house_numbers: str, street_name: str,
     else:
         separator = '-'
 
-    # Determine suffix which is not normalized away.
-    suffix = ""
-    if house_numbers.endswith("*"):
-        suffix = house_numbers[-1]
-
-    if street_name in normalizers.keys():
-        # Have a custom filter.
-        normalizer = normalizers[street_name]
-    else:
-        # Default sanity checks.
-        default = [ranges.Range(1, 999), ranges.Range(2, 998)]
-        normalizer = ranges.Ranges(default)
-
     for house_number in house_numbers.split(separator):
-        try:
-            number = int(re.sub(r"([0-9]+).*", r"\1", house_number))
-        except ValueError:
-            continue
+        if house_number and not house_number.strip("0123456789"):
+            # Fast path: only ASCII digits.
+            number = int(house_number)
+        else:
+            try:
+                number = int(HOUSE_NUMBER_PREFIX.sub(r"\1", house_number))
+            except ValueError:
+                continue
 
         ret_numbers_nofilter.append(number)
 
-        if number not in normalizer:
+        if not contains(number):
             continue
 
         ret_numbers.append(number)
 
-    street_is_even_odd = relation.get_config().get_street_is_even_odd(street_name)
     if separator == "-" and util.should_expand_range(ret_numbers_nofilter, street_is_even_odd):
         start = ret_numbers_nofilter[0]
         stop = ret_numbers_nofilter[1]
         if stop == 0:
-            ret_numbers = [number for number in [start] if number in normalizer]
+            ret_numbers = [number for number in [start] if contains(number)]
         elif street_is_even_odd:
             # Assume that e.g. 2-6 actually means 2, 4 and 6, not only 2 and 4.
             # Closed interval, even only or odd only case.
-            ret_numbers = [number for number in range(start, stop + 2, 2) if number in normalizer]
+            ret_numbers = [number for number in range(start, stop + 2, 2) if contains(number)]
         else:
             # Closed interval, but mixed even and odd.
-            ret_numbers = [number for number in range(start, stop + 1, 1) if number in normalizer]
+            ret_numbers = [number for number in range(start, stop + 1, 1) if contains(number)]
 
-    return [util.HouseNumber(str(number) + suffix, house_numbers) for number in ret_numbers]
+    return ret_numbers
 
 
 def make_turbo_query_for_streets(relation: Relation, table: List[List[yattag.Doc]]) -> str:
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+#
+# Copyright 2019 Miklos Vajna. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+#
+
+"""Shows missing house number counts across all relations, based on the stats index of cron."""
+
+import sys
+import configparser
+import helpers
+import stats
+import util
+
+# Number of streets or relations shown by default.
+DEFAULT_COUNT = 20
+
+
+def main() -> None:
+    """Commandline interface."""
+    config = configparser.ConfigParser()
+    config_path = util.get_abspath("wsgi.ini")
+    config.read(config_path)
+    workdir = helpers.get_workdir(config)
+    datadir = util.get_abspath("data")
+
+    # top-streets, relations or refmegyes.
+    query = sys.argv[1]
+    count = DEFAULT_COUNT
+    if len(sys.argv) > 2:
+        count = int(sys.argv[2])
+
+    relations = helpers.Relations(datadir, workdir, helpers.get_storage_name(config))
+    if query == "top-streets":
+        for relation_name, street, missing_count in stats.get_top_missing_streets(relations, count):
+            print("%s\t%s\t%s" % (relation_name, street, missing_count))
+    elif query == "relations":
+        for relation_name, missing_count, existing_count in stats.get_relation_missing_housenumbers(relations, count):
+            print("%s\t%s\t%s" % (relation_name, missing_count, existing_count))
+    elif query == "refmegyes":
+        for refmegye, missing_count, existing_count in stats.get_refmegye_missing_housenumbers(relations):
+            print("%s\t%s\t%s\t%s" % (refmegye, relations.refmegye_get_name(refmegye), missing_count, existing_count))
+    else:
+        sys.exit("usage: housenumber_stats.py top-streets|relations|refmegyes [count]")
+
+
+if __name__ == '__main__':
+    main()
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab:
@@ -7,28 +7,245 @@
 
 """The overpass_query module allows getting data out of the OSM DB without a full download."""
 
-import urllib.request
+from typing import BinaryIO
+from typing import Dict
+from typing import Iterator
+from typing import Optional
+from typing import TextIO
+from typing import Tuple
+from typing import cast
+import contextlib
+import http.client
+import io
+import json
+import threading
 import urllib.error
+import urllib.parse
 import re
 import sys
+import tempfile
+import zlib
+
+import settings
+
+# Can be overwritten with the overpass_endpoint key in wsgi.ini.
+DEFAULT_ENDPOINT = "https://overpass-api.de/api/"
+# In seconds, overpass_connect_timeout and overpass_read_timeout in wsgi.ini. Queries may run for
+# [timeout:425] seconds on the server.
+DEFAULT_CONNECT_TIMEOUT = 30.0
+DEFAULT_READ_TIMEOUT = 600.0
+# Responses are read and decoded in chunks of this size.
+CHUNK_SIZE = 64 * 1024
+
+
+def get_endpoint() -> str:
+    """Gets the base URL of the overpass API, ending with a slash."""
+    config = settings.get_config()
+    if config.has_option("wsgi", "overpass_endpoint"):
+        return config.get("wsgi", "overpass_endpoint").strip().rstrip("/") + "/"
+    return DEFAULT_ENDPOINT
+
+
+def get_timeouts() -> Tuple[float, float]:
+    """Gets the connect and read timeouts of overpass requests."""
+    config = settings.get_config()
+    connect_timeout = DEFAULT_CONNECT_TIMEOUT
+    if config.has_option("wsgi", "overpass_connect_timeout"):
+        connect_timeout = config.getfloat("wsgi", "overpass_connect_timeout")
+    read_timeout = DEFAULT_READ_TIMEOUT
+    if config.has_option("wsgi", "overpass_read_timeout"):
+        read_timeout = config.getfloat("wsgi", "overpass_read_timeout")
+    return connect_timeout, read_timeout
+
+
+class BodyDecoder:
+    """Decodes a response body based on its Content-Encoding, chunk by chunk."""
+    def __init__(self, encoding: str) -> None:
+        self.__compressed = encoding in ("gzip", "deflate")
+        self.__gzip = encoding == "gzip"
+        # Deflate input is kept until it's known if it has a zlib wrapper.
+        self.__started = encoding != "deflate"
+        self.__pending = b""
+        self.__decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def decode(self, chunk: bytes) -> bytes:
+        """Decodes the next chunk of the body."""
+        if not self.__compressed:
+            return chunk
+        if not self.__started:
+            self.__pending += chunk
+            if len(self.__pending) < 2:
+                return b""
+            # Some servers send a raw deflate stream, without the zlib wrapper.
+            wbits = -zlib.MAX_WBITS
+            if self.__pending[0] & 0x0f == 8 and int.from_bytes(self.__pending[:2], "big") % 31 == 0:
+                wbits = zlib.MAX_WBITS
+            self.__decompressor = zlib.decompressobj(wbits)
+            self.__started = True
+            chunk = self.__pending
+        ret = self.__decompressor.decompress(chunk)
+        while self.__decompressor.eof and self.__decompressor.unused_data:
+            if not self.__gzip:
+                raise ValueError("unexpected data after the end of the deflate body")
+            # A gzip body may have several members, decode them one after the other.
+            chunk = self.__decompressor.unused_data
+            self.__decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            ret += self.__decompressor.decompress(chunk)
+        return ret
+
+    def flush(self) -> bytes:
+        """Decodes the rest of the body, raises http.client.IncompleteRead if it's truncated."""
+        if not self.__compressed or (not self.__started and not self.__pending):
+            return b""
+        buf = b""
+        if self.__started:
+            buf = self.__decompressor.flush()
+        if not self.__decompressor.eof:
+            raise http.client.IncompleteRead(buf)
+        return buf
+
+
+def decode_body(body: bytes, encoding: str) -> bytes:
+    """Decodes a response body based on its Content-Encoding."""
+    decoder = BodyDecoder(encoding)
+    return decoder.decode(body) + decoder.flush()
+
+
+class ConnectionPool:
+    """
+    A connection pool keeps one keep-alive connection per thread and host, so repeated queries and
+    status polls don't pay the TCP and TLS setup again.
+    """
+    def __init__(self) -> None:
+        self.__local = threading.local()
+
+    def __get_connections(self) -> Dict[Tuple[str, str], http.client.HTTPConnection]:
+        """Gets the connections of the current thread."""
+        if not hasattr(self.__local, "connections"):
+            self.__local.connections = {}
+        return cast(Dict[Tuple[str, str], http.client.HTTPConnection], self.__local.connections)
+
+    def __connect(self, scheme: str, netloc: str) -> http.client.HTTPConnection:
+        """Opens a new connection with the configured timeouts."""
+        connect_timeout, read_timeout = get_timeouts()
+        if scheme == "http":
+            connection = http.client.HTTPConnection(netloc, timeout=connect_timeout)
+        else:
+            connection = http.client.HTTPSConnection(netloc, timeout=connect_timeout)
+        connection.connect()
+        # Reading the result of a slow query may take longer than connecting.
+        connection.sock.settimeout(read_timeout)
+        return connection
+
+    def request(self, url: str, data: Optional[bytes] = None) -> bytes:
+        """Sends a GET (or a POST, if data is provided) request, returns the decoded response body.
+        Raises urllib.error.HTTPError on an error status, like urllib.request.urlopen()."""
+        stream = io.BytesIO()
+        self.download(url, data, stream)
+        return stream.getvalue()
+
+    def download(self, url: str, data: Optional[bytes], stream: BinaryIO) -> None:
+        """Like request(), but writes the decoded response body to stream in chunks of CHUNK_SIZE,
+        so the body is never in memory as a whole."""
+        parts = urllib.parse.urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path
+        if parts.query:
+            path += "?" + parts.query
+        headers = {"Accept-Encoding": "gzip, deflate"}
+        method = "GET"
+        if data is not None:
+            method = "POST"
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+
+        connections = self.__get_connections()
+        reused = key in connections
+        if not reused:
+            connections[key] = self.__connect(*key)
+        try:
+            connections[key].request(method, path, body=data, headers=headers)
+            response = connections[key].getresponse()
+        except (OSError, http.client.HTTPException) as error:
+            connections.pop(key).close()
+            if not reused or not isinstance(error, (ConnectionResetError, BrokenPipeError)):
+                raise
+            # The server closed the idle connection, try again with a new one.
+            self.download(url, data, stream)
+            return
+
+        try:
+            if response.status >= 400:
+                response.read()
+            else:
+                self.__read_body(response, stream)
+        except (OSError, http.client.HTTPException):
+            connections.pop(key).close()
+            raise
+        if response.will_close:
+            connections.pop(key).close()
+
+        if response.status >= 400:
+            raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, None)
+
+    @staticmethod
+    def __read_body(response: http.client.HTTPResponse, stream: BinaryIO) -> None:
+        """Reads and decodes the body of a successful response, chunk by chunk."""
+        decoder = BodyDecoder(response.getheader("Content-Encoding", ""))
+        while True:
+            chunk = response.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            stream.write(decoder.decode(chunk))
+        if response.length:
+            # The server closed the connection before sending the whole body.
+            raise http.client.IncompleteRead(b"", response.length)
+        stream.write(decoder.flush())
+
+
+# Shared by all overpass requests of this process.
+CONNECTION_POOL = ConnectionPool()
+
+
+def urlopen(url: str, data: Optional[bytes] = None) -> BinaryIO:
+    """Opens an URL using CONNECTION_POOL, returns the response as a stream."""
+    return io.BytesIO(CONNECTION_POOL.request(url, data))
 
 
 def overpass_query(query: str) -> str:
     """Posts the query string to the overpass API and returns the result string."""
-    url = "http://overpass-api.de/api/interpreter"
-
-    sock = urllib.request.urlopen(url, bytes(query, "utf-8"))
+    sock = urlopen(get_endpoint() + "interpreter", bytes(query, "utf-8"))
     buf = sock.read()
     sock.close()
 
     return buf.decode('utf-8')
 
 
+def overpass_query_stream(query: str, stream: BinaryIO) -> None:
+    """Posts the query string to the overpass API and writes the result to stream as it arrives."""
+    CONNECTION_POOL.download(get_endpoint() + "interpreter", bytes(query, "utf-8"), stream)
+
+
+@contextlib.contextmanager
+def overpass_query_file(query: str) -> Iterator[TextIO]:
+    """Posts the query string to the overpass API, downloads the result to a temporary file and
+    yields it as a text stream. Nothing is yielded if the download fails, so a partial result never
+    replaces a good one."""
+    with tempfile.TemporaryFile() as stream:
+        overpass_query_stream(query, cast(BinaryIO, stream))
+        stream.seek(0)
+        yield io.TextIOWrapper(cast(BinaryIO, stream), encoding="utf-8", newline="\n")
+
+
+def overpass_query_status() -> str:
+    """Gets the status page of the overpass API, which describes the rate limit of this client."""
+    with urlopen(get_endpoint() + "status") as sock:
+        buf = sock.read()
+    return buf.decode('utf-8')
+
+
 def overpass_query_need_sleep() -> int:
     """Checks if we need to sleep before executing an overpass query."""
-    with urllib.request.urlopen("https://overpass-api.de/api/status") as sock:
-        buf = sock.read()
-    status = buf.decode('utf-8')
+    status = overpass_query_status()
     sleep = 0
     available = False
     for line in status.splitlines():
@@ -45,6 +262,40 @@ def overpass_query_need_sleep() -> int:
     return sleep
 
 
+def overpass_query_slots() -> Tuple[int, int]:
+    """Checks how many overpass queries may run in parallel, and how many of them can be started
+    now."""
+    status = overpass_query_status()
+    rate_limit = 1
+    available = 0
+    for line in status.splitlines():
+        match = re.match(r"^Rate limit: (\d+)", line)
+        if match:
+            rate_limit = int(match.group(1))
+            continue
+        match = re.match(r"^(\d+) slots? available now", line)
+        if match:
+            available = int(match.group(1))
+    return rate_limit, available
+
+
+def parse_osm_changes(data: str) -> Optional[Tuple[str, int, int]]:
+    """
+    Parses the JSON Overpass result of osm-changes-template.txt into the timestamp of the overpass
+    database, the count of all elements and the count of changed elements. Returns None if the
+    result is not complete, e.g. it only has a remark about a runtime error.
+    """
+    try:
+        result = json.loads(data)
+        timestamp = result["osm3s"]["timestamp_osm_base"]
+        counts = [int(element["tags"]["total"]) for element in result["elements"]]
+        if not isinstance(timestamp, str) or len(counts) != 2:
+            return None
+        return timestamp, counts[0], counts[1]
+    except (ValueError, TypeError, KeyError):
+        return None
+
+
 def main() -> None:
     """Commandline interface to this module."""
     sock = open(sys.argv[1])
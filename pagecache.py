@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2019 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""The pagecache module caches rendered pages and handles HTTP conditional requests for them."""
+
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Hashable
+from typing import List
+from typing import Optional
+from typing import Tuple
+import collections
+import email.utils
+import hashlib
+import math
+import os
+import threading
+
+# Rendered pages are typically 10-500 KB.
+DEFAULT_MAX_SIZE = 64
+
+
+def get_stamp(paths: List[str], getmtime: Callable[[str], float] = os.path.getmtime) -> Tuple[Optional[float], ...]:
+    """Gets the modification times of the files a page is rendered from, None for missing files.
+    getmtime() raises FileNotFoundError for missing files, like os.path.getmtime()."""
+    stamp = []  # type: List[Optional[float]]
+    for path in paths:
+        try:
+            stamp.append(getmtime(path))
+        except FileNotFoundError:
+            stamp.append(None)
+    return tuple(stamp)
+
+
+def get_etag(key: Hashable, stamp: Tuple[Optional[float], ...]) -> str:
+    """Gets a strong entity tag for a page, without rendering it."""
+    return '"' + hashlib.sha1(repr((key, stamp)).encode("utf-8")).hexdigest() + '"'
+
+
+def get_last_modified(stamp: Tuple[Optional[float], ...]) -> int:
+    """Gets the modification time of a page, the newest of its existing inputs. HTTP dates have no
+    fractions, it's rounded up, so a page is not older than its inputs."""
+    return int(math.ceil(max((i for i in stamp if i is not None), default=0)))
+
+
+def is_not_modified(environ: Dict[str, Any], etag: str, last_modified: int) -> bool:
+    """Decides if the client's copy of a page is still valid. If-Modified-Since is only honored if
+    there is no If-None-Match or it matches."""
+    if_none_match = environ.get("HTTP_IF_NONE_MATCH")
+    if_modified_since = environ.get("HTTP_IF_MODIFIED_SINCE")
+    if not if_none_match and not if_modified_since:
+        return False
+
+    if if_none_match:
+        tags = [i.strip() for i in if_none_match.split(",")]
+        # Weak comparison is fine for GET.
+        if "*" not in tags and etag not in [i[2:] if i.startswith("W/") else i for i in tags]:
+            return False
+
+    if if_modified_since:
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        return last_modified <= since.timestamp()
+
+    return True
+
+
+class PageCache:
+    """
+    A page cache maps keys (request URI, language, etc.) to rendered pages, an entry is valid while
+    the modification times of the files the page was rendered from are unchanged. Least recently
+    used entries are evicted first.
+    """
+    def __init__(self, max_size: int = DEFAULT_MAX_SIZE) -> None:
+        self.__max_size = max_size
+        self.__entries = collections.OrderedDict()  # type: collections.OrderedDict[Hashable, Tuple[str, str, bytes]]
+        self.__lock = threading.Lock()
+
+    def get(self, key: Hashable, etag: str) -> Optional[Tuple[str, bytes]]:
+        """Gets the content type and the body of a page, if the cached version has the given
+        entity tag."""
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None or entry[0] != etag:
+                return None
+            self.__entries.move_to_end(key)
+            return entry[1], entry[2]
+
+    def put(self, key: Hashable, etag: str, content_type: str, body: bytes) -> None:
+        """Stores a page, possibly evicting the least recently used one."""
+        with self.__lock:
+            self.__entries[key] = (etag, content_type, body)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.__max_size:
+                self.__entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Removes all pages."""
+        with self.__lock:
+            self.__entries.clear()
+
+    def serve(
+            self,
+            environ: Dict[str, Any],
+            key: Hashable,
+            paths: List[str],
+            render: Callable[[], Tuple[str, str]],
+            getmtime: Callable[[str], float] = os.path.getmtime
+    ) -> Tuple[str, List[Tuple[str, str]], bytes]:
+        """
+        Serves a page which is rendered from the files at paths, render() is only called if the
+        page is not in the cache. render() returns a content type and an output string, getmtime()
+        is used to check the files, see get_stamp().
+        Returns a status, response headers and the response body.
+        """
+        stamp = get_stamp(paths, getmtime)
+        etag = get_etag(key, stamp)
+        last_modified = get_last_modified(stamp)
+        headers = [("ETag", etag), ("Last-Modified", email.utils.formatdate(last_modified, usegmt=True))]
+        if is_not_modified(environ, etag, last_modified):
+            return "304 Not Modified", headers, b""
+
+        entry = self.get(key, etag)
+        if entry is None:
+            content_type, output = render()
+            entry = content_type, output.encode("utf-8")
+            # If an input changed while rendering, the next request will render again.
+            self.put(key, etag, entry[0], entry[1])
+        content_type, body = entry
+        headers = [("Content-type", content_type + "; charset=utf-8"), ("Content-Length", str(len(body)))] + headers
+        return "200 OK", headers, body
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab:
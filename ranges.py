@@ -8,7 +8,9 @@
 
 from typing import List
 from typing import Optional
+from typing import Tuple
 from typing import cast
+import bisect
 
 
 class Range:
@@ -53,20 +55,51 @@ class Range:
         return True
 
 
+def compile_intervals(items: List[Range], parity: int) -> Tuple[List[int], List[int]]:
+    """Builds the sorted, merged intervals of the numbers with the given parity (0 or 1) which are
+    in one of items. Both ends of the intervals have the given parity. Returns the list of starts
+    and the list of ends."""
+    intervals = []  # type: List[Tuple[int, int]]
+    for item in items:
+        if item.is_odd() is not None and item.is_odd() != (parity == 1):
+            continue
+        start = item.get_start()
+        if start % 2 != parity:
+            start += 1
+        end = item.get_end()
+        if end % 2 != parity:
+            end -= 1
+        if start <= end:
+            intervals.append((start, end))
+    intervals.sort()
+
+    starts = []  # type: List[int]
+    ends = []  # type: List[int]
+    for start, end in intervals:
+        # The next number with the same parity is 2 away.
+        if ends and start <= ends[-1] + 2:
+            ends[-1] = max(ends[-1], end)
+        else:
+            starts.append(start)
+            ends.append(end)
+    return starts, ends
+
+
 class Ranges:
     """A Ranges object contains an item if any of its Range objects contains it."""
     def __init__(self, items: List[Range]) -> None:
         self.__items = items
+        # Parity -> starts and ends of the merged intervals, see compile_intervals().
+        self.__intervals = (compile_intervals(items, 0), compile_intervals(items, 1))
 
     def get_items(self) -> List[Range]:
         """The list of contained Range objects."""
         return self.__items
 
     def __contains__(self, item: int) -> bool:
-        for i in self.__items:
-            if item in i:
-                return True
-        return False
+        starts, ends = self.__intervals[item % 2]
+        index = bisect.bisect_right(starts, item) - 1
+        return index >= 0 and item <= ends[index]
 
     def __repr__(self) -> str:
         return "Ranges(items=%s)" % self.__items
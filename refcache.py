@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2019 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+The refcache module provides an indexed, memory-mapped on-disk format for the house number
+reference, so the slice of a single relation can be read without deserializing the whole country.
+
+Layout (all integers are little-endian):
+- header: magic, version, source size, source mtime (ns), source SHA-256, string count, key count,
+  value count, refmegye filter size (-1: all refmegyes are included)
+- refmegye filter: tab-separated UTF-8 list of the included refmegyes
+- string offsets: string count + 1 uint64 offsets into the string blob
+- keys: (refmegye, reftelepules, street, first value, value count) uint32 tuples, sorted
+- values: uint32 string indexes, the house numbers of the keys
+- string blob: UTF-8 strings, sorted, so a string index compares the same way as its string
+"""
+
+from typing import BinaryIO
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+import mmap
+import struct
+import sys
+
+MAGIC = b"GIMMREF\0"
+VERSION = 3
+HEADER = struct.Struct("<8sIQq32sIIIi")
+# The source mtime in the header: after the magic, the version and the source size.
+MTIME = struct.Struct("<q")
+MTIME_OFFSET = struct.calcsize("<8sIQ")
+OFFSET = struct.Struct("<Q")
+KEY = struct.Struct("<IIIII")
+VALUE = struct.Struct("<I")
+# Size hint for reading the TSV in batches of lines.
+CHUNK_SIZE = 4 * 1024 * 1024
+
+
+class ReferenceCache:
+    """A reference cache provides read-only access to a memory-mapped, indexed reference."""
+    def __init__(self, path: str) -> None:
+        with open(path, "rb") as stream:
+            self.__mmap = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _size, _mtime, _digest, string_count, key_count, value_count, filter_size = \
+            HEADER.unpack_from(self.__mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            self.__mmap.close()
+            raise ValueError("unexpected reference cache format in '%s'" % path)
+        self.__string_count = string_count
+        self.__key_count = key_count
+        self.__offsets_start = HEADER.size + max(filter_size, 0)
+        self.__keys_start = self.__offsets_start + (string_count + 1) * OFFSET.size
+        self.__values_start = self.__keys_start + key_count * KEY.size
+        self.__blob_start = self.__values_start + value_count * VALUE.size
+
+    def close(self) -> None:
+        """Releases the underlying memory map."""
+        self.__mmap.close()
+
+    def __get_string_bytes(self, index: int) -> bytes:
+        """Gets the encoded string at index from the string table."""
+        start, end = struct.unpack_from("<QQ", self.__mmap, self.__offsets_start + index * OFFSET.size)
+        return self.__mmap[self.__blob_start + start:self.__blob_start + end]
+
+    def __find_string(self, string: str) -> int:
+        """Finds the index of a string in the string table, returns -1 if it's not there."""
+        needle = string.encode("utf-8")
+        low = 0
+        high = self.__string_count
+        while low < high:
+            middle = (low + high) // 2
+            if self.__get_string_bytes(middle) < needle:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.__string_count and self.__get_string_bytes(low) == needle:
+            return low
+        return -1
+
+    def __find_key(self, key: Tuple[int, int, int]) -> Tuple[int, int]:
+        """Finds the value range of a key, returns an empty range if it's not there."""
+        low = 0
+        high = self.__key_count
+        while low < high:
+            middle = (low + high) // 2
+            entry = KEY.unpack_from(self.__mmap, self.__keys_start + middle * KEY.size)
+            if entry[:3] < key:
+                low = middle + 1
+            elif entry[:3] > key:
+                high = middle
+            else:
+                return entry[3], entry[4]
+        return 0, 0
+
+    def get_house_numbers(self, refmegye: str, reftelepules: str, street: str) -> List[str]:
+        """Gets the house numbers of a street, in reference order."""
+        key = (self.__find_string(refmegye), self.__find_string(reftelepules), self.__find_string(street))
+        if -1 in key:
+            return []
+        first, count = self.__find_key(key)
+        values = struct.unpack_from("<%sI" % count, self.__mmap, self.__values_start + first * VALUE.size)
+        return [self.__get_string_bytes(i).decode("utf-8") for i in values]
+
+
+def read_stamp(path: str) -> Optional[Tuple[int, int, int, bytes]]:
+    """
+    Reads the (format version, source size, source mtime, source SHA-256) stamp of a cache, returns
+    None if path is not a cache.
+    """
+    try:
+        with open(path, "rb") as stream:
+            buf = stream.read(HEADER.size)
+    except FileNotFoundError:
+        return None
+    if len(buf) < HEADER.size:
+        return None
+    magic, version, size, mtime, digest, _string_count, _key_count, _value_count, _filter_size = HEADER.unpack(buf)
+    if magic != MAGIC:
+        return None
+    return version, size, mtime, digest
+
+
+def write_mtime(path: str, mtime: int) -> None:
+    """Updates the source mtime in the header of a cache, e.g. after the source was touched without
+    changing its content."""
+    with open(path, "r+b") as stream:
+        stream.seek(MTIME_OFFSET)
+        stream.write(MTIME.pack(mtime))
+
+
+def read_refmegyes(path: str) -> Optional[List[str]]:
+    """Reads the list of refmegyes included in a cache, returns None if all of them are included.
+    Assumes that read_stamp() already found a cache of the current version at path."""
+    with open(path, "rb") as stream:
+        filter_size = HEADER.unpack(stream.read(HEADER.size))[-1]
+        if filter_size < 0:
+            return None
+        refmegyes = stream.read(filter_size).decode("utf-8")
+    if not refmegyes:
+        return []
+    return refmegyes.split("\t")
+
+
+def write_header(
+        stream: BinaryIO,
+        stamp: Tuple[int, int, bytes],
+        counts: Tuple[int, int, int],
+        refmegyes: Optional[List[str]]
+) -> None:
+    """Writes the header and the refmegye filter of a cache. counts is the string, key and value
+    count."""
+    refmegye_filter = b""
+    filter_size = -1
+    if refmegyes is not None:
+        refmegye_filter = "\t".join(sorted(refmegyes)).encode("utf-8")
+        filter_size = len(refmegye_filter)
+    size, mtime, digest = stamp
+    string_count, key_count, value_count = counts
+    stream.write(HEADER.pack(MAGIC, VERSION, size, mtime, digest, string_count, key_count, value_count,
+                             filter_size))
+    stream.write(refmegye_filter)
+
+
+def write(
+        stream: BinaryIO,
+        reference: Dict[Tuple[str, str, str], List[str]],
+        stamp: Tuple[int, int, bytes],
+        refmegyes: Optional[List[str]] = None
+) -> None:
+    """Writes a (refmegye, reftelepules, street) -> house numbers map to stream in the indexed
+    format. stamp is the size, mtime and SHA-256 of the source TSV, refmegyes is the list of
+    refmegyes the map was limited to, if any."""
+    strings = {string for key, value in reference.items() for string in key + tuple(value)}
+    encoded = sorted(i.encode("utf-8") for i in strings)
+    string_indexes = {string.decode("utf-8"): index for index, string in enumerate(encoded)}
+
+    keys = sorted((tuple(string_indexes[i] for i in key), value) for key, value in reference.items())
+    value_count = sum(len(value) for _indexes, value in keys)
+    write_header(stream, stamp, (len(encoded), len(keys), value_count), refmegyes)
+    offset = 0
+    stream.write(OFFSET.pack(offset))
+    for string in encoded:
+        offset += len(string)
+        stream.write(OFFSET.pack(offset))
+    first = 0
+    for indexes, value in keys:
+        stream.write(KEY.pack(indexes[0], indexes[1], indexes[2], first, len(value)))
+        first += len(value)
+    for _indexes, value in keys:
+        stream.write(struct.pack("<%sI" % len(value), *[string_indexes[i] for i in value]))
+    for string in encoded:
+        stream.write(string)
+
+
+def build(
+        local: str,
+        stream: BinaryIO,
+        stamp: Tuple[int, int, bytes],
+        refmegyes: Optional[List[str]] = None
+) -> None:
+    """
+    Builds an indexed cache to stream from the reference on-disk TSV (house number version). The
+    TSV is read in batches of lines, and only the lines of refmegyes are kept, if it's not None.
+    """
+    wanted = None
+    if refmegyes is not None:
+        wanted = set(refmegyes)
+    reference = {}  # type: Dict[Tuple[str, str, str], List[str]]
+    with open(local, "r", buffering=CHUNK_SIZE) as sock:
+        # Skip the header.
+        sock.readline()
+        while True:
+            lines = sock.readlines(CHUNK_SIZE)
+            if not lines:
+                break
+
+            for line in lines:
+                if wanted is not None and line[:line.find("\t")] not in wanted:
+                    continue
+
+                refmegye, reftelepules, street, num = line.strip().split("\t")
+                # The same few strings repeat on many lines, share them.
+                key = (sys.intern(refmegye), sys.intern(reftelepules), sys.intern(street))
+                value = reference.get(key)
+                if value is None:
+                    value = []
+                    reference[key] = value
+                value.append(sys.intern(num))
+    write(stream, reference, stamp, refmegyes)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab:
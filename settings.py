@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2019 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""The settings module provides the settings which are specific to this installation, from wsgi.ini."""
+
+from typing import Dict
+from typing import Tuple
+import configparser
+import os
+
+# Path -> (mtime, config) of wsgi.ini files.
+ConfigCache = Dict[str, Tuple[float, configparser.ConfigParser]]
+
+# The parsed wsgi.ini files, see get_config().
+CONFIG_CACHE = {}  # type: ConfigCache
+
+
+def get_config(config_path: str = "") -> configparser.ConfigParser:
+    """Gets access to the settings which are specific to this installation, from the wsgi.ini next
+    to this module by default. The file is only parsed again if its modification time changed, the
+    returned config must not be modified."""
+    if not config_path:
+        config_path = os.path.join(os.path.dirname(__file__), "wsgi.ini")
+    try:
+        mtime = os.path.getmtime(config_path)
+    except FileNotFoundError:
+        mtime = 0
+    entry = CONFIG_CACHE.get(config_path)
+    if entry is None or entry[0] != mtime:
+        config = configparser.ConfigParser()
+        config.read(config_path)
+        entry = (mtime, config)
+        CONFIG_CACHE[config_path] = entry
+    return entry[1]
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab:
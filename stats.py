@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2019 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""The stats module builds the coverage stats of relations and caches them in the workdir."""
+
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+import json
+import os
+
+import yattag  # type: ignore
+
+from i18n import translate as _
+import helpers
+import storage
+import util
+
+# (Storage backend name, path) -> (mtime, stats) of stats indexes, see get_stats().
+STATS_CACHE = {}  # type: Dict[Tuple[str, str], Tuple[float, Dict[str, Dict[str, Any]]]]
+
+# The missing house numbers of a relation: ongoing and done streets.
+MissingHouseNumbers = Tuple[helpers.StreetHouseNumbers, helpers.StreetHouseNumbers]
+
+# Ongoing street count, missing count, done count, percent and table, see write_missing_housenumbers().
+MissingHouseNumbersResult = Tuple[int, int, int, str, List[List[yattag.Doc]]]
+
+
+def write_missing_housenumbers(relation: helpers.Relation) -> MissingHouseNumbersResult:
+    """
+    Calculate a write stat for the house number coverage of a relation.
+    Returns a tuple of: todo street count, todo count, done count, percent and table.
+    Also writes the cache which is used by read_missing_housenumbers().
+    """
+    return update_missing_housenumbers(relation)[1]
+
+
+def read_missing_housenumbers(relation: helpers.Relation) -> MissingHouseNumbersResult:
+    """Same as write_missing_housenumbers(), but uses the cache if it's up to date."""
+    cached = read_missing_housenumbers_cache(relation)
+    if cached is None:
+        return write_missing_housenumbers(relation)
+    return relation.format_missing_housenumbers(*cached)
+
+
+def get_missing_housenumbers_cached(relation: helpers.Relation) -> MissingHouseNumbers:
+    """Same as Relation.get_missing_housenumbers(), but uses the cache if it's up to date."""
+    cached = read_missing_housenumbers_cache(relation)
+    if cached is None:
+        return update_missing_housenumbers(relation)[0]
+    return cached
+
+
+def update_missing_housenumbers(relation: helpers.Relation) -> Tuple[MissingHouseNumbers, MissingHouseNumbersResult]:
+    """Calculates the missing house numbers, writes the percent file and the cache, returns
+    both the raw and the formatted result."""
+    ongoing_streets, done_streets = relation.get_missing_housenumbers()
+    ret = relation.format_missing_housenumbers(ongoing_streets, done_streets)
+
+    files = relation.get_files()
+    with files.get_storage().transaction():
+        # Write the bottom line to a file, so the index page show it fast.
+        with files.get_housenumbers_percent_stream("w") as stream:
+            stream.write(ret[3])
+
+        # Write the street tables, so the views don't have to compare ref and osm again.
+        cache = [[[street, [[i.get_number(), i.get_source()] for i in house_numbers]]
+                  for street, house_numbers in streets] for streets in (ongoing_streets, done_streets)]
+        buf = json.dumps(cache, ensure_ascii=False, separators=(",", ":"))
+        files.get_storage().write(files.get_housenumbers_cache_path(), buf)
+
+    return (ongoing_streets, done_streets), ret
+
+
+def read_missing_housenumbers_cache(relation: helpers.Relation) -> Optional[MissingHouseNumbers]:
+    """Reads the cache written by write_missing_housenumbers(), returns None if it's missing or
+    older than one of its inputs."""
+    files = relation.get_files()
+    path = files.get_housenumbers_cache_path()
+    if relation.get_stamps().needs_update(path, []):
+        return None
+    ongoing_streets, done_streets = [[(street, [util.HouseNumber(*i) for i in house_numbers])
+                                      for street, house_numbers in streets]
+                                     for streets in json.loads(files.get_storage().read(path))]
+    return ongoing_streets, done_streets
+
+
+def get_missing_housenumbers_stats(relation: helpers.Relation) -> Optional[Dict[str, Any]]:
+    """Counts the missing house numbers per street, like write_missing_housenumbers(), but only
+    from an up to date cache. Returns None if there is no such cache."""
+    cached = read_missing_housenumbers_cache(relation)
+    if cached is None:
+        return None
+    ongoing_streets, done_streets = cached
+    streets = {street: len(util.get_housenumber_ranges(house_numbers)) for street, house_numbers in ongoing_streets}
+    done_count = sum(len(util.get_housenumber_ranges(house_numbers)) for _street, house_numbers in done_streets)
+    return {"streets": streets, "todo_count": sum(streets.values()), "done_count": done_count}
+
+
+def get_relation_stats(relation: helpers.Relation) -> Dict[str, Any]:
+    """Collects the stats of a relation for the stats index: the percents and modification times
+    which are shown on the main page and get_missing_housenumbers_stats(). Percents of missing
+    files are None, times are 0."""
+    files = relation.get_files()
+    percents = {
+        "housenumbers_percent": files.get_housenumbers_percent_path(),
+        "streets_percent": files.get_streets_percent_path(),
+    }
+    paths = dict(percents)
+    paths["osm_housenumbers"] = files.get_osm_housenumbers_path()
+    paths["osm_streets"] = files.get_osm_streets_path()
+    mtimes = files.get_storage().get_mtimes(list(paths.values()))
+    contents = files.get_storage().read_many([i for i in percents.values() if i in mtimes])
+    stats = {}  # type: Dict[str, Any]
+    for key, path in paths.items():
+        if key in percents:
+            stats[key] = contents.get(path)
+        stats[key + "_mtime"] = mtimes.get(path, 0)
+    stats["missing_housenumbers"] = get_missing_housenumbers_stats(relation)
+    return stats
+
+
+def get_stats_path(relations: helpers.Relations) -> str:
+    """Builds the file name of the stats index of all relations."""
+    return os.path.join(relations.get_workdir(), "stats-relations.json")
+
+
+def get_stats(relations: helpers.Relations) -> Dict[str, Dict[str, Any]]:
+    """Reads the stats index: relation name -> get_relation_stats(). Relations which are not yet in
+    the index are added to it. The returned data is shared, callers must not modify it."""
+    stats = read_stats(relations)
+    names = [i for i in relations.get_names() if i not in stats]
+    # Relations removed from relations.yaml are dropped from the index.
+    if names or not set(stats.keys()).issubset(relations.get_names()):
+        stats = write_stats(relations, names)
+    return stats
+
+
+def write_stats(relations: helpers.Relations, names: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+    """Updates the stats index for the named relations, or builds it again for all relations by
+    default. Returns the new index. The index is only written if it changed, so the main page stays
+    cached."""
+    path = get_stats_path(relations)
+    backend = relations.get_storage()
+    # Parallel WSGI workers and cron update the same index.
+    with util.FileLock(path + ".lock"):
+        old_stats = read_stats(relations)
+        stats = {}  # type: Dict[str, Dict[str, Any]]
+        if names is None:
+            names = relations.get_names()
+        else:
+            stats = {key: value for key, value in old_stats.items() if key in relations.get_names()}
+        for name in names:
+            stats[name] = get_relation_stats(relations.get_relation(name))
+        if stats == old_stats and backend.exists(path):
+            return old_stats
+        backend.write(path, json.dumps(stats, ensure_ascii=False, sort_keys=True),
+                      counts=get_missing_counts(relations, stats))
+        STATS_CACHE[(relations.get_storage_name(), path)] = (backend.getmtime(path), stats)
+    return stats
+
+
+def read_stats(relations: helpers.Relations) -> Dict[str, Dict[str, Any]]:
+    """Reads the stats index, returns an empty one if it's missing. The index is only parsed again
+    if its modification time changed."""
+    path = get_stats_path(relations)
+    backend = relations.get_storage()
+    mtimes = backend.get_mtimes([path])
+    if path not in mtimes:
+        return {}
+    key = (relations.get_storage_name(), path)
+    if key not in STATS_CACHE or STATS_CACHE[key][0] != mtimes[path]:
+        STATS_CACHE[key] = (mtimes[path], json.loads(backend.read(path)))
+    return STATS_CACHE[key][1]
+
+
+def get_missing_counts(relations: helpers.Relations, stats: Dict[str, Dict[str, Any]]) -> List[storage.MissingCount]:
+    """Gets the missing house number counts of a stats index, which the storage backend can query
+    across relations: a row per street with missing house numbers, and a row per relation with its
+    existing count."""
+    ret = []  # type: List[storage.MissingCount]
+    for name, relation_stats in sorted(stats.items()):
+        # Older indexes don't have the counts yet.
+        missing = relation_stats.get("missing_housenumbers")
+        if not missing:
+            continue
+        refmegye = relations.get_relation(name).get_config().get_refmegye()
+        ret.append((name, refmegye, None, 0, missing["done_count"]))
+        ret += [(name, refmegye, street, street_count, 0)
+                for street, street_count in sorted(missing["streets"].items())]
+    return ret
+
+
+def get_top_missing_streets(relations: helpers.Relations, count: int) -> List[Tuple[str, str, int]]:
+    """Gets the streets with the most missing house numbers across all relations: a list of
+    relation name, street name and missing count."""
+    stats = get_stats(relations)
+    return relations.get_storage().get_top_missing_streets(get_stats_path(relations), count,
+                                                           lambda: get_missing_counts(relations, stats))
+
+
+def get_relation_missing_housenumbers(relations: helpers.Relations, count: int) -> List[Tuple[str, int, int]]:
+    """Gets the relations with the most missing house numbers: a list of relation name, missing
+    count and existing count."""
+    stats = get_stats(relations)
+    return relations.get_storage().get_missing_totals(get_stats_path(relations), "relation", count,
+                                                      lambda: get_missing_counts(relations, stats))
+
+
+def get_refmegye_missing_housenumbers(relations: helpers.Relations) -> List[Tuple[str, int, int]]:
+    """Gets the missing house numbers per refmegye: a list of refmegye, missing count and existing
+    count, the most missing first."""
+    stats = get_stats(relations)
+    return relations.get_storage().get_missing_totals(get_stats_path(relations), "refmegye", None,
+                                                      lambda: get_missing_counts(relations, stats))
+
+
+def get_housenumber_stats_tables(relations: helpers.Relations, count: int) -> List[Tuple[str, List[List[yattag.Doc]]]]:
+    """Builds the titles and tables of the missing house number counts across all relations, the
+    top count streets and relations, then all refmegyes."""
+    def relation_link(relation_name: str) -> yattag.Doc:
+        doc = yattag.Doc()
+        with doc.tag("a", href="/osm/missing-housenumbers/" + relation_name + "/view-result"):
+            doc.text(relation_name)
+        return doc
+
+    streets = [[util.html_escape(_("Area")), util.html_escape(_("Street name")), util.html_escape(_("Missing count"))]]
+    for relation_name, street, missing_count in get_top_missing_streets(relations, count):
+        streets.append([relation_link(relation_name), util.html_escape(street), util.html_escape(str(missing_count))])
+
+    areas = [[util.html_escape(_("Area")), util.html_escape(_("Missing count")),
+              util.html_escape(_("Existing house numbers"))]]
+    for relation_name, missing_count, existing_count in get_relation_missing_housenumbers(relations, count):
+        areas.append([relation_link(relation_name), util.html_escape(str(missing_count)),
+                      util.html_escape(str(existing_count))])
+
+    counties = [[util.html_escape(_("County")), util.html_escape(_("Missing count")),
+                 util.html_escape(_("Existing house numbers"))]]
+    for refmegye, missing_count, existing_count in get_refmegye_missing_housenumbers(relations):
+        cell = yattag.Doc()
+        with cell.tag("a", href="/osm/filter-for/refmegye/" + refmegye):
+            cell.text(relations.refmegye_get_name(refmegye) or refmegye)
+        counties.append([cell, util.html_escape(str(missing_count)), util.html_escape(str(existing_count))])
+
+    return [
+        (_("Streets with the most missing house numbers"), streets),
+        (_("Areas with the most missing house numbers"), areas),
+        (_("Missing house numbers per county"), counties),
+    ]
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab:
@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2019 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+The storage module provides backends which store the data files of relations in the workdir.
+
+The SQLite backend stores the files the flat file backend would write in a path -> content table
+(with an mtime; streamed files are split into chunks). Files can be indexed when they are
+written: their lines by a key (e.g. the reference house numbers by street, see get_lines()), and
+the missing house number counts of the stats index as one row per street, so the queries across
+relations (e.g. get_top_missing_streets()) run in SQL. Other queries parse the files.
+"""
+
+from typing import BinaryIO
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import TextIO
+from typing import Tuple
+from typing import cast
+import contextlib
+import heapq
+import io
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+import util
+
+# Maps a line of a file to its keys (e.g. street names), the line can be looked up by any of them.
+KeyFunction = Callable[[str], List[str]]
+
+# A missing house number count: relation name, refmegye, street name (None for the existing count
+# of the relation), missing count and existing count. The stats index is indexed by these.
+MissingCount = Tuple[str, str, Optional[str], int, int]
+
+# Gets the missing house number counts of a file, for backends which don't have them indexed.
+CountFunction = Callable[[], List[MissingCount]]
+
+# The columns of a MissingCount which get_missing_totals() can group by.
+MISSING_TOTALS_GROUPS = ("relation", "refmegye")
+
+# Flags of the indexed column of the files table: the file has lines or missing counts indexed.
+INDEXED_LINES = 1
+INDEXED_COUNTS = 2
+
+# The SQLite database has a limit on the number of parameters in a query.
+MAX_PARAMETERS = 500
+
+# Number of characters in a row of the chunks table, see SqliteStorage.write_stream().
+CHUNK_SIZE = 1024 * 1024
+
+
+class FileStorage:
+    """
+    The default storage backend: each data file is a flat file. Storage backends are keyed by
+    paths, so other backends can behave like a file system for their users.
+    """
+    def get_name(self) -> str:
+        """Gets the name of the backend, see get_storage()."""
+        return "files"
+
+    def exists(self, path: str) -> bool:
+        """Decides if a file exists."""
+        return os.path.exists(path)
+
+    def getmtime(self, path: str) -> float:
+        """Gets the modification time of a file, raises FileNotFoundError if it doesn't exist."""
+        return os.path.getmtime(path)
+
+    def get_mtimes(self, paths: List[str]) -> Dict[str, float]:
+        """Gets the modification times of several files, missing files are not in the result."""
+        ret = {}  # type: Dict[str, float]
+        for path in paths:
+            if os.path.exists(path):
+                ret[path] = os.path.getmtime(path)
+        return ret
+
+    def get_timestamp(self, path: str) -> float:
+        """Gets the modification time of a file, 0 if it doesn't exist."""
+        return self.get_mtimes([path]).get(path, 0)
+
+    def is_outdated(self, path: str, inputs: List[str]) -> bool:
+        """Decides if a derived file is missing or older than one of its (existing) inputs."""
+        mtimes = self.get_mtimes([path] + inputs)
+        if path not in mtimes:
+            return True
+        return any(mtimes[i] > mtimes[path] for i in inputs if i in mtimes)
+
+    def read(self, path: str) -> str:
+        """Reads a whole file, raises FileNotFoundError if it doesn't exist."""
+        with open(path) as stream:
+            return stream.read()
+
+    def read_many(self, paths: List[str]) -> Dict[str, str]:
+        """Reads several files, missing files are not in the result."""
+        return {path: self.read(path) for path in paths if os.path.exists(path)}
+
+    def open(self, path: str, mode: str) -> TextIO:
+        """Opens a file for reading ("r") or writing ("w") as a text stream."""
+        return cast(TextIO, open(path, mode=mode))
+
+    def write(self, path: str, content: str, key: Optional[KeyFunction] = None,
+              counts: Optional[List[MissingCount]] = None) -> None:
+        """Replaces a file atomically. key allows get_lines() to find lines of the file faster,
+        counts allows get_top_missing_streets() and get_missing_totals() to query the counts of
+        the file faster, this backend ignores them."""
+        # pylint: disable=unused-argument
+        util.write_atomically(path, lambda stream: stream.write(content.encode("utf-8")))
+
+    def write_stream(self, path: str, write: Callable[[TextIO], None], key: Optional[KeyFunction] = None) -> None:
+        """Replaces a file atomically with what write() writes to a text stream, so the content
+        doesn't have to fit into memory. key is the same as for write()."""
+        # pylint: disable=unused-argument
+        def write_text(stream: BinaryIO) -> None:
+            text = io.TextIOWrapper(stream, encoding="utf-8", newline="\n")
+            write(text)
+            # Flushes, but leaves closing the file to write_atomically().
+            text.detach()
+        util.write_atomically(path, write_text)
+
+    def remove(self, path: str) -> None:
+        """Removes a file, raises FileNotFoundError if it doesn't exist."""
+        os.remove(path)
+
+    @contextlib.contextmanager
+    def transaction(self) -> Iterator[None]:
+        """Groups writes, e.g. the files of a relation, so readers see all or none of them. This
+        backend only replaces individual files atomically."""
+        yield
+
+    def get_lines(self, path: str, values: List[str], key: KeyFunction) -> Dict[str, List[str]]:
+        """Groups the lines of a file (without the trailing newline) by the values of key(), e.g.
+        the house numbers of streets. Only the given values are in the result."""
+        wanted = set(values)
+        ret = {}  # type: Dict[str, List[str]]
+        with self.open(path, "r") as stream:
+            for line in util.split_lines(stream):
+                for value in key(line):
+                    if value in wanted:
+                        ret.setdefault(value, []).append(line)
+        return ret
+
+    def get_top_missing_streets(self, path: str, count: int, counts: CountFunction) -> List[Tuple[str, str, int]]:
+        """Gets the count streets with the most missing house numbers from the counts of a file: a
+        list of relation name, street name and missing count. counts() is only called if the
+        counts of the file are not indexed, see write()."""
+        # pylint: disable=unused-argument
+        streets = ((i[0], i[2], i[3]) for i in counts() if i[2] is not None)
+        return heapq.nsmallest(count, streets, key=lambda street: (-street[2], street[0], street[1]))
+
+    def get_missing_totals(self, path: str, group: str, count: Optional[int],
+                           counts: CountFunction) -> List[Tuple[str, int, int]]:
+        """Sums the counts of a file per relation or refmegye (group): a list of group, missing
+        count and existing count, the most missing first, at most count items if it's not None.
+        counts() is the same as for get_top_missing_streets()."""
+        # pylint: disable=unused-argument
+        if group not in MISSING_TOTALS_GROUPS:
+            raise ValueError("unknown group: " + group)
+        totals = {}  # type: Dict[str, List[int]]
+        for row in counts():
+            total = totals.setdefault(row[1] if group == "refmegye" else row[0], [0, 0])
+            total[0] += row[3]
+            total[1] += row[4]
+        ret = sorted(((name, total[0], total[1]) for name, total in totals.items()), key=lambda i: (-i[1], i[0]))
+        return ret[:count]
+
+
+class WriteStream(io.StringIO):
+    """A text stream which is written to a storage backend when it's closed."""
+    def __init__(self, storage: FileStorage, path: str) -> None:
+        super().__init__()
+        self.__storage = storage
+        self.__path = path
+
+    def close(self) -> None:
+        if not self.closed:
+            self.__storage.write(self.__path, self.getvalue())
+        super().close()
+
+
+class SqliteStorage(FileStorage):
+    """
+    A storage backend which writes files to an SQLite database, with lines indexed by their key,
+    e.g. the house numbers of a relation indexed by street. Files which are not yet in the database
+    are read from the file system, so an existing workdir can be switched over without a migration.
+    """
+    def __init__(self, database: str) -> None:
+        self.__database = database
+        self.__local = threading.local()
+
+    def __get_connection(self) -> sqlite3.Connection:
+        """Gets the connection of the current thread, a forked child process opens its own."""
+        if getattr(self.__local, "pid", None) != os.getpid():
+            # Autocommit, transaction() starts transactions explicitly.
+            connection = sqlite3.connect(self.__database, timeout=60, isolation_level=None)
+            connection.executescript("""
+                create table if not exists files (
+                    path text primary key, mtime real not null, content text not null, indexed integer not null);
+                create table if not exists chunks (path text not null, content text not null);
+                create index if not exists chunks_path on chunks (path);
+                create table if not exists lines (path text not null, key text not null, line text not null);
+                create index if not exists lines_path_key on lines (path, key);
+                create table if not exists counts (path text not null, relation text not null, refmegye text not null,
+                    street text, missing integer not null, existing integer not null);
+                create index if not exists counts_path on counts (path);
+            """)
+            self.__local.connection = connection
+            self.__local.depth = 0
+            self.__local.pid = os.getpid()
+        return cast(sqlite3.Connection, self.__local.connection)
+
+    def get_name(self) -> str:
+        return "sqlite"
+
+    def __select(self, columns: str, paths: List[str], table: str = "files") -> List[Tuple[str, ...]]:
+        """Selects columns of the rows of several files in a table, in insertion order."""
+        rows = []  # type: List[Tuple[str, ...]]
+        for index in range(0, len(paths), MAX_PARAMETERS):
+            chunk = paths[index:index + MAX_PARAMETERS]
+            query = "select path, {} from {} where path in ({}) order by rowid"
+            query = query.format(columns, table, ", ".join("?" * len(chunk)))
+            rows += self.__get_connection().execute(query, chunk).fetchall()
+        return rows
+
+    def __read_contents(self, paths: List[str]) -> Dict[str, str]:
+        """Reads several files from the database, files which are not there are not in the result."""
+        contents = {row[0]: [row[1]] for row in self.__select("content", paths)}
+        for path, content in self.__select("content", list(contents.keys()), table="chunks"):
+            contents[path].append(content)
+        return {path: "".join(chunks) for path, chunks in contents.items()}
+
+    def __is_indexed(self, path: str, flag: int) -> bool:
+        """Decides if the lines or counts (flag) of a file are indexed in the database."""
+        rows = self.__select("indexed", [path])
+        return bool(rows) and bool(cast(int, rows[0][1]) & flag)
+
+    def __replace(self, path: str, content: str, chunks: Iterable[str], lines: Iterable[str],
+                  key: Optional[KeyFunction]) -> None:
+        """Replaces a file in the database: content is stored in the files table, chunks are
+        appended to it. lines are only iterated if key is given. The iterables are consumed row by
+        row, so they don't have to fit into memory."""
+        with self.transaction():
+            connection = self.__get_connection()
+            connection.execute("insert or replace into files (path, mtime, content, indexed) values (?, ?, ?, ?)",
+                               (path, time.time(), content, INDEXED_LINES if key else 0))
+            for table in ("chunks", "lines", "counts"):
+                connection.execute("delete from {} where path = ?".format(table), (path,))
+            connection.executemany("insert into chunks (path, content) values (?, ?)",
+                                   ((path, chunk) for chunk in chunks))
+            if key:
+                connection.executemany("insert into lines (path, key, line) values (?, ?, ?)",
+                                       ((path, value, line) for line in lines for value in key(line)))
+
+    def exists(self, path: str) -> bool:
+        return bool(self.__select("mtime", [path])) or os.path.exists(path)
+
+    def getmtime(self, path: str) -> float:
+        rows = self.__select("mtime", [path])
+        if rows:
+            return cast(float, rows[0][1])
+        return os.path.getmtime(path)
+
+    def get_mtimes(self, paths: List[str]) -> Dict[str, float]:
+        ret = super().get_mtimes(paths)
+        ret.update({row[0]: cast(float, row[1]) for row in self.__select("mtime", paths)})
+        return ret
+
+    def read(self, path: str) -> str:
+        contents = self.__read_contents([path])
+        if contents:
+            return contents[path]
+        return super().read(path)
+
+    def read_many(self, paths: List[str]) -> Dict[str, str]:
+        ret = super().read_many(paths)
+        ret.update(self.__read_contents(paths))
+        return ret
+
+    def open(self, path: str, mode: str) -> TextIO:
+        if mode == "w":
+            return WriteStream(self, path)
+        return io.StringIO(self.read(path))
+
+    def write(self, path: str, content: str, key: Optional[KeyFunction] = None,
+              counts: Optional[List[MissingCount]] = None) -> None:
+        with self.transaction():
+            self.__replace(path, content, [], util.split_lines(io.StringIO(content)), key)
+            if counts is not None:
+                connection = self.__get_connection()
+                connection.execute("update files set indexed = indexed | ? where path = ?", (INDEXED_COUNTS, path))
+                connection.executemany("insert into counts (path, relation, refmegye, street, missing, existing) "
+                                       "values (?, ?, ?, ?, ?, ?)", ((path,) + row for row in counts))
+
+    def write_stream(self, path: str, write: Callable[[TextIO], None], key: Optional[KeyFunction] = None) -> None:
+        # The content is collected in a temporary file, then inserted as chunks, so it doesn't have
+        # to fit into memory.
+        with tempfile.TemporaryFile("w+", encoding="utf-8", newline="\n") as stream:
+            write(stream)
+            stream.seek(0)
+            chunks = iter(lambda: stream.read(CHUNK_SIZE), "")
+
+            def get_lines() -> Iterator[str]:
+                # Only started once all chunks are inserted, so the file can be read again.
+                stream.seek(0)
+                yield from util.split_lines(stream)
+            self.__replace(path, "", chunks, get_lines(), key)
+
+    def remove(self, path: str) -> None:
+        in_database = bool(self.__select("mtime", [path]))
+        if in_database:
+            with self.transaction():
+                connection = self.__get_connection()
+                for table in ("files", "chunks", "lines", "counts"):
+                    connection.execute("delete from {} where path = ?".format(table), (path,))
+        # Don't let the file system fallback resurrect the file.
+        if not in_database or os.path.exists(path):
+            super().remove(path)
+
+    @contextlib.contextmanager
+    def transaction(self) -> Iterator[None]:
+        connection = self.__get_connection()
+        if self.__local.depth == 0:
+            connection.execute("begin immediate")
+        self.__local.depth += 1
+        try:
+            yield
+        except BaseException:
+            self.__local.depth -= 1
+            if self.__local.depth == 0:
+                connection.execute("rollback")
+            raise
+        self.__local.depth -= 1
+        if self.__local.depth == 0:
+            connection.execute("commit")
+
+    def get_lines(self, path: str, values: List[str], key: KeyFunction) -> Dict[str, List[str]]:
+        if not self.__is_indexed(path, INDEXED_LINES):
+            return super().get_lines(path, values, key)
+        ret = {}  # type: Dict[str, List[str]]
+        for index in range(0, len(values), MAX_PARAMETERS):
+            chunk = values[index:index + MAX_PARAMETERS]
+            query = "select key, line from lines where path = ? and key in ({}) order by rowid"
+            query = query.format(", ".join("?" * len(chunk)))
+            for value, line in self.__get_connection().execute(query, [path] + chunk).fetchall():
+                ret.setdefault(value, []).append(line)
+        return ret
+
+    def get_top_missing_streets(self, path: str, count: int, counts: CountFunction) -> List[Tuple[str, str, int]]:
+        if not self.__is_indexed(path, INDEXED_COUNTS):
+            return super().get_top_missing_streets(path, count, counts)
+        query = "select relation, street, missing from counts where path = ? and street is not null "
+        query += "order by missing desc, relation, street limit ?"
+        rows = self.__get_connection().execute(query, (path, count)).fetchall()
+        return [(row[0], row[1], row[2]) for row in rows]
+
+    def get_missing_totals(self, path: str, group: str, count: Optional[int],
+                           counts: CountFunction) -> List[Tuple[str, int, int]]:
+        if group not in MISSING_TOTALS_GROUPS:
+            raise ValueError("unknown group: " + group)
+        if not self.__is_indexed(path, INDEXED_COUNTS):
+            return super().get_missing_totals(path, group, count, counts)
+        query = "select {0}, sum(missing), sum(existing) from counts where path = ? group by {0} "
+        query += "order by 2 desc, 1 limit ?"
+        # A negative limit means no limit.
+        limit = count if count is not None else -1
+        rows = self.__get_connection().execute(query.format(group), (path, limit)).fetchall()
+        return [(row[0], row[1], row[2]) for row in rows]
+
+
+# Backend name and workdir -> backend, shared by all Relations objects of this process.
+STORAGES = {}  # type: Dict[Tuple[str, str], FileStorage]
+
+
+def get_storage(name: str, workdir: str) -> FileStorage:
+    """Gets a storage backend by name: "files" (the default) or "sqlite", which uses
+    workdir/workdir.sqlite."""
+    if not name:
+        name = os.environ.get("GIMMISN_STORAGE", "files")
+    if (name, workdir) not in STORAGES:
+        if name == "files":
+            STORAGES[(name, workdir)] = FileStorage()
+        elif name == "sqlite":
+            STORAGES[(name, workdir)] = SqliteStorage(os.path.join(workdir, "workdir.sqlite"))
+        else:
+            raise ValueError("unknown storage backend: " + name)
+    return STORAGES[(name, workdir)]
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab:
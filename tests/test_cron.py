@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2019 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""The test_cron module covers the cron module."""
+
+from typing import Dict
+from typing import List
+from typing import Tuple
+import http.client
+import os
+import threading
+import unittest
+import unittest.mock
+import urllib.error
+
+import cron
+import helpers
+
+
+def get_relations() -> helpers.Relations:
+    """Returns a Relations object that uses the test data and workdir."""
+    datadir = os.path.join(os.path.dirname(__file__), "data")
+    workdir = os.path.join(os.path.dirname(__file__), "workdir")
+    return helpers.Relations(datadir, workdir)
+
+
+def gen_http_error() -> urllib.error.HTTPError:
+    """Generates an HTTP error, like the one of a rate limited overpass query."""
+    return urllib.error.HTTPError("https://overpass-api.de/api/interpreter", 429, "Too Many Requests", {}, None)
+
+
+class TestRunQueries(unittest.TestCase):
+    """Tests run_queries()."""
+    def run_queries(self, relation_names: List[str], errors: Dict[str, List[Exception]]) -> List[str]:
+        """Runs run_queries() with 2 free slots, fetch() raises the errors of a relation one by one,
+        then succeeds."""
+        def fetch(relation: helpers.Relation) -> None:
+            relation_errors = errors.get(relation.get_name(), [])
+            if relation_errors:
+                raise relation_errors.pop(0)
+        with unittest.mock.patch("overpass_query.overpass_query_slots", return_value=(2, 2)):
+            return cron.run_queries("test", get_relations(), relation_names, fetch)
+
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        self.assertEqual(sorted(self.run_queries(["gazdagret", "ujbuda"], {})), ["gazdagret", "ujbuda"])
+
+    def test_retry(self) -> None:
+        """Tests that a query is retried after an HTTP error."""
+        errors = {"gazdagret": [gen_http_error(), gen_http_error()]}  # type: Dict[str, List[Exception]]
+        self.assertEqual(sorted(self.run_queries(["gazdagret", "ujbuda"], errors)), ["gazdagret", "ujbuda"])
+        self.assertEqual(errors["gazdagret"], [])
+
+    def test_retry_limit(self) -> None:
+        """Tests that a query is not retried forever."""
+        errors = {"gazdagret": [gen_http_error() for _ in range(3)]}  # type: Dict[str, List[Exception]]
+        with unittest.mock.patch("cron.should_retry", lambda retry: retry < 2):
+            self.assertEqual(self.run_queries(["gazdagret", "ujbuda"], errors), ["ujbuda"])
+        self.assertEqual(len(errors["gazdagret"]), 1)
+
+    def test_failure(self) -> None:
+        """Tests that other errors fail the relation, but not the others."""
+        errors = {
+            "gazdagret": [http.client.IncompleteRead(b"")],
+            "ujbuda": [OSError()],
+            "budafok": [ValueError()],
+        }  # type: Dict[str, List[Exception]]
+        self.assertEqual(self.run_queries(["gazdagret", "ujbuda", "budafok", "ormezo"], errors), ["ormezo"])
+
+    def run_throttled(self, free: int, relation_names: List[str]) -> Tuple[List[str], List[int]]:
+        """Runs run_queries() against an overpass with a rate limit of 2, which has free slots for us,
+        minus our queries in flight. Returns the succeeded relations and the number of queries in
+        flight at the start of each query."""
+        lock = threading.Lock()
+        in_flight = [0]
+        starts = []  # type: List[int]
+        # Each query waits until free queries are in flight, which fails if they are not parallel.
+        barrier = threading.Barrier(free, timeout=10)
+        # Never set: holds each query a bit, so the scheduler could start too many meanwhile.
+        hold = threading.Event()
+
+        def get_slots() -> Tuple[int, int]:
+            with lock:
+                return 2, max(free - in_flight[0], 0)
+
+        def fetch(_relation: helpers.Relation) -> None:
+            with lock:
+                in_flight[0] += 1
+                starts.append(in_flight[0])
+            try:
+                barrier.wait()
+                hold.wait(0.05)
+            finally:
+                with lock:
+                    in_flight[0] -= 1
+
+        with unittest.mock.patch("overpass_query.overpass_query_slots", get_slots):
+            with unittest.mock.patch("cron.overpass_sleep") as mock_sleep:
+                succeeded = cron.run_queries("test", get_relations(), relation_names, fetch)
+        self.assertFalse(mock_sleep.called)
+        return sorted(succeeded), starts
+
+    def test_throttle(self) -> None:
+        """Tests that no more queries are in flight than the free slots allow."""
+        succeeded, starts = self.run_throttled(1, ["gazdagret", "ujbuda", "budafok"])
+        self.assertEqual(succeeded, ["budafok", "gazdagret", "ujbuda"])
+        self.assertEqual(starts, [1, 1, 1])
+
+    def test_parallel(self) -> None:
+        """Tests that two free slots are used in parallel."""
+        succeeded, starts = self.run_throttled(2, ["gazdagret", "ujbuda", "budafok", "ormezo"])
+        self.assertEqual(succeeded, ["budafok", "gazdagret", "ormezo", "ujbuda"])
+        self.assertEqual(max(starts), 2)
+
+    def test_no_slots(self) -> None:
+        """Tests that the scheduler waits if there are no free slots."""
+        with unittest.mock.patch("overpass_query.overpass_query_slots", return_value=(1, 0)):
+            with unittest.mock.patch("cron.overpass_sleep") as mock_sleep:
+                succeeded = cron.run_queries("test", get_relations(), ["gazdagret", "ujbuda"], lambda _: None)
+        self.assertEqual(sorted(succeeded), ["gazdagret", "ujbuda"])
+        self.assertEqual(mock_sleep.call_count, 2)
+
+    def test_slots(self) -> None:
+        """Tests that free slots are used without waiting, but not beyond the rate limit."""
+        with unittest.mock.patch("overpass_query.overpass_query_slots", return_value=(1, 2)):
+            with unittest.mock.patch("cron.overpass_sleep") as mock_sleep:
+                succeeded = cron.run_queries("test", get_relations(), ["gazdagret", "ujbuda"], lambda _: None)
+        self.assertEqual(sorted(succeeded), ["gazdagret", "ujbuda"])
+        self.assertFalse(mock_sleep.called)
+
+
+class TestCheckOsmChanges(unittest.TestCase):
+    """Tests check_osm_changes()."""
+    def test_malformed(self) -> None:
+        """Tests that a relation is downloaded again if the result of the check is not usable."""
+        remark = '{"osm3s": {"timestamp_osm_base": "2019-11-20T03:00:02Z"}, "elements": [], "remark": "runtime error"}'
+        with unittest.mock.patch("overpass_query.overpass_query_slots", return_value=(2, 2)):
+            with unittest.mock.patch("overpass_query.overpass_query", return_value=remark):
+                changed = cron.check_osm_changes(get_relations(), ["gazdagret"])
+        self.assertEqual(changed, {"gazdagret": None})
+
+
+if __name__ == '__main__':
+    unittest.main()
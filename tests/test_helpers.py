@@ -7,14 +7,17 @@
 """The test_helpers module covers the helpers module."""
 
 import configparser
+import io
 import os
 from typing import List
+from typing import Tuple
+import tempfile
 import unittest
-
-import yattag  # type: ignore
+import unittest.mock
 
 import helpers
 import ranges
+import storage
 import util
 
 
@@ -25,92 +28,6 @@ def get_relations() -> helpers.Relations:
     return helpers.Relations(datadir, workdir)
 
 
-class TestSortStreetsCsv(unittest.TestCase):
-    """Tests sort_streets_csv()."""
-    def test_single_field(self) -> None:
-        """Tests a single column."""
-        unsorted = 'head\n2\n1'
-        expected = 'head\n1\n2'
-        self.assertEqual(helpers.sort_streets_csv(unsorted), expected)
-
-    def test_two_fields(self) -> None:
-        """Tests 2 columns."""
-        unsorted = 'head\n1\tb\n2\ta'
-        expected = 'head\n2\ta\n1\tb'
-        self.assertEqual(helpers.sort_streets_csv(unsorted), expected)
-
-
-class TestSortStreets(unittest.TestCase):
-    """Tests sort_streets()."""
-    def test_primary(self) -> None:
-        """Tests that missing 2nd col is ordered last."""
-        unsorted = [
-            '0\t\tprimary',
-            '1\tPear\tprimary',
-            '2\tApple\tsecondary',
-            '3\tApple\tprimary',
-        ]
-        expected = [
-            '3\tApple\tprimary',
-            '2\tApple\tsecondary',
-            '1\tPear\tprimary',
-            '0\t\tprimary',
-        ]
-        self.assertEqual(helpers.sort_streets(unsorted), expected)
-
-    def test_service(self) -> None:
-        """Tests that matching 2nd and 3rd col means ordering by 4th col."""
-        unsorted = [
-            '4\tMine\tservice\tdriveway',
-            '5\tMine\tservice\tallay',
-        ]
-        sort = [
-            '5\tMine\tservice\tallay',
-            '4\tMine\tservice\tdriveway',
-        ]
-        self.assertEqual(helpers.sort_streets(unsorted), sort)
-
-
-class TestSortHouseNumbersCsv(unittest.TestCase):
-    """Tests sort_housenumbers_csv()."""
-    def test_happy(self) -> None:
-        """Tests the happy path."""
-        unsorted = 'head\n2\n1'
-        expected = 'head\n1\n2'
-        self.assertEqual(helpers.sort_housenumbers_csv(unsorted), expected)
-
-
-class TestSortHousenumbers(unittest.TestCase):
-    """Tests sort_housenumbers()."""
-    def test_happy(self) -> None:
-        """Tests the happy path."""
-        unsorted = [
-            '0\t\t42\t1234\tPalace\t1000/11\t8\t0\t2\tA\tMinistry of OpenStreetMap',
-            '1\tApple ave\t42\t1234\tPalace\t1000/11\t8\t0\t2\tA\tMinistry of OpenStreetMap',
-            '2\tPear ave\t42\t1234\tPalace\t1000/11\t8\t0\t2\tA\tMinistry of OpenStreetMap',
-            '3\tApple ave\t42\t1234\tPalace\t1000/11\t8\t0\t2\tA\tBase of OpenStreetMap',
-            '4\tApple ave\t5\t1234\tPalace\t1000/11\t8\t0\t2\tA\tMinistry of OpenStreetMap',
-            '5\tApple ave\t\t1234\t\t\t8\t0\t2\tA\tMinistry of OpenStreetMap',
-            '6\tApple ave\t\t1234\t\t1000/11\t8\t0\t2\tA\tMinistry of OpenStreetMap',
-            '7\tApple ave\t\t1234\tPalace\t1000/11\t8\t0\t2\tA\tMinistry of OpenStreetMap',
-            '8\tApple ave\t42\t\tPalace\t1000/11\t8\t0\t2\tA\tMinistry of OpenStreetMap',
-            '9\tApple ave\t42\t\tPalace\t1000/11',
-        ]
-        expected = [
-            '9\tApple ave\t42\t\tPalace\t1000/11',
-            '8\tApple ave\t42\t\tPalace\t1000/11\t8\t0\t2\tA\tMinistry of OpenStreetMap',
-            '5\tApple ave\t\t1234\t\t\t8\t0\t2\tA\tMinistry of OpenStreetMap',
-            '6\tApple ave\t\t1234\t\t1000/11\t8\t0\t2\tA\tMinistry of OpenStreetMap',
-            '7\tApple ave\t\t1234\tPalace\t1000/11\t8\t0\t2\tA\tMinistry of OpenStreetMap',
-            '0\t\t42\t1234\tPalace\t1000/11\t8\t0\t2\tA\tMinistry of OpenStreetMap',
-            '4\tApple ave\t5\t1234\tPalace\t1000/11\t8\t0\t2\tA\tMinistry of OpenStreetMap',
-            '3\tApple ave\t42\t1234\tPalace\t1000/11\t8\t0\t2\tA\tBase of OpenStreetMap',
-            '1\tApple ave\t42\t1234\tPalace\t1000/11\t8\t0\t2\tA\tMinistry of OpenStreetMap',
-            '2\tPear ave\t42\t1234\tPalace\t1000/11\t8\t0\t2\tA\tMinistry of OpenStreetMap',
-        ]
-        self.assertEqual(helpers.sort_housenumbers(unsorted), expected)
-
-
 class TestInBoth(unittest.TestCase):
     """Tests get_in_both()."""
     def test_happy(self) -> None:
@@ -125,6 +42,27 @@ class TestOnlyInFirst(unittest.TestCase):
         self.assertEqual(helpers.get_only_in_first(["1", "2", "3"], ["3", "4"]), ["1", "2"])
 
 
+class TestOnlyInFirstAndInBoth(unittest.TestCase):
+    """Tests get_only_in_first_and_in_both()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        only_in_first, in_both = helpers.get_only_in_first_and_in_both(["3", "1*", "2"], ["2", "3*", "4"])
+        self.assertEqual(only_in_first, ["1*"])
+        self.assertEqual(in_both, ["3", "2"])
+
+    def test_house_numbers(self) -> None:
+        """Tests the case when the input is a house number list."""
+        first = [util.HouseNumber("1", "1-3"), util.HouseNumber("3*", "1-3")]
+        second = [util.HouseNumber("3", "3")]
+        only_in_first, in_both = helpers.get_only_in_first_and_in_both(first, second)
+        self.assertEqual([i.get_number() for i in only_in_first], ["1"])
+        self.assertEqual([i.get_number() for i in in_both], ["3*"])
+
+    def test_empty(self) -> None:
+        """Tests the case when first is empty."""
+        self.assertEqual(helpers.get_only_in_first_and_in_both([], ["1"]), ([], []))
+
+
 class TestRelationGetOsmStreets(unittest.TestCase):
     """Tests Relation.get_osm_streets()."""
     def test_happy(self) -> None:
@@ -155,29 +93,173 @@ class TestGetWorkdir(unittest.TestCase):
         self.assertEqual(actual, expected)
 
 
+class TestGetStorageName(unittest.TestCase):
+    """Tests get_storage_name()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        config = configparser.ConfigParser()
+        config.read_dict({"wsgi": {"workdir": "/path/to/workdir"}})
+        self.assertEqual(helpers.get_storage_name(config), "")
+        config.read_dict({"wsgi": {"storage": "sqlite"}})
+        self.assertEqual(helpers.get_storage_name(config), "sqlite")
+        datadir = os.path.join(os.path.dirname(__file__), "data")
+        with tempfile.TemporaryDirectory() as workdir:
+            relations = helpers.Relations(datadir, workdir, "files")
+            self.assertEqual(relations.get_storage_name(), "files")
+            self.assertIs(relations.get_relation("gazdagret").get_files().get_storage(), relations.get_storage())
+
+
+class TestRelationFilesGetRefHousenumbersStream(unittest.TestCase):
+    """Tests RelationFiles.get_ref_housenumbers_stream()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        files = get_relations().get_relation("gazdagret").get_files()
+        with files.get_ref_housenumbers_stream("r") as stream:
+            self.assertIn("Tűzkő utca 9\n", stream.readlines())
+
+
 class TestRelationGetOsmStreetsQuery(unittest.TestCase):
-    """Tests Relation.get_osm_streets_query()."""
+    """Tests RelationQueries.get_osm_streets_query()."""
     def test_happy(self) -> None:
         """Tests the happy path."""
         relations = get_relations()
         self.assertEqual(os.path.join(os.path.dirname(__file__), "workdir"), relations.get_workdir())
-        relation_name = "gazdagret"
-        relation = relations.get_relation(relation_name)
-        ret = relation.get_osm_streets_query()
+        ret = relations.get_relation("gazdagret").get_queries().get_osm_streets_query()
         self.assertEqual(ret, 'aaa 2713748 bbb 3602713748 ccc\n')
 
 
 class TestRelationGetOsmHousenumbersQuery(unittest.TestCase):
-    """Tests Relation.get_osm_housenumbers_query()."""
+    """Tests RelationQueries.get_osm_housenumbers_query()."""
     def test_happy(self) -> None:
         """Tests the happy path."""
-        relations = get_relations()
-        relation_name = "gazdagret"
-        relation = relations.get_relation(relation_name)
-        ret = relation.get_osm_housenumbers_query()
+        ret = get_relations().get_relation("gazdagret").get_queries().get_osm_housenumbers_query()
         self.assertEqual(ret, 'housenr aaa 2713748 bbb 3602713748 ccc\n')
 
 
+class TestRelationGetOsmStreetsHousenumbersQuery(unittest.TestCase):
+    """Tests RelationQueries.get_osm_streets_housenumbers_query()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        ret = get_relations().get_relation("gazdagret").get_queries().get_osm_streets_housenumbers_query()
+        self.assertEqual(ret, 'streets-housenumbers aaa 2713748 bbb 3602713748 ccc\n')
+
+
+class TestRelationGetOsmChangesQuery(unittest.TestCase):
+    """Tests RelationQueries.get_osm_changes_query()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        queries = get_relations().get_relation("gazdagret").get_queries()
+        ret = queries.get_osm_changes_query("2019-11-20T03:00:00Z")
+        self.assertEqual(ret, 'changes aaa 2713748 bbb 3602713748 ccc 2019-11-20T03:00:00Z\n')
+
+
+class TestRelationStampsOsmStamp(unittest.TestCase):
+    """Tests RelationStamps.read_osm_stamp() and RelationStamps.write_osm_stamp()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        with tempfile.TemporaryDirectory() as workdir:
+            stamps = helpers.Relation("data", workdir, "gazdagret", {}).get_stamps()
+            self.assertIsNone(stamps.read_osm_stamp())
+            stamps.write_osm_stamp(("2019-11-20T03:00:00Z", 42))
+            self.assertEqual(stamps.read_osm_stamp(), ("2019-11-20T03:00:00Z", 42))
+
+    def test_bad(self) -> None:
+        """Tests the case when the stamp is not in the expected format."""
+        with tempfile.TemporaryDirectory() as workdir:
+            stamps = helpers.Relation("data", workdir, "gazdagret", {}, storage.FileStorage()).get_stamps()
+            with open(stamps.get_osm_stamp_path(), "w") as stream:
+                stream.write("2019-11-20T03:00:00Z\n")
+            self.assertIsNone(stamps.read_osm_stamp())
+
+
+class TestRelationsGetRelation(unittest.TestCase):
+    """Tests Relations.get_relation()."""
+    def test_new(self) -> None:
+        """Tests that a relation without config doesn't show up in other Relations objects."""
+        relations = get_relations()
+        relations.get_relation("newrelation")
+        self.assertIn("newrelation", relations.get_names())
+        self.assertNotIn("newrelation", get_relations().get_names())
+
+
+class TestRelationStampsNeedsUpdate(unittest.TestCase):
+    """Tests RelationStamps.needs_update()."""
+    def test_happy(self) -> None:
+        """Tests the happy path: a newer relation config only invalidates derived files."""
+        with tempfile.TemporaryDirectory() as datadir:
+            with tempfile.TemporaryDirectory() as workdir:
+                relation = helpers.Relation(datadir, workdir, "gazdagret", {}, storage.FileStorage())
+                files = relation.get_files()
+                stamps = relation.get_stamps()
+                references = [os.path.join(datadir, "hazszamok.tsv")]
+                paths = [
+                    references[0],
+                    files.get_osm_streets_path(),
+                    files.get_osm_housenumbers_path(),
+                    files.get_ref_streets_path(),
+                    files.get_ref_housenumbers_path(),
+                    files.get_housenumbers_percent_path(),
+                    files.get_streets_percent_path(),
+                    files.get_config_path(),
+                ]
+                for index, path in enumerate(paths):
+                    with open(path, "w"):
+                        pass
+                    os.utime(path, (index, index))
+                stamps.update_version_stamp()
+                os.utime(stamps.get_version_path(), (0, 0))
+                # The config is the newest, so all derived files are outdated.
+                self.assertTrue(stamps.needs_update(files.get_ref_housenumbers_path(), references))
+                self.assertTrue(stamps.needs_update(files.get_housenumbers_percent_path(), references))
+                self.assertTrue(stamps.needs_update(files.get_streets_percent_path(), references))
+                os.utime(files.get_config_path(), (0, 0))
+                self.assertFalse(stamps.needs_update(files.get_ref_housenumbers_path(), references))
+                self.assertFalse(stamps.needs_update(files.get_housenumbers_percent_path(), references))
+                self.assertFalse(stamps.needs_update(files.get_streets_percent_path(), references))
+                # A newer reference only invalidates the reference house numbers directly.
+                os.utime(references[0], (10, 10))
+                self.assertTrue(stamps.needs_update(files.get_ref_housenumbers_path(), references))
+                self.assertFalse(stamps.needs_update(files.get_streets_percent_path(), references))
+
+    def test_osm_housenumbers(self) -> None:
+        """Tests that newer OSM house numbers alone outdate the files built from the OSM streets."""
+        with tempfile.TemporaryDirectory() as datadir:
+            with tempfile.TemporaryDirectory() as workdir:
+                relation = helpers.Relation(datadir, workdir, "gazdagret", {}, storage.FileStorage())
+                files = relation.get_files()
+                stamps = relation.get_stamps()
+                stamps.update_version_stamp()
+                paths = [stamps.get_version_path(), files.get_osm_streets_path(), files.get_osm_housenumbers_path(),
+                         files.get_ref_streets_path(), files.get_ref_housenumbers_path(),
+                         files.get_streets_percent_path()]
+                for index, path in enumerate(paths):
+                    with open(path, "a"):
+                        pass
+                    os.utime(path, (index, index))
+                self.assertFalse(stamps.needs_update(files.get_ref_housenumbers_path(), []))
+                self.assertFalse(stamps.needs_update(files.get_streets_percent_path(), []))
+                os.utime(files.get_osm_housenumbers_path(), (10, 10))
+                self.assertTrue(stamps.needs_update(files.get_ref_housenumbers_path(), []))
+                self.assertTrue(stamps.needs_update(files.get_streets_percent_path(), []))
+
+    def test_version(self) -> None:
+        """Tests that a new DERIVED_FILES_VERSION outdates all derived files."""
+        with tempfile.TemporaryDirectory() as workdir:
+            relation = helpers.Relation("data", workdir, "gazdagret", {}, storage.FileStorage())
+            files = relation.get_files()
+            stamps = relation.get_stamps()
+            files.get_storage().write(files.get_streets_percent_path(), "100.00")
+            stamps.update_version_stamp()
+            os.utime(stamps.get_version_path(), (0, 0))
+            self.assertFalse(stamps.needs_update(files.get_streets_percent_path(), []))
+            # Checked again, e.g. in a new process, but the version is the same.
+            with unittest.mock.patch("helpers.VERSION_STAMPS", {}):
+                self.assertFalse(stamps.needs_update(files.get_streets_percent_path(), []))
+            with unittest.mock.patch("helpers.DERIVED_FILES_VERSION", 2):
+                self.assertTrue(stamps.needs_update(files.get_streets_percent_path(), []))
+            self.assertEqual(files.get_storage().read(stamps.get_version_path()), "2\n")
+
+
 class TestRelationFilesWriteOsmStreets(unittest.TestCase):
     """Tests RelationFiles.write_osm_streets()."""
     def test_happy(self) -> None:
@@ -187,10 +269,24 @@ class TestRelationFilesWriteOsmStreets(unittest.TestCase):
         relation = relations.get_relation(relation_name)
         result_from_overpass = "@id\tname\n1\tTűzkő utca\n2\tTörökugrató utca\n3\tOSM Name 1\n4\tHamzsabégi út\n"
         expected = helpers.get_content(relations.get_workdir(), "streets-gazdagret.csv")
-        relation.get_files().write_osm_streets(result_from_overpass)
+        relation.get_files().write_osm_streets(io.StringIO(result_from_overpass))
         actual = helpers.get_content(relations.get_workdir(), "streets-gazdagret.csv")
         self.assertEqual(actual, expected)
 
+    def test_failure(self) -> None:
+        """Tests that a failure while reading the result keeps the old file."""
+        with tempfile.TemporaryDirectory() as workdir:
+            relations = helpers.Relations(os.path.join(os.path.dirname(__file__), "data"), workdir)
+            files = relations.get_relation("gazdagret").get_files()
+            files.write_osm_streets(io.StringIO("@id\tname\n1\tTűzkő utca\n"))
+            result_from_overpass = unittest.mock.MagicMock()
+            result_from_overpass.__iter__.side_effect = OSError()
+            with self.assertRaises(OSError):
+                files.write_osm_streets(result_from_overpass)
+            self.assertEqual(files.get_storage().read(files.get_osm_streets_path()), "@id\tname\n1\tTűzkő utca\n")
+            # No leftover temporary file.
+            self.assertNotIn("streets-gazdagret.csv.", "".join(os.listdir(workdir)))
+
 
 class TestRelationFilesWriteOsmHousenumbers(unittest.TestCase):
     """Tests RelationFiles.write_osm_housenumbers()."""
@@ -208,11 +304,36 @@ class TestRelationFilesWriteOsmHousenumbers(unittest.TestCase):
         result_from_overpass += "1\tOnly In OSM utca\t1\n"
         expected = helpers.get_content(relations.get_workdir(), "street-housenumbers-gazdagret.csv")
         relation = relations.get_relation(relation_name)
-        relation.get_files().write_osm_housenumbers(result_from_overpass)
+        relation.get_files().write_osm_housenumbers(io.StringIO(result_from_overpass))
         actual = helpers.get_content(relations.get_workdir(), "street-housenumbers-gazdagret.csv")
         self.assertEqual(actual, expected)
 
 
+class TestRelationFilesWriteOsmStreetsHousenumbers(unittest.TestCase):
+    """Tests RelationFiles.write_osm_streets_housenumbers()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        with tempfile.TemporaryDirectory() as workdir:
+            relations = helpers.Relations(os.path.join(os.path.dirname(__file__), "data"), workdir)
+            relation = relations.get_relation("gazdagret")
+            with open("tests/mock/overpass-interpreter-streets-housenumbers.response-data") as stream:
+                relation.get_files().write_osm_streets_housenumbers(stream)
+            files = relation.get_files()
+            streets = files.get_storage().read(files.get_osm_streets_path()).split("\n")
+            self.assertEqual(streets[0], "@id\tname\thighway\tservice\tsurface\tleisure\t@type")
+            self.assertEqual(streets[1], "30373416\tHamzsabégi út\tsecondary\t\t\t\tway")
+            # The ways of the relation are also in the area, Overpass outputs them twice.
+            self.assertEqual(len(streets), 10)
+            expected = ["Hamzsabégi út", "OSM Name 1", "Törökugrató utca", "Tűzkő utca"]
+            self.assertEqual(relation.get_osm_streets(), expected)
+            housenumbers = files.get_storage().read(files.get_osm_housenumbers_path()).split("\n")
+            self.assertEqual(housenumbers[0], "\t".join(util.HOUSENUMBERS_COLUMNS))
+            self.assertEqual(housenumbers[2], "1299342187\tTörökugrató utca\t1\t1119\t\t\t\t\t\t\t\tnode")
+            self.assertEqual(len(housenumbers), 6)
+            house_numbers = relation.get_osm_housenumbers("Tűzkő utca")
+            self.assertEqual([i.get_number() for i in house_numbers], ["9", "10"])
+
+
 class TestGetContent(unittest.TestCase):
     """Tests get_content()."""
     def test_happy(self) -> None:
@@ -335,6 +456,49 @@ class TestRelationGetRefStreetFromOsmStreet(unittest.TestCase):
         self.assertEqual("Csiki-hegyek utca", street)
 
 
+class TestNormalizeMany(unittest.TestCase):
+    """Tests normalize_many()."""
+    def normalize_many(self, house_numbers: List[str], street_name: str) -> List[Tuple[str, str]]:
+        """Normalizes house_numbers of street_name in gazdagret, returns number-source pairs."""
+        relation = get_relations().get_relation("gazdagret")
+        normalizers = relation.get_street_ranges()
+        ret = helpers.normalize_many(relation, house_numbers, street_name, normalizers)
+        return [(i.get_number(), i.get_source()) for i in ret]
+
+    def test_happy(self) -> None:
+        """Tests the happy path: several house numbers in one call, in order."""
+        actual = self.normalize_many(["139", "137-141", "141*"], "Budaörsi út")
+        expected = [("139", "139"), ("137", "137-141"), ("139", "137-141"), ("141", "137-141"), ("141*", "141*")]
+        self.assertEqual(actual, expected)
+
+    def test_not_in_range(self) -> None:
+        """Tests that numbers outside the street's ranges are dropped, also from intervals."""
+        actual = self.normalize_many(["999", "163-167", "139"], "Budaörsi út")
+        self.assertEqual(actual, [("163", "163-167"), ("165", "163-167"), ("139", "139")])
+
+    def test_not_a_number(self) -> None:
+        """Tests that invalid house numbers are dropped without affecting the rest."""
+        actual = self.normalize_many(["x", "1;3", "x;y"], "Teszt utca")
+        self.assertEqual(actual, [("1", "1;3"), ("3", "1;3")])
+
+    def test_interpolation_all(self) -> None:
+        """Tests that an interval of an 'all' street is expanded without parity, then filtered."""
+        actual = self.normalize_many(["2-5", "10-14"], "Hamzsabégi út")
+        expected = [("2", "2-5"), ("3", "2-5"), ("4", "2-5"), ("5", "2-5"),
+                    ("10", "10-14"), ("11", "10-14"), ("12", "10-14")]
+        self.assertEqual(actual, expected)
+
+    def test_interpolation_notall(self) -> None:
+        """Tests that an interval of a 'notall' street only keeps its ends if the parity differs."""
+        actual = self.normalize_many(["2-5", "2-6", "42-1"], "Teszt utca")
+        expected = [("2", "2-5"), ("5", "2-5"), ("2", "2-6"), ("4", "2-6"), ("6", "2-6"), ("42", "42-1")]
+        self.assertEqual(actual, expected)
+
+    def test_empty(self) -> None:
+        """Tests the case when there are no house numbers."""
+        self.assertEqual(self.normalize_many([], "Budaörsi út"), [])
+
+
 class TestNormalize(unittest.TestCase):
     """Tests normalize()."""
     def test_happy(self) -> None:
@@ -486,6 +650,37 @@ class TestRelationGetOsmHouseNumbers(unittest.TestCase):
         house_numbers = relation.get_osm_housenumbers(street_name)
         self.assertEqual([i.get_number() for i in house_numbers], ["1", "2"])
 
+    def test_no_such_street(self) -> None:
+        """Tests the case when the street has no house numbers."""
+        relations = get_relations()
+        relation = relations.get_relation("gazdagret")
+        self.assertEqual(relation.get_osm_housenumbers("No such utca"), [])
+
+    def test_cached(self) -> None:
+        """Tests that the file is parsed only once for multiple streets."""
+        relations = get_relations()
+        relation = relations.get_relation("gazdagret")
+        files = relation.get_files()
+        with unittest.mock.patch.object(files, "get_osm_housenumbers_stream",
+                                        wraps=files.get_osm_housenumbers_stream) as mock_stream:
+            relation.get_osm_housenumbers("Törökugrató utca")
+            house_numbers = relation.get_osm_housenumbers("Tűzkő utca")
+            self.assertEqual(mock_stream.call_count, 1)
+        self.assertEqual([i.get_number() for i in house_numbers], ["9", "10"])
+
+    def test_invalidate(self) -> None:
+        """Tests that the cache is dropped when the file is modified."""
+        relations = get_relations()
+        relation = relations.get_relation("gazdagret")
+        files = relation.get_files()
+        with unittest.mock.patch.object(files, "get_osm_housenumbers_stream",
+                                        wraps=files.get_osm_housenumbers_stream) as mock_stream:
+            with unittest.mock.patch.object(files.get_storage(), "getmtime", lambda _path: 1.0):
+                relation.get_osm_housenumbers("Törökugrató utca")
+            with unittest.mock.patch.object(files.get_storage(), "getmtime", lambda _path: 2.0):
+                relation.get_osm_housenumbers("Törökugrató utca")
+            self.assertEqual(mock_stream.call_count, 2)
+
 
 class TestRelationGetMissingHousenumbers(unittest.TestCase):
     """Tests Relation.get_missing_housenumbers()."""
@@ -522,62 +717,6 @@ class TestRelationGetMissingStreets(unittest.TestCase):
         self.assertEqual(in_both, ['Hamzsabégi út', 'Ref Name 1', 'Törökugrató utca', 'Tűzkő utca'])
 
 
-def table_doc_to_string(table: List[List[yattag.Doc]]) -> List[List[str]]:
-    """Unwraps an escaped matrix of yattag documents into a string matrix."""
-    table_content = []
-    for row in table:
-        row_content = []
-        for cell in row:
-            row_content.append(cell.getvalue())
-        table_content.append(row_content)
-    return table_content
-
-
-class TestRelationWriteMissingHouseNumbers(unittest.TestCase):
-    """Tests Relation.write_missing_housenumbers()."""
-    def test_happy(self) -> None:
-        """Tests the happy path."""
-        relations = get_relations()
-        relation_name = "gazdagret"
-        relation = relations.get_relation(relation_name)
-        expected = helpers.get_content(relations.get_workdir(), "gazdagret.percent")
-        ret = relation.write_missing_housenumbers()
-        todo_street_count, todo_count, done_count, percent, table = ret
-        self.assertEqual(todo_street_count, 3)
-        self.assertEqual(todo_count, 5)
-        self.assertEqual(done_count, 6)
-        self.assertEqual(percent, '54.55')
-        table = table_doc_to_string(table)
-        self.assertEqual(table, [['Street name', 'Missing count', 'House numbers'],
-                                 ['Törökugrató utca', '2', '7<br />10'],
-                                 ['Tűzkő utca', '2', '1<br />2'],
-                                 ['Hamzsabégi út', '1', '1']])
-        actual = helpers.get_content(relations.get_workdir(), "gazdagret.percent")
-        self.assertEqual(actual, expected)
-
-    def test_empty(self) -> None:
-        """Tests the case when percent can't be determined."""
-        relations = get_relations()
-        relation_name = "empty"
-        relation = relations.get_relation(relation_name)
-        ret = relation.write_missing_housenumbers()
-        _todo_street_count, _todo_count, _done_count, percent, _table = ret
-        self.assertEqual(percent, '100.00')
-        os.unlink(os.path.join(relations.get_workdir(), "empty.percent"))
-        self.assertEqual({}, relation.get_config().get_filters())
-
-    def test_interpolation_all(self) -> None:
-        """Tests the case when the street is interpolation=all and coloring is wanted."""
-        relations = get_relations()
-        relation_name = "budafok"
-        relation = relations.get_relation(relation_name)
-        ret = relation.write_missing_housenumbers()
-        _todo_street_count, _todo_count, _done_count, _percent, table = ret
-        table = table_doc_to_string(table)
-        self.assertEqual(table, [['Street name', 'Missing count', 'House numbers'],
-                                 ['Vöröskúti határsor', '2', '34, <span style="color: blue;">36</span>']])
-
-
 class TestRelationWriteMissingStreets(unittest.TestCase):
     """Tests Relation.write_missing_streets()."""
     def test_happy(self) -> None:
@@ -603,7 +742,8 @@ class TestRelationWriteMissingStreets(unittest.TestCase):
         ret = relation.write_missing_streets()
         _todo_count, _done_count, percent, _streets = ret
         self.assertEqual(percent, '100.00')
-        os.unlink(os.path.join(relations.get_workdir(), "empty-streets.percent"))
+        files = relation.get_files()
+        files.get_storage().remove(files.get_streets_percent_path())
 
 
 class TestRelationBuildRefHousenumbers(unittest.TestCase):
@@ -743,6 +883,16 @@ class TestRelations(unittest.TestCase):
         # Allow seeing data of a relation even if it's not in relations.yaml.
         relations.get_relation("gh195")
 
+    def test_datadir(self) -> None:
+        """Tests get_datadir()."""
+        relations = get_relations()
+        self.assertEqual(relations.get_datadir(), os.path.join(os.path.dirname(__file__), "data"))
+
+    def test_refmegyes(self) -> None:
+        """Tests get_refmegyes()."""
+        relations = get_relations()
+        self.assertEqual(relations.get_refmegyes(), ["01", "43", "67", "98"])
+
 
 class TestRelationConfigMissingStreets(unittest.TestCase):
     """Tests RelationConfig.should_check_missing_streets()."""
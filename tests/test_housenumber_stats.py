@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2019 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""The test_housenumber_stats module covers the housenumber_stats module."""
+
+from typing import List
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+
+import helpers
+import housenumber_stats
+import stats
+
+
+class TestMain(unittest.TestCase):
+    """Tests main()."""
+    def setUp(self) -> None:
+        """Creates a workdir with a stats index."""
+        self.workdir = tempfile.mkdtemp()
+        self.config_path = os.path.join(self.workdir, "wsgi.ini")
+        with open(self.config_path, "w") as stream:
+            stream.write("[wsgi]\nworkdir = " + self.workdir + "\n")
+        relations = helpers.Relations(os.path.join(os.path.dirname(__file__), "data"), self.workdir)
+        stats_index = {
+            "gazdagret": {"missing_housenumbers": {"streets": {"A utca": 3, "B utca": 1}, "todo_count": 4,
+                                                   "done_count": 6}},
+            "budafok": {"missing_housenumbers": {"streets": {"C utca": 5}, "todo_count": 5, "done_count": 0}},
+        }
+        for name in relations.get_names():
+            stats_index.setdefault(name, {})
+        relations.get_storage().write(stats.get_stats_path(relations), json.dumps(stats_index))
+
+    def tearDown(self) -> None:
+        """Removes the workdir."""
+        shutil.rmtree(self.workdir)
+
+    def get_output(self, argv: List[str]) -> str:
+        """Runs main() with the given arguments, returns its output."""
+        def get_abspath(path: str) -> str:
+            if path == "wsgi.ini":
+                return self.config_path
+            if os.path.isabs(path):
+                return path
+            return os.path.join(os.path.dirname(__file__), path)
+        buf = io.StringIO()
+        with unittest.mock.patch('util.get_abspath', get_abspath):
+            with unittest.mock.patch('sys.argv', [""] + argv):
+                with unittest.mock.patch('sys.stdout', buf):
+                    housenumber_stats.main()
+        return buf.getvalue()
+
+    def test_top_streets(self) -> None:
+        """Tests the top streets, with a count."""
+        self.assertEqual(self.get_output(["top-streets", "2"]), "budafok\tC utca\t5\ngazdagret\tA utca\t3\n")
+
+    def test_relations(self) -> None:
+        """Tests the relation ranking."""
+        self.assertEqual(self.get_output(["relations"]), "budafok\t5\t0\ngazdagret\t4\t6\n")
+
+    def test_refmegyes(self) -> None:
+        """Tests the per-refmegye totals."""
+        self.assertEqual(self.get_output(["refmegyes"]), "43\t\t5\t0\n01\tBudapest\t4\t6\n")
+
+    def test_unknown(self) -> None:
+        """Tests the case when the query is not known."""
+        with self.assertRaises(SystemExit):
+            self.get_output(["nosuchquery"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,14 +6,22 @@
 
 """The test_overpass_query module covers the overpass_query module."""
 
+from typing import Any
 from typing import BinaryIO
 from typing import Callable
+from typing import List
 from typing import Optional
+import configparser
+import gzip
+import http.client
 import io
 import os
+import socket
 import unittest
 import unittest.mock
 import urllib.error
+import zlib
+
 import overpass_query
 
 
@@ -47,36 +55,256 @@ class TestOverpassQueryNeedSleeep(unittest.TestCase):
     """Tests overpass_query_need_sleep()."""
     def test_happy(self) -> None:
         """Tests the happy path."""
-        with unittest.mock.patch('urllib.request.urlopen', gen_urlopen("overpass-status-happy")):
+        with unittest.mock.patch('overpass_query.urlopen', gen_urlopen("overpass-status-happy")):
             self.assertEqual(overpass_query.overpass_query_need_sleep(), 0)
 
     def test_wait(self) -> None:
         """Tests the wait path."""
-        with unittest.mock.patch('urllib.request.urlopen', gen_urlopen("overpass-status-wait")):
+        with unittest.mock.patch('overpass_query.urlopen', gen_urlopen("overpass-status-wait")):
             self.assertEqual(overpass_query.overpass_query_need_sleep(), 12)
 
     def test_wait_negative(self) -> None:
         """Tests the wait for negative amount path."""
-        with unittest.mock.patch('urllib.request.urlopen', gen_urlopen("overpass-status-wait-negative")):
+        with unittest.mock.patch('overpass_query.urlopen', gen_urlopen("overpass-status-wait-negative")):
             self.assertEqual(overpass_query.overpass_query_need_sleep(), 1)
 
 
+class TestOverpassQuerySlots(unittest.TestCase):
+    """Tests overpass_query_slots()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        with unittest.mock.patch('overpass_query.urlopen', gen_urlopen("overpass-status-happy")):
+            self.assertEqual(overpass_query.overpass_query_slots(), (2, 2))
+
+    def test_wait(self) -> None:
+        """Tests the case when no slots are available."""
+        with unittest.mock.patch('overpass_query.urlopen', gen_urlopen("overpass-status-wait")):
+            self.assertEqual(overpass_query.overpass_query_slots(), (2, 0))
+
+
 class TestOverpassQuery(unittest.TestCase):
     """Tests overpass_query()."""
     def test_happy(self) -> None:
         """Tests the happy path."""
-        with unittest.mock.patch('urllib.request.urlopen', gen_urlopen("overpass-interpreter-happy")):
+        with unittest.mock.patch('overpass_query.urlopen', gen_urlopen("overpass-interpreter-happy")):
             with open("tests/mock/overpass-interpreter-happy.request-data") as stream:
                 query = stream.read()
                 ret = overpass_query.overpass_query(query)
                 self.assertEqual(ret[:3], "@id")
 
 
+def gen_connection(responses: List[Any]) -> unittest.mock.MagicMock:
+    """Generates a mock for http.client.HTTPConnection, getresponse() returns or raises the items
+    of responses."""
+    connection = unittest.mock.MagicMock()
+    connection.getresponse.side_effect = responses
+    return connection
+
+
+def gen_response(body: bytes, status: int = 200, encoding: str = "") -> unittest.mock.MagicMock:
+    """Generates a mock for http.client.HTTPResponse."""
+    response = unittest.mock.MagicMock()
+    response.status = status
+    response.read.side_effect = io.BytesIO(body).read
+    response.getheader.return_value = encoding
+    response.will_close = False
+    response.length = None
+    return response
+
+
+class TestConnectionPool(unittest.TestCase):
+    """Tests ConnectionPool."""
+    def test_happy(self) -> None:
+        """Tests the happy path: gzip is decoded and the connection is reused."""
+        connection = gen_connection([gen_response(gzip.compress(b"@id"), encoding="gzip"), gen_response(b"ok")])
+        pool = overpass_query.ConnectionPool()
+        with unittest.mock.patch('http.client.HTTPSConnection', return_value=connection) as mock_connection:
+            self.assertEqual(pool.request("https://overpass-api.de/api/interpreter", b"query"), b"@id")
+            self.assertEqual(pool.request("https://overpass-api.de/api/status"), b"ok")
+            self.assertEqual(mock_connection.call_count, 1)
+            mock_connection.assert_called_with("overpass-api.de", timeout=overpass_query.DEFAULT_CONNECT_TIMEOUT)
+        connection.sock.settimeout.assert_called_with(overpass_query.DEFAULT_READ_TIMEOUT)
+        method, path = connection.request.call_args_list[0][0]
+        self.assertEqual((method, path), ("POST", "/api/interpreter"))
+        self.assertEqual(connection.request.call_args_list[0][1]["headers"]["Accept-Encoding"], "gzip, deflate")
+        self.assertEqual(connection.request.call_args_list[1][0], ("GET", "/api/status"))
+
+    def test_http(self) -> None:
+        """Tests the case when the URL is plain HTTP and has a query string."""
+        connection = gen_connection([gen_response(b"ok")])
+        pool = overpass_query.ConnectionPool()
+        with unittest.mock.patch('http.client.HTTPConnection', return_value=connection):
+            self.assertEqual(pool.request("http://localhost:8080/api/status?x=1"), b"ok")
+        self.assertEqual(connection.request.call_args[0], ("GET", "/api/status?x=1"))
+
+    def test_stale(self) -> None:
+        """Tests the case when the server closed the idle connection."""
+        closed = http.client.RemoteDisconnected("Remote end closed connection without response")
+        stale = gen_connection([gen_response(b"1"), closed])
+        fresh = gen_connection([gen_response(b"2")])
+        pool = overpass_query.ConnectionPool()
+        with unittest.mock.patch('http.client.HTTPSConnection', side_effect=[stale, fresh]):
+            self.assertEqual(pool.request("https://overpass-api.de/api/status"), b"1")
+            self.assertEqual(pool.request("https://overpass-api.de/api/status"), b"2")
+        self.assertTrue(stale.close.called)
+
+    def test_new_connection_failure(self) -> None:
+        """Tests the case when a new connection fails: no retry."""
+        connection = gen_connection([ConnectionResetError()])
+        pool = overpass_query.ConnectionPool()
+        with unittest.mock.patch('http.client.HTTPSConnection', return_value=connection) as mock_connection:
+            with self.assertRaises(ConnectionResetError):
+                pool.request("https://overpass-api.de/api/status")
+            self.assertEqual(mock_connection.call_count, 1)
+
+    def test_timeout(self) -> None:
+        """Tests the case when a reused connection times out: no retry, but it's not reused."""
+        connection = gen_connection([gen_response(b"1"), socket.timeout()])
+        pool = overpass_query.ConnectionPool()
+        with unittest.mock.patch('http.client.HTTPSConnection', return_value=connection) as mock_connection:
+            pool.request("https://overpass-api.de/api/status")
+            with self.assertRaises(socket.timeout):
+                pool.request("https://overpass-api.de/api/status")
+            self.assertEqual(mock_connection.call_count, 1)
+        self.assertTrue(connection.close.called)
+
+    def test_will_close(self) -> None:
+        """Tests the case when the server closes the connection after the response."""
+        response = gen_response(b"1")
+        response.will_close = True
+        connection = gen_connection([response])
+        pool = overpass_query.ConnectionPool()
+        with unittest.mock.patch('http.client.HTTPSConnection', return_value=connection):
+            pool.request("https://overpass-api.de/api/status")
+        self.assertTrue(connection.close.called)
+
+    def test_http_error(self) -> None:
+        """Tests the case when the server responds with an error status."""
+        connection = gen_connection([gen_response(b"", status=429)])
+        pool = overpass_query.ConnectionPool()
+        with unittest.mock.patch('http.client.HTTPSConnection', return_value=connection):
+            with self.assertRaises(urllib.error.HTTPError):
+                pool.request("https://overpass-api.de/api/interpreter", b"query")
+
+    def test_chunks(self) -> None:
+        """Tests the case when the body is larger than a chunk."""
+        connection = gen_connection([gen_response(gzip.compress(b"@id\n1\n"), encoding="gzip")])
+        pool = overpass_query.ConnectionPool()
+        stream = io.BytesIO()
+        with unittest.mock.patch('http.client.HTTPSConnection', return_value=connection):
+            with unittest.mock.patch('overpass_query.CHUNK_SIZE', 1):
+                pool.download("https://overpass-api.de/api/interpreter", b"query", stream)
+        self.assertEqual(stream.getvalue(), b"@id\n1\n")
+
+    def test_truncated(self) -> None:
+        """Tests the case when the server closes the connection before sending the whole body."""
+        response = gen_response(b"@id")
+        response.length = 3
+        connection = gen_connection([response, gen_response(b"@id")])
+        pool = overpass_query.ConnectionPool()
+        with unittest.mock.patch('http.client.HTTPSConnection', return_value=connection) as mock_connection:
+            with self.assertRaises(http.client.IncompleteRead):
+                pool.request("https://overpass-api.de/api/interpreter", b"query")
+            # The connection is not reused.
+            pool.request("https://overpass-api.de/api/interpreter", b"query")
+            self.assertEqual(mock_connection.call_count, 2)
+
+
+class TestUrlopen(unittest.TestCase):
+    """Tests urlopen()."""
+    def test_happy(self) -> None:
+        """Tests the happy path: the shared pool is used."""
+        with unittest.mock.patch('overpass_query.CONNECTION_POOL') as mock_pool:
+            mock_pool.request.return_value = b"@id"
+            with overpass_query.urlopen("https://overpass-api.de/api/status") as stream:
+                self.assertEqual(stream.read(), b"@id")
+            mock_pool.request.assert_called_with("https://overpass-api.de/api/status", None)
+
+
+class TestOverpassQueryFile(unittest.TestCase):
+    """Tests overpass_query_file()."""
+    def test_happy(self) -> None:
+        """Tests the happy path: the result is a text stream."""
+        def download(_url: str, _data: bytes, stream: BinaryIO) -> None:
+            stream.write("@id\tname\n1\tTűzkő utca\n".encode("utf-8"))
+        with unittest.mock.patch('overpass_query.CONNECTION_POOL') as mock_pool:
+            mock_pool.download.side_effect = download
+            with overpass_query.overpass_query_file("query") as stream:
+                self.assertEqual(stream.readlines(), ["@id\tname\n", "1\tTűzkő utca\n"])
+
+
+class TestDecodeBody(unittest.TestCase):
+    """Tests decode_body()."""
+    def test_deflate(self) -> None:
+        """Tests the deflate path, both with and without a zlib wrapper."""
+        self.assertEqual(overpass_query.decode_body(zlib.compress(b"@id"), "deflate"), b"@id")
+        compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+        raw = compressor.compress(b"@id") + compressor.flush()
+        self.assertEqual(overpass_query.decode_body(raw, "deflate"), b"@id")
+
+    def test_truncated(self) -> None:
+        """Tests the case when the compressed body is truncated."""
+        with self.assertRaises(http.client.IncompleteRead):
+            overpass_query.decode_body(gzip.compress(b"@id")[:-1], "gzip")
+        with self.assertRaises(http.client.IncompleteRead):
+            overpass_query.decode_body(zlib.compress(b"@id")[:1], "deflate")
+
+    def test_deflate_chunks(self) -> None:
+        """Tests the case when the deflate header is split between chunks."""
+        decoder = overpass_query.BodyDecoder("deflate")
+        body = zlib.compress(b"@id")
+        self.assertEqual(decoder.decode(body[:1]) + decoder.decode(body[1:]) + decoder.flush(), b"@id")
+
+    def test_gzip_members(self) -> None:
+        """Tests the case when a gzip body has several members, also split between chunks."""
+        body = gzip.compress(b"@id\tname\n") + gzip.compress(b"1\tA utca\n")
+        self.assertEqual(overpass_query.decode_body(body, "gzip"), b"@id\tname\n1\tA utca\n")
+        decoder = overpass_query.BodyDecoder("gzip")
+        buf = b"".join(decoder.decode(body[i:i + 7]) for i in range(0, len(body), 7)) + decoder.flush()
+        self.assertEqual(buf, b"@id\tname\n1\tA utca\n")
+        with self.assertRaises(http.client.IncompleteRead):
+            overpass_query.decode_body(body[:-1], "gzip")
+
+    def test_deflate_trailing(self) -> None:
+        """Tests the case when a deflate body has data after its end."""
+        with self.assertRaises(ValueError):
+            overpass_query.decode_body(zlib.compress(b"@id") + b"x", "deflate")
+
+    def test_empty(self) -> None:
+        """Tests the case when a deflate body is empty."""
+        self.assertEqual(overpass_query.decode_body(b"", "deflate"), b"")
+
+    def test_identity(self) -> None:
+        """Tests the case when the body is not encoded."""
+        self.assertEqual(overpass_query.decode_body(b"@id", ""), b"@id")
+
+
+class TestGetEndpoint(unittest.TestCase):
+    """Tests get_endpoint() and get_timeouts()."""
+    def test_default(self) -> None:
+        """Tests the case when wsgi.ini has no overpass settings."""
+        with unittest.mock.patch('settings.get_config', configparser.ConfigParser):
+            self.assertEqual(overpass_query.get_endpoint(), "https://overpass-api.de/api/")
+            self.assertEqual(overpass_query.get_timeouts(), (30.0, 600.0))
+
+    def test_happy(self) -> None:
+        """Tests the case when wsgi.ini has overpass settings."""
+        config = configparser.ConfigParser()
+        config.read_dict({"wsgi": {
+            "overpass_endpoint": "http://localhost:8080/api",
+            "overpass_connect_timeout": "5",
+            "overpass_read_timeout": "60.5",
+        }})
+        with unittest.mock.patch('settings.get_config', return_value=config):
+            self.assertEqual(overpass_query.get_endpoint(), "http://localhost:8080/api/")
+            self.assertEqual(overpass_query.get_timeouts(), (5.0, 60.5))
+
+
 class TestMain(unittest.TestCase):
     """Tests main()."""
     def test_happy(self) -> None:
         """Tests the happy path."""
-        with unittest.mock.patch('urllib.request.urlopen', gen_urlopen("overpass-interpreter-happy")):
+        with unittest.mock.patch('overpass_query.urlopen', gen_urlopen("overpass-interpreter-happy")):
             buf = io.StringIO()
             with unittest.mock.patch('sys.stdout', buf):
                 argv = ["", "tests/mock/overpass-interpreter-happy.request-data"]
@@ -87,7 +315,7 @@ class TestMain(unittest.TestCase):
 
     def test_failure(self) -> None:
         """Tests the failure path."""
-        with unittest.mock.patch('urllib.request.urlopen', gen_urlopen("")):
+        with unittest.mock.patch('overpass_query.urlopen', gen_urlopen("")):
             buf = io.StringIO()
             with unittest.mock.patch('sys.stdout', buf):
                 argv = ["", "tests/mock/overpass-interpreter-happy.request-data"]
@@ -97,5 +325,41 @@ class TestMain(unittest.TestCase):
             self.assertTrue(buf.read().startswith("overpass query failed"))
 
 
+class TestParseOsmChanges(unittest.TestCase):
+    """Tests parse_osm_changes()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        data = """{
+  "version": 0.6,
+  "osm3s": {
+    "timestamp_osm_base": "2019-11-20T03:00:02Z",
+    "timestamp_areas_base": "2019-11-20T02:41:02Z"
+  },
+  "elements": [
+{
+  "type": "count",
+  "id": 0,
+  "tags": {"nodes": "1285", "ways": "163", "relations": "0", "total": "1448"}
+},
+{
+  "type": "count",
+  "id": 0,
+  "tags": {"nodes": "2", "ways": "0", "relations": "0", "total": "2"}
+}
+  ]
+}
+"""
+        self.assertEqual(overpass_query.parse_osm_changes(data), ("2019-11-20T03:00:02Z", 1448, 2))
+
+    def test_malformed(self) -> None:
+        """Tests results which are not complete, e.g. an overpass error."""
+        remark = '{"osm3s": {"timestamp_osm_base": "2019-11-20T03:00:02Z"}, "elements": [], ' + \
+            '"remark": "runtime error: Query timed out"}'
+        for data in (remark, '{"osm3s": {"timestamp_osm_base": "2019-11-20T03:00:02Z"}, "elements": [{}, {}]}',
+                     '{"elements": [{"tags": {"total": "x"}}]}', '{"osm3s": {', '[]'):
+            with self.subTest(data=data):
+                self.assertIsNone(overpass_query.parse_osm_changes(data))
+
+
 if __name__ == '__main__':
     unittest.main()
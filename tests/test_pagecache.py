@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2019 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""The test_pagecache module covers the pagecache module."""
+
+from typing import List
+from typing import Tuple
+import os
+import tempfile
+import unittest
+
+import pagecache
+
+
+class TestGetStamp(unittest.TestCase):
+    """Tests get_stamp()."""
+    def test_happy(self) -> None:
+        """Tests the happy path: missing files are part of the stamp, too."""
+        with tempfile.NamedTemporaryFile() as stream:
+            os.utime(stream.name, (42, 42))
+            self.assertEqual(pagecache.get_stamp([stream.name, "/no/such/file"]), (42, None))
+
+
+class TestGetLastModified(unittest.TestCase):
+    """Tests get_last_modified()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        self.assertEqual(pagecache.get_last_modified((1.5, None, 3.5)), 4)
+        self.assertEqual(pagecache.get_last_modified((3.0,)), 3)
+
+    def test_missing(self) -> None:
+        """Tests the case when none of the files exist."""
+        self.assertEqual(pagecache.get_last_modified((None,)), 0)
+
+
+class TestIsNotModified(unittest.TestCase):
+    """Tests is_not_modified()."""
+    def test_if_none_match(self) -> None:
+        """Tests the If-None-Match header, If-Modified-Since is only honored if it matches."""
+        since = "Thu, 01 Jan 1970 00:00:10 GMT"
+        self.assertTrue(pagecache.is_not_modified({"HTTP_IF_NONE_MATCH": '"x", W/"y"'}, '"y"', 100))
+        self.assertTrue(pagecache.is_not_modified({"HTTP_IF_NONE_MATCH": "*"}, '"y"', 100))
+        environ = {"HTTP_IF_NONE_MATCH": '"x"', "HTTP_IF_MODIFIED_SINCE": since}
+        self.assertFalse(pagecache.is_not_modified(environ, '"y"', 1))
+        environ = {"HTTP_IF_NONE_MATCH": '"y"', "HTTP_IF_MODIFIED_SINCE": since}
+        self.assertTrue(pagecache.is_not_modified(environ, '"y"', 10))
+        self.assertFalse(pagecache.is_not_modified(environ, '"y"', 11))
+
+    def test_if_modified_since(self) -> None:
+        """Tests the If-Modified-Since header."""
+        environ = {"HTTP_IF_MODIFIED_SINCE": "Thu, 01 Jan 1970 00:00:10 GMT"}
+        self.assertTrue(pagecache.is_not_modified(environ, '"y"', 10))
+        self.assertFalse(pagecache.is_not_modified(environ, '"y"', 11))
+
+    def test_bad_date(self) -> None:
+        """Tests the case when If-Modified-Since is not a date."""
+        self.assertFalse(pagecache.is_not_modified({"HTTP_IF_MODIFIED_SINCE": "yesterday"}, '"y"', 10))
+
+    def test_unconditional(self) -> None:
+        """Tests the case when the request is not conditional."""
+        self.assertFalse(pagecache.is_not_modified({}, '"y"', 10))
+
+
+class TestPageCache(unittest.TestCase):
+    """Tests PageCache."""
+    def setUp(self) -> None:
+        """Creates an input file and a page cache."""
+        handle, self.path = tempfile.mkstemp()
+        os.close(handle)
+        os.utime(self.path, (10, 10))
+        self.page_cache = pagecache.PageCache(max_size=2)
+        self.renders = []  # type: List[str]
+
+    def tearDown(self) -> None:
+        """Removes the input file."""
+        os.unlink(self.path)
+
+    def serve(
+            self,
+            key: str,
+            environ_headers: Tuple[Tuple[str, str], ...] = ()
+    ) -> Tuple[str, List[Tuple[str, str]], bytes]:
+        """Serves a page, rendering is recorded in self.renders."""
+        def render() -> Tuple[str, str]:
+            self.renders.append(key)
+            return "text/html", "<p>" + key + "</p>"
+        return self.page_cache.serve(dict(environ_headers), key, [self.path], render)
+
+    def test_happy(self) -> None:
+        """Tests the happy path: the second request doesn't render again."""
+        status, headers, body = self.serve("/osm")
+        self.assertEqual(status, "200 OK")
+        self.assertEqual(body, b"<p>/osm</p>")
+        header_dict = dict(headers)
+        self.assertEqual(header_dict["Content-type"], "text/html; charset=utf-8")
+        self.assertEqual(header_dict["Content-Length"], "11")
+        self.assertEqual(header_dict["Last-Modified"], "Thu, 01 Jan 1970 00:00:10 GMT")
+        self.assertEqual(self.serve("/osm")[2], body)
+        self.assertEqual(self.renders, ["/osm"])
+
+    def test_not_modified(self) -> None:
+        """Tests the case when the client has the current version."""
+        etag = dict(self.serve("/osm")[1])["ETag"]
+        status, headers, body = self.serve("/osm", (("HTTP_IF_NONE_MATCH", etag),))
+        self.assertEqual(status, "304 Not Modified")
+        self.assertEqual(dict(headers)["ETag"], etag)
+        self.assertEqual(body, b"")
+
+    def test_input_changed(self) -> None:
+        """Tests the case when an input file changed since the page was rendered."""
+        etag = dict(self.serve("/osm")[1])["ETag"]
+        os.utime(self.path, (20, 20))
+        status, headers, _body = self.serve("/osm", (("HTTP_IF_NONE_MATCH", etag),))
+        self.assertEqual(status, "200 OK")
+        self.assertNotEqual(dict(headers)["ETag"], etag)
+        self.assertEqual(self.renders, ["/osm", "/osm"])
+
+    def test_lru(self) -> None:
+        """Tests that the least recently used page is evicted."""
+        self.serve("a")
+        self.serve("b")
+        self.serve("a")
+        self.serve("c")
+        self.serve("a")
+        self.serve("b")
+        self.assertEqual(self.renders, ["a", "b", "c", "b"])
+        self.page_cache.clear()
+        self.serve("a")
+        self.assertEqual(self.renders, ["a", "b", "c", "b", "a"])
+
+
+if __name__ == '__main__':
+    unittest.main()
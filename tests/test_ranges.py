@@ -66,6 +66,29 @@ class TestRanges(unittest.TestCase):
         test = ranges.Ranges([ranges.Range(0, 0), ranges.Range(1, 1)])
         self.assertFalse(2 in test)
 
+    def test_overlap(self) -> None:
+        """Tests overlapping ranges with both parities."""
+        test = ranges.Ranges([ranges.Range(1, 11), ranges.Range(4, 8, interpolation="all"), ranges.Range(12, 14)])
+        self.assertEqual([i for i in range(-1, 17) if i in test], [1, 3, 4, 5, 6, 7, 8, 9, 11, 12, 14])
+
+    def test_eq(self) -> None:
+        """Tests equality code."""
+        self.assertEqual(ranges.Ranges([ranges.Range(1, 3)]), ranges.Ranges([ranges.Range(1, 3)]))
+        self.assertNotEqual(ranges.Ranges([ranges.Range(1, 3)]), ranges.Ranges([ranges.Range(1, 5)]))
+
+
+class TestCompileIntervals(unittest.TestCase):
+    """Tests compile_intervals()."""
+    def test_happy(self) -> None:
+        """Tests that intervals are cut to the parity, then merged."""
+        items = [ranges.Range(9, 11), ranges.Range(1, 3), ranges.Range(2, 6, interpolation="all"), ranges.Range(4, 4)]
+        self.assertEqual(ranges.compile_intervals(items, 1), ([1, 9], [5, 11]))
+        self.assertEqual(ranges.compile_intervals(items, 0), ([2], [6]))
+
+    def test_empty(self) -> None:
+        """Tests a range which has no number of the parity."""
+        self.assertEqual(ranges.compile_intervals([ranges.Range(3, 3, interpolation="all")], 0), ([], []))
+
 
 if __name__ == '__main__':
     unittest.main()
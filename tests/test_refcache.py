@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2019 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""The test_refcache module covers the refcache module."""
+
+import os
+import tempfile
+import unittest
+import unittest.mock
+
+import refcache
+
+
+class TestReferenceCache(unittest.TestCase):
+    """Tests ReferenceCache."""
+    def setUp(self) -> None:
+        """Writes a small reference to a temporary file."""
+        handle, self.path = tempfile.mkstemp(suffix=".cache")
+        reference = {
+            ("01", "011", "Törökugrató utca"): ["1", "10", "2"],
+            ("01", "011", "Tűzkő utca"): ["9"],
+            ("01", "012", "Törökugrató utca"): ["3"],
+            ("13", "011", "A utca"): ["1"],
+        }
+        with os.fdopen(handle, "wb") as stream:
+            refcache.write(stream, reference, (1, 2, b"3" * 32))
+
+    def tearDown(self) -> None:
+        """Removes the temporary file."""
+        os.unlink(self.path)
+
+    def test_happy(self) -> None:
+        """Tests the happy path: reference order is kept."""
+        reference_cache = refcache.ReferenceCache(self.path)
+        self.assertEqual(reference_cache.get_house_numbers("01", "011", "Törökugrató utca"), ["1", "10", "2"])
+        self.assertEqual(reference_cache.get_house_numbers("01", "011", "Tűzkő utca"), ["9"])
+        self.assertEqual(reference_cache.get_house_numbers("01", "012", "Törökugrató utca"), ["3"])
+        self.assertEqual(reference_cache.get_house_numbers("13", "011", "A utca"), ["1"])
+        reference_cache.close()
+
+    def test_missing(self) -> None:
+        """Tests the case when some or all parts of the key are missing."""
+        reference_cache = refcache.ReferenceCache(self.path)
+        self.assertEqual(reference_cache.get_house_numbers("01", "011", "No such utca"), [])
+        self.assertEqual(reference_cache.get_house_numbers("01", "013", "Tűzkő utca"), [])
+        self.assertEqual(reference_cache.get_house_numbers("13", "011", "Tűzkő utca"), [])
+        self.assertEqual(reference_cache.get_house_numbers("zz", "011", "Tűzkő utca"), [])
+        reference_cache.close()
+
+    def test_bad_format(self) -> None:
+        """Tests the case when the file is not in the expected format."""
+        with open(self.path, "wb") as stream:
+            stream.write(refcache.HEADER.pack(b"GIMMREF\0", refcache.VERSION + 1, 0, 0, b"", 0, 0, 0, -1))
+        with self.assertRaises(ValueError):
+            refcache.ReferenceCache(self.path)
+
+
+class TestReadStamp(unittest.TestCase):
+    """Tests read_stamp()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        handle, path = tempfile.mkstemp(suffix=".cache")
+        with os.fdopen(handle, "wb") as stream:
+            refcache.write(stream, {}, (1, 2, b"3" * 32))
+        self.assertEqual(refcache.read_stamp(path), (refcache.VERSION, 1, 2, b"3" * 32))
+        os.unlink(path)
+
+    def test_missing(self) -> None:
+        """Tests the case when the cache doesn't exist."""
+        self.assertIsNone(refcache.read_stamp("/no/such/file.cache"))
+
+    def test_truncated(self) -> None:
+        """Tests the case when the cache is shorter than a header."""
+        with tempfile.NamedTemporaryFile(suffix=".cache") as stream:
+            stream.write(refcache.MAGIC)
+            stream.flush()
+            self.assertIsNone(refcache.read_stamp(stream.name))
+
+    def test_bad_magic(self) -> None:
+        """Tests the case when the file is not a cache."""
+        with tempfile.NamedTemporaryFile(suffix=".cache") as stream:
+            stream.write(refcache.HEADER.pack(b"PICKLE\0\0", refcache.VERSION, 0, 0, b"", 0, 0, 0, -1))
+            stream.flush()
+            self.assertIsNone(refcache.read_stamp(stream.name))
+
+
+class TestReadRefmegyes(unittest.TestCase):
+    """Tests read_refmegyes()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        handle, path = tempfile.mkstemp(suffix=".cache")
+        with os.fdopen(handle, "wb") as stream:
+            refcache.write(stream, {("13", "011", "A utca"): ["1"]}, (1, 2, b"3" * 32), ["13", "01"])
+        self.assertEqual(refcache.read_refmegyes(path), ["01", "13"])
+        reference_cache = refcache.ReferenceCache(path)
+        self.assertEqual(reference_cache.get_house_numbers("13", "011", "A utca"), ["1"])
+        reference_cache.close()
+        os.unlink(path)
+
+    def test_all(self) -> None:
+        """Tests the case when all refmegyes are included."""
+        handle, path = tempfile.mkstemp(suffix=".cache")
+        with os.fdopen(handle, "wb") as stream:
+            refcache.write(stream, {}, (1, 2, b"3" * 32))
+        self.assertIsNone(refcache.read_refmegyes(path))
+        os.unlink(path)
+
+    def test_none(self) -> None:
+        """Tests the case when no refmegyes are included."""
+        handle, path = tempfile.mkstemp(suffix=".cache")
+        with os.fdopen(handle, "wb") as stream:
+            refcache.write(stream, {}, (1, 2, b"3" * 32), [])
+        self.assertEqual(refcache.read_refmegyes(path), [])
+        os.unlink(path)
+
+
+class TestBuild(unittest.TestCase):
+    """Tests build()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        refpath = os.path.join(os.path.dirname(__file__), "refdir", "hazszamok_kieg_20190808.tsv")
+        handle, path = tempfile.mkstemp(suffix=".cache")
+        with os.fdopen(handle, "wb") as stream:
+            refcache.build(refpath, stream, (1, 2, b"3" * 32))
+        reference_cache = refcache.ReferenceCache(path)
+        self.assertEqual(reference_cache.get_house_numbers("01", "011", "Márton Áron tér"), ["1"])
+        reference_cache.close()
+        os.unlink(path)
+
+    def test_refmegyes(self) -> None:
+        """Tests the case when only some refmegyes are wanted."""
+        refpath = os.path.join(os.path.dirname(__file__), "refdir", "hazszamok_kieg_20190808.tsv")
+        handle, path = tempfile.mkstemp(suffix=".cache")
+        with unittest.mock.patch('refcache.CHUNK_SIZE', 1):
+            with os.fdopen(handle, "wb") as stream:
+                refcache.build(refpath, stream, (1, 2, b"3" * 32), ["13"])
+        reference_cache = refcache.ReferenceCache(path)
+        self.assertEqual(reference_cache.get_house_numbers("01", "011", "Márton Áron tér"), [])
+        reference_cache.close()
+        os.unlink(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2019 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""The test_settings module covers the settings module."""
+
+import os
+import tempfile
+import unittest
+import unittest.mock
+
+import settings
+
+
+class TestGetConfig(unittest.TestCase):
+    """Tests get_config()."""
+    def test_default(self) -> None:
+        """Tests that the config next to the module is only parsed once while it's unchanged."""
+        config = settings.get_config()
+        with unittest.mock.patch('configparser.ConfigParser.read', side_effect=AssertionError):
+            self.assertIs(settings.get_config(), config)
+
+    def test_changed(self) -> None:
+        """Tests that the config is only parsed again after it changed."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "wsgi.ini")
+            with open(path, "w") as stream:
+                stream.write("[wsgi]\nlocale = en_US.UTF-8\n")
+            os.utime(path, (1, 1))
+            config = settings.get_config(path)
+            self.assertIs(settings.get_config(path), config)
+            with open(path, "w") as stream:
+                stream.write("[wsgi]\nlocale = hu_HU.UTF-8\n")
+            os.utime(path, (2, 2))
+            self.assertEqual(settings.get_config(path).get("wsgi", "locale"), "hu_HU.UTF-8")
+
+    def test_missing(self) -> None:
+        """Tests the case when the config file doesn't exist."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            config = settings.get_config(os.path.join(tmpdir, "wsgi.ini"))
+            self.assertEqual(config.sections(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2019 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""The test_stats module covers the stats module."""
+
+from typing import List
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+
+import yattag  # type: ignore
+
+import helpers
+import stats
+
+
+def get_relations() -> helpers.Relations:
+    """Returns a Relations object that uses the test data and workdir."""
+    datadir = os.path.join(os.path.dirname(__file__), "data")
+    workdir = os.path.join(os.path.dirname(__file__), "workdir")
+    return helpers.Relations(datadir, workdir)
+
+
+class TestGetStats(unittest.TestCase):
+    """Tests get_stats() and write_stats()."""
+    def test_happy(self) -> None:
+        """Tests the happy path: the index is built on first use, then updated per relation."""
+        datadir = os.path.join(os.path.dirname(__file__), "data")
+        with tempfile.TemporaryDirectory() as workdir:
+            relations = helpers.Relations(datadir, workdir)
+            stats_index = stats.get_stats(relations)
+            self.assertEqual(sorted(stats_index.keys()), relations.get_names())
+            self.assertEqual(stats_index["gazdagret"], {
+                "housenumbers_percent": None,
+                "housenumbers_percent_mtime": 0,
+                "missing_housenumbers": None,
+                "osm_housenumbers_mtime": 0,
+                "osm_streets_mtime": 0,
+                "streets_percent": None,
+                "streets_percent_mtime": 0,
+            })
+
+            files = relations.get_relation("gazdagret").get_files()
+            with files.get_housenumbers_percent_stream("w") as stream:
+                stream.write("50.00")
+            # The index is trusted, it's not checked against the files.
+            self.assertIsNone(stats.get_stats(relations)["gazdagret"]["housenumbers_percent"])
+            stats.write_stats(relations, ["gazdagret"])
+            stats_index = stats.get_stats(relations)
+            self.assertEqual(stats_index["gazdagret"]["housenumbers_percent"], "50.00")
+            mtime = files.get_storage().get_timestamp(files.get_housenumbers_percent_path())
+            self.assertGreater(mtime, 0)
+            self.assertEqual(stats_index["gazdagret"]["housenumbers_percent_mtime"], mtime)
+            self.assertEqual(sorted(stats_index.keys()), relations.get_names())
+
+    def test_rebuild(self) -> None:
+        """Tests that relations which are no longer there are dropped."""
+        datadir = os.path.join(os.path.dirname(__file__), "data")
+        with tempfile.TemporaryDirectory() as workdir:
+            relations = helpers.Relations(datadir, workdir)
+            relations.get_storage().write(stats.get_stats_path(relations), '{"removed": {}}')
+            self.assertEqual(sorted(stats.get_stats(relations).keys()), relations.get_names())
+
+    def test_unchanged(self) -> None:
+        """Tests that the index is not written again if it would not change."""
+        datadir = os.path.join(os.path.dirname(__file__), "data")
+        with tempfile.TemporaryDirectory() as workdir:
+            relations = helpers.Relations(datadir, workdir)
+            stats_index = stats.write_stats(relations)
+            with unittest.mock.patch.object(relations.get_storage(), "write") as mock_write:
+                self.assertEqual(stats.write_stats(relations, ["gazdagret"]), stats_index)
+                self.assertFalse(mock_write.called)
+
+
+class TestGetMissingHousenumbersStats(unittest.TestCase):
+    """Tests get_missing_housenumbers_stats()."""
+    def test_happy(self) -> None:
+        """Tests the happy path: the counts match write_missing_housenumbers()."""
+        relation = get_relations().get_relation("gazdagret")
+        _todo_street_count, todo_count, done_count, _percent, _table = stats.write_missing_housenumbers(relation)
+        expected = {
+            "streets": {"Törökugrató utca": 2, "Tűzkő utca": 2, "Hamzsabégi út": 1},
+            "todo_count": todo_count,
+            "done_count": done_count,
+        }
+        self.assertEqual(stats.get_missing_housenumbers_stats(relation), expected)
+
+    def test_no_cache(self) -> None:
+        """Tests that the missing house numbers are not calculated if there is no cache."""
+        datadir = os.path.join(os.path.dirname(__file__), "data")
+        with tempfile.TemporaryDirectory() as workdir:
+            relation = helpers.Relations(datadir, workdir).get_relation("gazdagret")
+            self.assertIsNone(stats.get_missing_housenumbers_stats(relation))
+            self.assertIsNone(stats.get_relation_stats(relation)["missing_housenumbers"])
+
+
+class TestGetTopMissingStreets(unittest.TestCase):
+    """Tests get_top_missing_streets() and the other queries over the stats index."""
+    def setUp(self) -> None:
+        """Creates a stats index in a temporary workdir."""
+        self.workdir = tempfile.mkdtemp()
+        datadir = os.path.join(os.path.dirname(__file__), "data")
+        self.relations = helpers.Relations(datadir, self.workdir)
+        stats_index = {
+            "gazdagret": {"missing_housenumbers": {"streets": {"A utca": 3, "B utca": 1}, "todo_count": 4,
+                                                   "done_count": 6}},
+            "ujbuda": {"missing_housenumbers": {"streets": {"A utca": 3}, "todo_count": 3, "done_count": 1}},
+            "budafok": {"missing_housenumbers": {"streets": {"C utca": 5}, "todo_count": 5, "done_count": 0}},
+            # Not updated yet.
+            "empty": {"missing_housenumbers": None},
+            # Removed from relations.yaml.
+            "removed": {"missing_housenumbers": {"streets": {"D utca": 9}, "todo_count": 9, "done_count": 0}},
+        }
+        for name in self.relations.get_names():
+            stats_index.setdefault(name, {})
+        self.relations.get_storage().write(stats.get_stats_path(self.relations), json.dumps(stats_index))
+
+    def tearDown(self) -> None:
+        """Removes the workdir."""
+        shutil.rmtree(self.workdir)
+
+    def test_top_missing_streets(self) -> None:
+        """Tests get_top_missing_streets()."""
+        expected = [("budafok", "C utca", 5), ("gazdagret", "A utca", 3), ("ujbuda", "A utca", 3)]
+        self.assertEqual(stats.get_top_missing_streets(self.relations, 3), expected)
+
+    def test_relation_missing_housenumbers(self) -> None:
+        """Tests get_relation_missing_housenumbers()."""
+        expected = [("budafok", 5, 0), ("gazdagret", 4, 6), ("ujbuda", 3, 1)]
+        self.assertEqual(stats.get_relation_missing_housenumbers(self.relations, 10), expected)
+
+    def test_refmegye_missing_housenumbers(self) -> None:
+        """Tests get_refmegye_missing_housenumbers()."""
+        expected = [("01", 7, 7), ("43", 5, 0)]
+        self.assertEqual(stats.get_refmegye_missing_housenumbers(self.relations), expected)
+
+    def test_cache(self) -> None:
+        """Tests that the index is only parsed again after it changed."""
+        stats_index = stats.get_stats(self.relations)
+        with unittest.mock.patch("json.loads", side_effect=AssertionError):
+            self.assertIs(stats.get_stats(self.relations), stats_index)
+        stats_index = stats.write_stats(self.relations, ["gazdagret"])
+        with unittest.mock.patch("json.loads", side_effect=AssertionError):
+            self.assertIs(stats.get_stats(self.relations), stats_index)
+        self.assertEqual(stats.get_top_missing_streets(self.relations, 1), [("budafok", "C utca", 5)])
+
+
+def table_doc_to_string(table: List[List[yattag.Doc]]) -> List[List[str]]:
+    """Unwraps an escaped matrix of yattag documents into a string matrix."""
+    table_content = []
+    for row in table:
+        row_content = []
+        for cell in row:
+            row_content.append(cell.getvalue())
+        table_content.append(row_content)
+    return table_content
+
+
+class TestWriteMissingHousenumbers(unittest.TestCase):
+    """Tests write_missing_housenumbers()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        relations = get_relations()
+        relation_name = "gazdagret"
+        relation = relations.get_relation(relation_name)
+        expected = helpers.get_content(relations.get_workdir(), "gazdagret.percent")
+        ret = stats.write_missing_housenumbers(relation)
+        todo_street_count, todo_count, done_count, percent, table = ret
+        self.assertEqual(todo_street_count, 3)
+        self.assertEqual(todo_count, 5)
+        self.assertEqual(done_count, 6)
+        self.assertEqual(percent, '54.55')
+        table = table_doc_to_string(table)
+        self.assertEqual(table, [['Street name', 'Missing count', 'House numbers'],
+                                 ['Törökugrató utca', '2', '7<br />10'],
+                                 ['Tűzkő utca', '2', '1<br />2'],
+                                 ['Hamzsabégi út', '1', '1']])
+        actual = helpers.get_content(relations.get_workdir(), "gazdagret.percent")
+        self.assertEqual(actual, expected)
+
+    def test_empty(self) -> None:
+        """Tests the case when percent can't be determined."""
+        relations = get_relations()
+        relation_name = "empty"
+        relation = relations.get_relation(relation_name)
+        ret = stats.write_missing_housenumbers(relation)
+        _todo_street_count, _todo_count, _done_count, percent, _table = ret
+        self.assertEqual(percent, '100.00')
+        files = relation.get_files()
+        files.get_storage().remove(files.get_housenumbers_percent_path())
+        files.get_storage().remove(files.get_housenumbers_cache_path())
+        self.assertEqual({}, relation.get_config().get_filters())
+
+    def test_interpolation_all(self) -> None:
+        """Tests the case when the street is interpolation=all and coloring is wanted."""
+        relations = get_relations()
+        relation_name = "budafok"
+        relation = relations.get_relation(relation_name)
+        ret = stats.write_missing_housenumbers(relation)
+        _todo_street_count, _todo_count, _done_count, _percent, table = ret
+        table = table_doc_to_string(table)
+        self.assertEqual(table, [['Street name', 'Missing count', 'House numbers'],
+                                 ['Vöröskúti határsor', '2', '34, <span style="color: blue;">36</span>']])
+
+
+class TestReadMissingHousenumbers(unittest.TestCase):
+    """Tests read_missing_housenumbers()."""
+    def test_happy(self) -> None:
+        """Tests the happy path: the second read doesn't compare ref and osm again."""
+        relations = get_relations()
+        relation = relations.get_relation("gazdagret")
+        expected = stats.write_missing_housenumbers(relation)
+        with unittest.mock.patch('helpers.Relation.get_missing_housenumbers', side_effect=AssertionError):
+            actual = stats.read_missing_housenumbers(relation)
+        self.assertEqual(actual[:4], expected[:4])
+        self.assertEqual(table_doc_to_string(actual[4]), table_doc_to_string(expected[4]))
+
+    def test_outdated(self) -> None:
+        """Tests the case when the cache is older than its inputs."""
+        relations = get_relations()
+        relation = relations.get_relation("gazdagret")
+        stats.write_missing_housenumbers(relation)
+        os.utime(relation.get_files().get_housenumbers_cache_path(), (0, 0))
+        ret = stats.read_missing_housenumbers(relation)
+        _todo_street_count, _todo_count, _done_count, percent, _table = ret
+        self.assertEqual(percent, '54.55')
+        self.assertFalse(relation.get_stamps().needs_update(relation.get_files().get_housenumbers_cache_path(), []))
+
+
+class TestGetMissingHousenumbersCached(unittest.TestCase):
+    """Tests get_missing_housenumbers_cached()."""
+    def test_happy(self) -> None:
+        """Tests the happy path: house number sources survive the cache."""
+        relations = get_relations()
+        relation = relations.get_relation("gazdagret")
+        stats.write_missing_housenumbers(relation)
+        # Outdated cache: calculated again.
+        os.utime(relation.get_files().get_housenumbers_cache_path(), (0, 0))
+        expected = stats.get_missing_housenumbers_cached(relation)
+        with unittest.mock.patch('helpers.Relation.get_missing_housenumbers', side_effect=AssertionError):
+            actual = stats.get_missing_housenumbers_cached(relation)
+        for expected_streets, actual_streets in zip(expected, actual):
+            self.assertEqual([(name, [(i.get_number(), i.get_source()) for i in numbers])
+                              for name, numbers in actual_streets],
+                             [(name, [(i.get_number(), i.get_source()) for i in numbers])
+                              for name, numbers in expected_streets])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2019 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""The test_storage module covers the storage module."""
+
+from typing import Callable
+from typing import List
+from typing import TextIO
+import concurrent.futures
+import os
+import tempfile
+import unittest
+import unittest.mock
+
+import storage
+
+
+def get_street(line: str) -> List[str]:
+    """Gets the street of a "street<tab>number" line."""
+    tokens = line.split("\t")
+    if len(tokens) < 2:
+        return []
+    return [tokens[0]]
+
+
+class StorageTestCase(unittest.TestCase):
+    """Runs a test with both backends, in an empty workdir."""
+    def run_backends(self, test: Callable[[storage.FileStorage, str], None]) -> None:
+        """Calls test() with each backend and its workdir."""
+        for name in ("files", "sqlite"):
+            with self.subTest(backend=name):
+                with tempfile.TemporaryDirectory() as workdir:
+                    backend = storage.get_storage(name, workdir)
+                    try:
+                        test(backend, workdir)
+                    finally:
+                        del storage.STORAGES[(name, workdir)]
+
+
+class TestWrite(StorageTestCase):
+    """Tests FileStorage.write() and the read functions."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        def test(backend: storage.FileStorage, workdir: str) -> None:
+            path = os.path.join(workdir, "a.csv")
+            missing = os.path.join(workdir, "missing.csv")
+            self.assertFalse(backend.exists(path))
+            with self.assertRaises(FileNotFoundError):
+                backend.getmtime(path)
+            with self.assertRaises(FileNotFoundError):
+                backend.read(path)
+            backend.write(path, "árvíztűrő\n")
+            self.assertTrue(backend.exists(path))
+            self.assertEqual(backend.read(path), "árvíztűrő\n")
+            self.assertEqual(backend.read_many([path, missing]), {path: "árvíztűrő\n"})
+            mtimes = backend.get_mtimes([path, missing])
+            self.assertEqual(list(mtimes.keys()), [path])
+            self.assertEqual(mtimes[path], backend.getmtime(path))
+        self.run_backends(test)
+
+    def test_many(self) -> None:
+        """Tests reading more files than the number of parameters in a single query."""
+        def test(backend: storage.FileStorage, workdir: str) -> None:
+            paths = [os.path.join(workdir, str(i)) for i in range(3)]
+            for path in paths:
+                backend.write(path, path)
+            with unittest.mock.patch("storage.MAX_PARAMETERS", 2):
+                self.assertEqual(backend.read_many(paths), {path: path for path in paths})
+        self.run_backends(test)
+
+    def test_stream(self) -> None:
+        """Tests write_stream()."""
+        def test(backend: storage.FileStorage, workdir: str) -> None:
+            def write(stream: TextIO) -> None:
+                stream.write("street\tnumber\nA\t1\n")
+            path = os.path.join(workdir, "a.csv")
+            backend.write_stream(path, write, key=get_street)
+            self.assertEqual(backend.read(path), "street\tnumber\nA\t1\n")
+            self.assertEqual(backend.get_lines(path, ["A"], get_street), {"A": ["A\t1"]})
+        self.run_backends(test)
+
+    def test_stream_chunks(self) -> None:
+        """Tests that write_stream() content can span several chunks and write() replaces them."""
+        def test(backend: storage.FileStorage, workdir: str) -> None:
+            def write(stream: TextIO) -> None:
+                stream.write("street\tnumber\n")
+                stream.write("A\t1\nB\t2\nA\t3\n")
+            paths = [os.path.join(workdir, "a.csv"), os.path.join(workdir, "b.csv")]
+            with unittest.mock.patch("storage.CHUNK_SIZE", 4):
+                for path in paths:
+                    backend.write_stream(path, write, key=get_street)
+            expected = "street\tnumber\nA\t1\nB\t2\nA\t3\n"
+            self.assertEqual(backend.read(paths[0]), expected)
+            self.assertEqual(backend.read_many(paths), {paths[0]: expected, paths[1]: expected})
+            self.assertEqual(backend.get_lines(paths[0], ["A"], get_street), {"A": ["A\t1", "A\t3"]})
+            backend.write(paths[0], "B\t4\n")
+            self.assertEqual(backend.read(paths[0]), "B\t4\n")
+            self.assertEqual(backend.get_lines(paths[0], ["A", "B"], get_street), {"B": ["B\t4"]})
+            backend.remove(paths[1])
+            self.assertFalse(backend.exists(paths[1]))
+        self.run_backends(test)
+
+
+class TestOpen(StorageTestCase):
+    """Tests FileStorage.open()."""
+    def test_happy(self) -> None:
+        """Tests the happy path: the file is written when the stream is closed."""
+        def test(backend: storage.FileStorage, workdir: str) -> None:
+            path = os.path.join(workdir, "a.lst")
+            with backend.open(path, "w") as stream:
+                stream.write("a\n")
+                stream.write("b\n")
+            stream.close()
+            with backend.open(path, "r") as stream:
+                self.assertEqual(stream.readlines(), ["a\n", "b\n"])
+        self.run_backends(test)
+
+
+class TestRemove(StorageTestCase):
+    """Tests FileStorage.remove()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        def test(backend: storage.FileStorage, workdir: str) -> None:
+            path = os.path.join(workdir, "a.lst")
+            backend.write(path, "a\n")
+            backend.remove(path)
+            self.assertFalse(backend.exists(path))
+            with self.assertRaises(FileNotFoundError):
+                backend.remove(path)
+        self.run_backends(test)
+
+
+class TestGetLines(StorageTestCase):
+    """Tests FileStorage.get_lines()."""
+    def test_happy(self) -> None:
+        """Tests the happy path: lines are grouped by key, in file order."""
+        def test(backend: storage.FileStorage, workdir: str) -> None:
+            path = os.path.join(workdir, "a.csv")
+            backend.write(path, "street\tnumber\nB\t1\nA\t2\nB\t3\n", key=get_street)
+            expected = {"B": ["B\t1", "B\t3"], "A": ["A\t2"]}
+            self.assertEqual(backend.get_lines(path, ["A", "B", "C"], get_street), expected)
+            with unittest.mock.patch("storage.MAX_PARAMETERS", 1):
+                self.assertEqual(backend.get_lines(path, ["A", "B"], get_street), expected)
+        self.run_backends(test)
+
+    def test_not_indexed(self) -> None:
+        """Tests the case when the file was written without a key."""
+        def test(backend: storage.FileStorage, workdir: str) -> None:
+            path = os.path.join(workdir, "a.csv")
+            backend.write(path, "B\t1\nA\t2\n")
+            self.assertEqual(backend.get_lines(path, ["A"], get_street), {"A": ["A\t2"]})
+        self.run_backends(test)
+
+
+class TestTransaction(StorageTestCase):
+    """Tests FileStorage.transaction()."""
+    def test_happy(self) -> None:
+        """Tests the happy path: nested transactions are committed at the end."""
+        def test(backend: storage.FileStorage, workdir: str) -> None:
+            paths = [os.path.join(workdir, "a"), os.path.join(workdir, "b")]
+            with backend.transaction():
+                with backend.transaction():
+                    backend.write(paths[0], "a")
+                backend.write(paths[1], "b")
+            self.assertEqual(backend.read_many(paths), {paths[0]: "a", paths[1]: "b"})
+        self.run_backends(test)
+
+    def test_rollback(self) -> None:
+        """Tests that nothing is written by a failed transaction."""
+        backend = storage.SqliteStorage(":memory:")
+        with self.assertRaises(ValueError):
+            with backend.transaction():
+                backend.write("a", "a")
+                with backend.transaction():
+                    raise ValueError()
+        self.assertFalse(backend.exists("a"))
+
+
+class TestSqliteStorage(unittest.TestCase):
+    """Tests SqliteStorage."""
+    def test_fallback(self) -> None:
+        """Tests that files which are not in the database are read from the file system."""
+        with tempfile.TemporaryDirectory() as workdir:
+            path = os.path.join(workdir, "a.lst")
+            with open(path, "w") as stream:
+                stream.write("a\n")
+            os.utime(path, (42, 42))
+            backend = storage.SqliteStorage(os.path.join(workdir, "workdir.sqlite"))
+            self.assertTrue(backend.exists(path))
+            self.assertEqual(backend.getmtime(path), 42)
+            self.assertEqual(backend.read(path), "a\n")
+            # The database wins once the file is written.
+            backend.write(path, "b\n")
+            self.assertEqual(backend.read(path), "b\n")
+            self.assertNotEqual(backend.getmtime(path), 42)
+            # Removing the file doesn't uncover the old version.
+            backend.remove(path)
+            self.assertFalse(backend.exists(path))
+
+    def test_threads(self) -> None:
+        """Tests that threads have their own connection to the same database."""
+        with tempfile.TemporaryDirectory() as workdir:
+            backend = storage.SqliteStorage(os.path.join(workdir, "workdir.sqlite"))
+            backend.write("a", "a")
+            with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+                self.assertEqual(executor.submit(backend.read, "a").result(), "a")
+
+
+class TestGetStorage(unittest.TestCase):
+    """Tests get_storage()."""
+    def test_happy(self) -> None:
+        """Tests the happy path: backends are shared, the default comes from the environment."""
+        with tempfile.TemporaryDirectory() as workdir:
+            try:
+                sqlite = storage.get_storage("sqlite", workdir)
+                self.assertIsInstance(sqlite, storage.SqliteStorage)
+                self.assertIs(storage.get_storage("sqlite", workdir), sqlite)
+                self.assertEqual(sqlite.get_name(), "sqlite")
+                with unittest.mock.patch.dict(os.environ, {"GIMMISN_STORAGE": "sqlite"}):
+                    self.assertIs(storage.get_storage("", workdir), sqlite)
+                with unittest.mock.patch.dict(os.environ, {"GIMMISN_STORAGE": "files"}):
+                    files = storage.get_storage("", workdir)
+                    self.assertNotIsInstance(files, storage.SqliteStorage)
+                    self.assertEqual(files.get_name(), "files")
+            finally:
+                storage.STORAGES.pop(("sqlite", workdir))
+                storage.STORAGES.pop(("files", workdir))
+
+    def test_unknown(self) -> None:
+        """Tests the case when the backend name is not known."""
+        with self.assertRaises(ValueError):
+            storage.get_storage("nosuchstorage", "workdir")
+
+
+class TestGetTimestamp(StorageTestCase):
+    """Tests FileStorage.get_timestamp()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        def test(backend: storage.FileStorage, workdir: str) -> None:
+            path = os.path.join(workdir, "a.txt")
+            self.assertEqual(backend.get_timestamp(path), 0)
+            backend.write(path, "a\n")
+            self.assertEqual(backend.get_timestamp(path), backend.getmtime(path))
+        self.run_backends(test)
+
+
+class TestMissingCounts(StorageTestCase):
+    """Tests FileStorage.get_top_missing_streets() and FileStorage.get_missing_totals()."""
+    def test_happy(self) -> None:
+        """Tests the happy path: the indexed counts give the same result as counts()."""
+        counts = [
+            ("a", "01", None, 0, 6), ("a", "01", "A utca", 3, 0), ("a", "01", "B utca", 1, 0),
+            ("b", "01", None, 0, 1), ("b", "01", "A utca", 3, 0),
+            ("c", "43", None, 0, 0), ("c", "43", "C utca", 5, 0),
+        ]  # type: List[storage.MissingCount]
+
+        def test(backend: storage.FileStorage, workdir: str) -> None:
+            path = os.path.join(workdir, "stats.json")
+            for indexed in (False, True):
+                backend.write(path, "{}", counts=counts if indexed else None)
+                get_counts = unittest.mock.Mock(return_value=counts)
+                self.assertEqual(backend.get_top_missing_streets(path, 3, get_counts),
+                                 [("c", "C utca", 5), ("a", "A utca", 3), ("b", "A utca", 3)])
+                self.assertEqual(backend.get_missing_totals(path, "relation", 2, get_counts),
+                                 [("c", 5, 0), ("a", 4, 6)])
+                self.assertEqual(backend.get_missing_totals(path, "refmegye", None, get_counts),
+                                 [("01", 7, 7), ("43", 5, 0)])
+                self.assertEqual(get_counts.called, not (indexed and backend.get_name() == "sqlite"))
+                with self.assertRaises(ValueError):
+                    backend.get_missing_totals(path, "street", None, get_counts)
+        self.run_backends(test)
+
+
+class TestIsOutdated(unittest.TestCase):
+    """Tests FileStorage.is_outdated()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        with tempfile.TemporaryDirectory() as workdir:
+            path = os.path.join(workdir, "out")
+            inputs = [os.path.join(workdir, "in"), os.path.join(workdir, "no-such-in")]
+            self.assertTrue(storage.FileStorage().is_outdated(path, inputs))
+            for i in (inputs[0], path):
+                with open(i, "w"):
+                    pass
+            os.utime(inputs[0], (1, 1))
+            os.utime(path, (2, 2))
+            self.assertFalse(storage.FileStorage().is_outdated(path, inputs))
+            os.utime(inputs[0], (3, 3))
+            self.assertTrue(storage.FileStorage().is_outdated(path, inputs))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,14 +6,20 @@
 
 """The test_util module covers the util module."""
 
+from typing import Any
+from typing import BinaryIO
+from typing import Callable
 import io
 import os
+import pickle
+import tempfile
 import unittest
 import unittest.mock
 import urllib.error
 
 import yattag  # type: ignore
 
+import refcache
 import util
 
 
@@ -31,6 +37,10 @@ class TestFormatEvenOdd(unittest.TestCase):
         """Tests when we have even numbers only."""
         self.assertEqual(util.format_even_odd(["2", "4"], doc=None), ["2, 4"])
 
+    def test_sort(self) -> None:
+        """Tests that both parities are sorted numerically."""
+        self.assertEqual(util.format_even_odd(["10", "9", "2", "1a", "1"], doc=None), ["1, 1a, 9", "2, 10"])
+
     def test_html(self) -> None:
         """Tests HTML coloring."""
         doc = yattag.Doc()
@@ -82,28 +92,301 @@ class TestBuildReferenceCache(unittest.TestCase):
         """Tests the happy path."""
         refdir = os.path.join(os.path.dirname(__file__), "refdir")
         refpath = os.path.join(refdir, "hazszamok_20190511.tsv")
-        memory_cache = util.build_reference_cache(refpath)
-        expected = {'01': {'011': {'Ref Name 1': ['1', '2'],
-                                   'Törökugrató utca': ['1', '10', '11', '12', '2', '7'],
-                                   'Tűzkő utca': ['1', '10', '2', '9'],
-                                   'Hamzsabégi út': ['1']}}}
-        self.assertEqual(memory_cache, expected)
-        os.unlink(refpath + ".pickle")
+        if os.path.exists(refpath + ".cache"):
+            os.unlink(refpath + ".cache")
+        reference_cache = util.build_reference_cache(refpath)
+        self.assertEqual(reference_cache.get_house_numbers("01", "011", "Ref Name 1"), ['1', '2'])
+        self.assertEqual(reference_cache.get_house_numbers("01", "011", "Törökugrató utca"),
+                         ['1', '10', '11', '12', '2', '7'])
+        self.assertEqual(reference_cache.get_house_numbers("01", "011", "Tűzkő utca"), ['1', '10', '2', '9'])
+        self.assertEqual(reference_cache.get_house_numbers("01", "011", "Hamzsabégi út"), ['1'])
+        reference_cache.close()
+        os.unlink(refpath + ".cache")
 
     def test_cached(self) -> None:
-        """Tests the case when the pickle cache is already available."""
+        """Tests the case when the indexed cache is already available."""
         refdir = os.path.join(os.path.dirname(__file__), "refdir")
         refpath = os.path.join(refdir, "hazszamok_20190511.tsv")
-        util.build_reference_cache(refpath)
-        memory_cache = util.build_reference_cache(refpath)
-        expected = {'01': {'011': {'Hamzsabégi út': ['1'],
-                                   'Ref Name 1': ['1', '2'],
-                                   'Törökugrató utca': ['1', '10', '11', '12', '2', '7'],
-                                   'Tűzkő utca': ['1', '10', '2', '9']}}}
-        self.assertEqual(memory_cache, expected)
+        util.build_reference_cache(refpath).close()
+        reference_cache = util.build_reference_cache(refpath)
+        self.assertEqual(reference_cache.get_house_numbers("01", "011", "Hamzsabégi út"), ['1'])
+        self.assertEqual(reference_cache.get_house_numbers("01", "011", "Ref Name 1"), ['1', '2'])
+        reference_cache.close()
+        os.unlink(refpath + ".cache")
+
+
+class TestBuildStreetReferenceCacheStale(unittest.TestCase):
+    """Tests build_street_reference_cache() when the on-disk cache can't be used."""
+    def test_old_format(self) -> None:
+        """Tests the case when the pickle has no stamp."""
+        refdir = os.path.join(os.path.dirname(__file__), "refdir")
+        refpath = os.path.join(refdir, "utcak_20190514.tsv")
+        with open(refpath + ".pickle", "wb") as stream:
+            pickle.dump({'01': {'011': ['Stale utca']}}, stream)
+        memory_cache = util.build_street_reference_cache(refpath)
+        self.assertIn('Törökugrató utca', memory_cache['01']['011'])
+        os.unlink(refpath + ".pickle")
+
+    def test_corrupted(self) -> None:
+        """Tests the case when the pickle is truncated, e.g. a crash during the dump."""
+        refdir = os.path.join(os.path.dirname(__file__), "refdir")
+        refpath = os.path.join(refdir, "utcak_20190514.tsv")
+        util.build_street_reference_cache(refpath)
+        with open(refpath + ".pickle", "rb") as stream:
+            buf = stream.read()
+        with open(refpath + ".pickle", "wb") as stream:
+            stream.write(buf[:-10])
+        memory_cache = util.build_street_reference_cache(refpath)
+        self.assertIn('Törökugrató utca', memory_cache['01']['011'])
+        os.unlink(refpath + ".pickle")
+
+    def test_stale(self) -> None:
+        """Tests the case when the reference changed since the pickle was written."""
+        refdir = os.path.join(os.path.dirname(__file__), "refdir")
+        refpath = os.path.join(refdir, "utcak_20190514.tsv")
+        util.build_street_reference_cache(refpath)
+        with unittest.mock.patch('util.get_file_hash', lambda _path: b"0" * 32):
+            with unittest.mock.patch('util.parse_street_reference', lambda _path: {}):
+                # Same size, different mtime, different hash.
+                stat = os.stat(refpath)
+                os.utime(refpath, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+                memory_cache = util.build_street_reference_cache(refpath)
+                os.utime(refpath, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertEqual(memory_cache, {})
+        os.unlink(refpath + ".pickle")
+
+    def test_locked_rebuild(self) -> None:
+        """Tests the case when an other process rebuilt the cache while we waited for the lock."""
+        refdir = os.path.join(os.path.dirname(__file__), "refdir")
+        refpath = os.path.join(refdir, "utcak_20190514.tsv")
+        util.build_street_reference_cache(refpath)
+        with unittest.mock.patch('util.read_street_reference_cache', side_effect=[None, {'01': {}}]):
+            self.assertEqual(util.build_street_reference_cache(refpath), {'01': {}})
         os.unlink(refpath + ".pickle")
 
 
+class TestIsCacheFresh(unittest.TestCase):
+    """Tests is_cache_fresh()."""
+    def test_happy(self) -> None:
+        """Tests the happy path."""
+        refpath = os.path.join(os.path.dirname(__file__), "refdir", "utcak_20190514.tsv")
+        size, mtime, digest = util.get_cache_stamp(refpath)
+        self.assertTrue(util.is_cache_fresh(refpath, 1, (1, size, mtime, digest), self.fail))
+
+    def test_missing(self) -> None:
+        """Tests the case when there is no stamp."""
+        refpath = os.path.join(os.path.dirname(__file__), "refdir", "utcak_20190514.tsv")
+        self.assertFalse(util.is_cache_fresh(refpath, 1, None, self.fail))
+
+    def test_version(self) -> None:
+        """Tests the case when the cache format changed."""
+        refpath = os.path.join(os.path.dirname(__file__), "refdir", "utcak_20190514.tsv")
+        size, mtime, digest = util.get_cache_stamp(refpath)
+        self.assertFalse(util.is_cache_fresh(refpath, 2, (1, size, mtime, digest), self.fail))
+
+    def test_size(self) -> None:
+        """Tests the case when the size of the reference changed."""
+        refpath = os.path.join(os.path.dirname(__file__), "refdir", "utcak_20190514.tsv")
+        size, mtime, digest = util.get_cache_stamp(refpath)
+        self.assertFalse(util.is_cache_fresh(refpath, 1, (1, size + 1, mtime, digest), self.fail))
+
+    def test_touched(self) -> None:
+        """Tests the case when only the mtime of the reference changed."""
+        refpath = os.path.join(os.path.dirname(__file__), "refdir", "utcak_20190514.tsv")
+        size, mtime, digest = util.get_cache_stamp(refpath)
+        update_mtime = unittest.mock.Mock()
+        self.assertTrue(util.is_cache_fresh(refpath, 1, (1, size, mtime - 1, digest), update_mtime))
+        update_mtime.assert_called_once_with(mtime)
+        self.assertFalse(util.is_cache_fresh(refpath, 1, (1, size, mtime - 1, b"0" * 32), self.fail))
+
+    def test_touched_rebuild(self) -> None:
+        """Tests that the reference is not hashed again after a touch, once the hash matched."""
+        refdir = os.path.join(os.path.dirname(__file__), "refdir")
+        for refpath, build in ((os.path.join(refdir, "hazszamok_20190511.tsv"), util.build_reference_cache),
+                               (os.path.join(refdir, "utcak_20190514.tsv"), util.build_street_reference_cache)):
+            with self.subTest(refpath=refpath):
+                cache = build(refpath)
+                stat = os.stat(refpath)
+                os.utime(refpath, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+                try:
+                    with unittest.mock.patch('util.get_file_hash', side_effect=util.get_file_hash) as mock_hash:
+                        for _ in range(2):
+                            cache = build(refpath)
+                            if isinstance(cache, refcache.ReferenceCache):
+                                cache.close()
+                        self.assertEqual(mock_hash.call_count, 1)
+                finally:
+                    os.utime(refpath, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+                    for suffix in (".cache", ".pickle"):
+                        if os.path.exists(refpath + suffix):
+                            os.unlink(refpath + suffix)
+
+
+class TestBuildReferenceCacheStale(unittest.TestCase):
+    """Tests build_reference_cache() when the on-disk cache can't be used."""
+    def test_old_format(self) -> None:
+        """Tests the case when the cache is not in the indexed format."""
+        refdir = os.path.join(os.path.dirname(__file__), "refdir")
+        refpath = os.path.join(refdir, "hazszamok_20190511.tsv")
+        with open(refpath + ".cache", "wb") as stream:
+            pickle.dump({}, stream)
+        reference_cache = util.build_reference_cache(refpath)
+        self.assertEqual(reference_cache.get_house_numbers("01", "011", "Hamzsabégi út"), ['1'])
+        reference_cache.close()
+        os.unlink(refpath + ".cache")
+
+    def test_locked_rebuild(self) -> None:
+        """Tests the case when an other process rebuilt the cache while we waited for the lock."""
+        refdir = os.path.join(os.path.dirname(__file__), "refdir")
+        refpath = os.path.join(refdir, "hazszamok_20190511.tsv")
+        util.build_reference_cache(refpath).close()
+        with unittest.mock.patch('util.is_cache_fresh', side_effect=[False, True]):
+            with unittest.mock.patch('refcache.build') as mock_build:
+                util.build_reference_cache(refpath).close()
+                self.assertFalse(mock_build.called)
+        os.unlink(refpath + ".cache")
+
+
+class TestBuildReferenceCacheRefmegyes(unittest.TestCase):
+    """Tests build_reference_cache() when only some refmegyes are wanted."""
+    def test_happy(self) -> None:
+        """Tests the happy path: other refmegyes are not included."""
+        refdir = os.path.join(os.path.dirname(__file__), "refdir")
+        refpath = os.path.join(refdir, "hazszamok_20190511.tsv")
+        reference_cache = util.build_reference_cache(refpath, ["13"])
+        self.assertEqual(reference_cache.get_house_numbers("01", "011", "Hamzsabégi út"), [])
+        reference_cache.close()
+        reference_cache = util.build_reference_cache(refpath, ["01"])
+        self.assertEqual(reference_cache.get_house_numbers("01", "011", "Hamzsabégi út"), ['1'])
+        reference_cache.close()
+        # Refmegyes from the previous build are kept.
+        self.assertEqual(refcache.read_refmegyes(refpath + ".cache"), ["01", "13"])
+        os.unlink(refpath + ".cache")
+
+    def test_included(self) -> None:
+        """Tests the case when the cache already includes the wanted refmegyes."""
+        refdir = os.path.join(os.path.dirname(__file__), "refdir")
+        refpath = os.path.join(refdir, "hazszamok_20190511.tsv")
+        util.build_reference_cache(refpath, ["01", "13"]).close()
+        with unittest.mock.patch('refcache.build') as mock_build:
+            util.build_reference_cache(refpath, ["01"]).close()
+            self.assertFalse(mock_build.called)
+        # All refmegyes are wanted: rebuild.
+        util.build_reference_cache(refpath).close()
+        self.assertIsNone(refcache.read_refmegyes(refpath + ".cache"))
+        with unittest.mock.patch('refcache.build') as mock_build:
+            util.build_reference_caches([refpath], ["01"])[0].close()
+            self.assertFalse(mock_build.called)
+        os.unlink(refpath + ".cache")
+
+
+class TestWriteAtomically(unittest.TestCase):
+    """Tests write_atomically()."""
+    def test_failure(self) -> None:
+        """Tests that a failing write keeps the old content and leaves no temporary file behind."""
+        workdir = os.path.join(os.path.dirname(__file__), "workdir")
+        path = os.path.join(workdir, "atomic.txt")
+
+        def write(stream: BinaryIO) -> None:
+            stream.write(b"old")
+        util.write_atomically(path, write)
+
+        def fail(stream: BinaryIO) -> None:
+            stream.write(b"partial")
+            raise OSError()
+        with self.assertRaises(OSError):
+            util.write_atomically(path, fail)
+        with open(path, "rb") as stream:
+            self.assertEqual(stream.read(), b"old")
+        self.assertEqual([i for i in os.listdir(workdir) if i.startswith("atomic.txt")], ["atomic.txt"])
+        os.unlink(path)
+
+
+class TestYamlCache(unittest.TestCase):
+    """Tests YamlCache."""
+    def test_happy(self) -> None:
+        """Tests that a file is only parsed again after it changed."""
+        yaml_cache = util.YamlCache()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "relations.yaml")
+            with open(path, "w") as stream:
+                stream.write("gazdagret:\n  osmrelation: 42\n")
+            os.utime(path, (1, 1))
+            data = yaml_cache.load(path)
+            self.assertEqual(data, {"gazdagret": {"osmrelation": 42}})
+            with unittest.mock.patch('yaml.load', side_effect=AssertionError):
+                self.assertIs(yaml_cache.load(path), data)
+            with open(path, "w") as stream:
+                stream.write("gazdagret:\n  osmrelation: 43\n")
+            os.utime(path, (2, 2))
+            self.assertEqual(yaml_cache.load(path), {"gazdagret": {"osmrelation": 43}})
+
+
+class TestReferenceCacheLru(unittest.TestCase):
+    """Tests ReferenceCacheLru."""
+    def test_happy(self) -> None:
+        """Tests that the 2nd lookup of the same reference is a hit."""
+        refdir = os.path.join(os.path.dirname(__file__), "refdir")
+        refpath = os.path.join(refdir, "hazszamok_20190511.tsv")
+        lru = util.ReferenceCacheLru(max_size=1024 * 1024)
+        first = lru.get(refpath)
+        second = lru.get(refpath)
+        self.assertIs(first, second)
+        self.assertEqual(lru.get_hits(), 1)
+        self.assertEqual(lru.get_misses(), 1)
+        self.assertEqual(second.get_house_numbers("01", "011", "Hamzsabégi út"), ['1'])
+
+    def test_modified(self) -> None:
+        """Tests that a modified reference is a miss."""
+        refdir = os.path.join(os.path.dirname(__file__), "refdir")
+        refpath = os.path.join(refdir, "hazszamok_20190511.tsv")
+        lru = util.ReferenceCacheLru(max_size=1024 * 1024)
+        with unittest.mock.patch("os.path.getmtime", lambda _path: 1.0):
+            first = lru.get(refpath)
+        with unittest.mock.patch("os.path.getmtime", lambda _path: 2.0):
+            second = lru.get(refpath)
+        self.assertIsNot(first, second)
+        self.assertEqual(lru.get_hits(), 0)
+        self.assertEqual(lru.get_misses(), 2)
+        # The replaced reference cache is not closed, it may be still in use.
+        self.assertEqual(first.get_house_numbers("01", "011", "Hamzsabégi út"), ['1'])
+        self.assertEqual(second.get_house_numbers("01", "011", "Hamzsabégi út"), ['1'])
+        # An older version is not looked up again, but it's not a reason to evict the newer one.
+        with unittest.mock.patch("os.path.getmtime", lambda _path: 1.0):
+            self.assertIsNot(lru.get(refpath), first)
+        with unittest.mock.patch("os.path.getmtime", lambda _path: 2.0):
+            self.assertIs(lru.get(refpath), second)
+
+    def test_refmegyes(self) -> None:
+        """Tests that lookups which only differ in refmegyes don't evict each other."""
+        refdir = os.path.join(os.path.dirname(__file__), "refdir")
+        refpath = os.path.join(refdir, "hazszamok_20190511.tsv")
+        lru = util.ReferenceCacheLru(max_size=1024 * 1024)
+        first = lru.get(refpath, ["01"])
+        second = lru.get(refpath)
+        self.assertIs(lru.get(refpath, ["01"]), first)
+        self.assertIs(lru.get(refpath), second)
+        self.assertEqual(lru.get_hits(), 2)
+
+    def test_evict(self) -> None:
+        """Tests that the least recently used reference is evicted when the size limit is hit."""
+        refdir = os.path.join(os.path.dirname(__file__), "refdir")
+        refpath = os.path.join(refdir, "hazszamok_20190511.tsv")
+        refpath2 = os.path.join(refdir, "hazszamok_kieg_20190808.tsv")
+        lru = util.ReferenceCacheLru(max_size=1)
+        first = lru.get(refpath)
+        second = lru.get(refpath2)
+        # The evicted reference cache is not closed, it may be still in use.
+        self.assertEqual(first.get_house_numbers("01", "011", "Hamzsabégi út"), ['1'])
+        third = lru.get(refpath)
+        self.assertIsNot(first, third)
+        self.assertEqual(third.get_house_numbers("01", "011", "Hamzsabégi út"), ['1'])
+        # The second one was evicted by the third one.
+        self.assertIsNot(lru.get(refpath2), second)
+        self.assertEqual(lru.get_hits(), 0)
+        self.assertEqual(lru.get_misses(), 4)
+
+
 class TestSplitHouseNumber(unittest.TestCase):
     """Tests split_house_number()."""
     def test_only_number(self) -> None:
@@ -118,6 +401,19 @@ class TestSplitHouseNumber(unittest.TestCase):
         """Tests just suffixes."""
         self.assertEqual(util.split_house_number('a'), (0, 'a'))
 
+    def test_newline(self) -> None:
+        """Tests the regex fallback, which is used when the remainder has a newline."""
+        self.assertEqual(util.split_house_number('42a\n'), (42, 'a'))
+        self.assertEqual(util.split_house_number('\n'), (0, '\n'))
+        self.assertEqual(util.split_house_number('42a\nb'), (0, ''))
+
+    def test_cache(self) -> None:
+        """Tests that the result is cached."""
+        util.split_house_number.cache_clear()
+        util.split_house_number('42')
+        util.split_house_number('42')
+        self.assertEqual(util.split_house_number.cache_info().hits, 1)
+
 
 class TestParseFilters(unittest.TestCase):
     """Tests parse_filters()."""
@@ -253,6 +549,17 @@ class TestHouseNumber(unittest.TestCase):
                                   util.HouseNumber("2", "1-2"),
                                   util.HouseNumber("2", "1-2")])), 2)
 
+    def test_not_house_number(self) -> None:
+        """Tests comparing with something which is not a house number."""
+        self.assertNotEqual(util.HouseNumber("1", "1-2"), "1")
+
+    def test_sort_key(self) -> None:
+        """Tests get_sort_key()."""
+        house_number = util.HouseNumber("12/a", "12/a")
+        self.assertEqual(house_number.get_sort_key(), (12, "/a"))
+        # Second call returns the cached key.
+        self.assertIs(house_number.get_sort_key(), house_number.get_sort_key())
+
     def test_is_invalid(self) -> None:
         """Tests is_invalid()."""
         self.assertTrue(util.HouseNumber.is_invalid("15 a", ["15a"]))
@@ -323,5 +630,122 @@ class TestSortNumerically(unittest.TestCase):
         self.assertEqual([i.get_number() for i in ascending], ['a', 'b', 'c'])
 
 
+class TestSplitLines(unittest.TestCase):
+    """Tests split_lines()."""
+    def test_happy(self) -> None:
+        """Tests that the result is the same as str.split()."""
+        for data in ("", "a", "a\n", "a\nb", "a\n\nb\n"):
+            with self.subTest(data=data):
+                self.assertEqual(list(util.split_lines(io.StringIO(data))), data.split("\n"))
+
+
+def sort_csv(data: str, key: Callable[[str], Any]) -> str:
+    """Sorts the body of a CSV/TSV with sort_csv_stream()."""
+    outstream = io.StringIO()
+    util.sort_csv_stream(io.StringIO(data), outstream, key)
+    return outstream.getvalue()
+
+
+class TestSortCsvStream(unittest.TestCase):
+    """Tests sort_csv_stream()."""
+    def test_happy(self) -> None:
+        """Tests the happy path: the body fits into a single run."""
+        self.assertEqual(sort_csv("head\n2\n1\n", lambda line: line), "head\n\n1\n2")
+
+    def test_runs(self) -> None:
+        """Tests the case when sorted runs are merged from temporary files."""
+        unsorted = "head\n5\n3\n1\n4\n2"
+        with unittest.mock.patch("util.SORT_CSV_RUN_SIZE", 2):
+            self.assertEqual(sort_csv(unsorted, int), "head\n1\n2\n3\n4\n5")
+            # The last run is full.
+            self.assertEqual(sort_csv("head\n4\n3\n2\n1", int), "head\n1\n2\n3\n4")
+
+    def test_stable(self) -> None:
+        """Tests that the order of equal lines is kept when merging runs."""
+        unsorted = "head\nb1\na1\nb2\na2\nb3"
+        with unittest.mock.patch("util.SORT_CSV_RUN_SIZE", 2):
+            self.assertEqual(sort_csv(unsorted, lambda line: line[0]), "head\na1\na2\nb1\nb2\nb3")
+
+
+class TestSplitStreetLine(unittest.TestCase):
+    """Tests split_street_line()."""
+    def test_primary(self) -> None:
+        """Tests that missing 2nd col is ordered last."""
+        unsorted = [
+            '0\t\tprimary',
+            '1\tPear\tprimary',
+            '2\tApple\tsecondary',
+            '3\tApple\tprimary',
+        ]
+        expected = [
+            '3\tApple\tprimary',
+            '2\tApple\tsecondary',
+            '1\tPear\tprimary',
+            '0\t\tprimary',
+        ]
+        self.assertEqual(sorted(unsorted, key=util.split_street_line), expected)
+
+    def test_service(self) -> None:
+        """Tests that matching 2nd and 3rd col means ordering by 4th col."""
+        unsorted = [
+            '4\tMine\tservice\tdriveway',
+            '5\tMine\tservice\tallay',
+        ]
+        sort = [
+            '5\tMine\tservice\tallay',
+            '4\tMine\tservice\tdriveway',
+        ]
+        self.assertEqual(sorted(unsorted, key=util.split_street_line), sort)
+
+
+class TestSplitHousenumberLine(unittest.TestCase):
+    """Tests split_housenumber_line()."""
+    def test_happy(self) -> None:
+        """Tests the happy path: the order of the OSM house number list."""
+        unsorted = [
+            '0\t\t42\t1234\tPalace\t1000/11\t8\t0\t2\tA\tMinistry of OpenStreetMap',
+            '1\tApple ave\t42\t1234\tPalace\t1000/11\t8\t0\t2\tA\tMinistry of OpenStreetMap',
+            '2\tPear ave\t42\t1234\tPalace\t1000/11\t8\t0\t2\tA\tMinistry of OpenStreetMap',
+            '3\tApple ave\t42\t1234\tPalace\t1000/11\t8\t0\t2\tA\tBase of OpenStreetMap',
+            '4\tApple ave\t5\t1234\tPalace\t1000/11\t8\t0\t2\tA\tMinistry of OpenStreetMap',
+            '5\tApple ave\t\t1234\t\t\t8\t0\t2\tA\tMinistry of OpenStreetMap',
+            '6\tApple ave\t\t1234\t\t1000/11\t8\t0\t2\tA\tMinistry of OpenStreetMap',
+            '7\tApple ave\t\t1234\tPalace\t1000/11\t8\t0\t2\tA\tMinistry of OpenStreetMap',
+            '8\tApple ave\t42\t\tPalace\t1000/11\t8\t0\t2\tA\tMinistry of OpenStreetMap',
+            '9\tApple ave\t42\t\tPalace\t1000/11',
+        ]
+        expected = [
+            '9\tApple ave\t42\t\tPalace\t1000/11',
+            '8\tApple ave\t42\t\tPalace\t1000/11\t8\t0\t2\tA\tMinistry of OpenStreetMap',
+            '5\tApple ave\t\t1234\t\t\t8\t0\t2\tA\tMinistry of OpenStreetMap',
+            '6\tApple ave\t\t1234\t\t1000/11\t8\t0\t2\tA\tMinistry of OpenStreetMap',
+            '7\tApple ave\t\t1234\tPalace\t1000/11\t8\t0\t2\tA\tMinistry of OpenStreetMap',
+            '0\t\t42\t1234\tPalace\t1000/11\t8\t0\t2\tA\tMinistry of OpenStreetMap',
+            '4\tApple ave\t5\t1234\tPalace\t1000/11\t8\t0\t2\tA\tMinistry of OpenStreetMap',
+            '3\tApple ave\t42\t1234\tPalace\t1000/11\t8\t0\t2\tA\tBase of OpenStreetMap',
+            '1\tApple ave\t42\t1234\tPalace\t1000/11\t8\t0\t2\tA\tMinistry of OpenStreetMap',
+            '2\tPear ave\t42\t1234\tPalace\t1000/11\t8\t0\t2\tA\tMinistry of OpenStreetMap',
+        ]
+        self.assertEqual(sorted(unsorted, key=util.split_housenumber_line), expected)
+
+
+class TestGetRefHousenumbersStreets(unittest.TestCase):
+    """Tests get_ref_housenumbers_streets()."""
+    def test_happy(self) -> None:
+        """Tests that both the street and the house number of a reference line may contain spaces."""
+        expected = ["Ref", "Ref Name", "Ref Name 1", "Ref Name 1 1"]
+        self.assertEqual(util.get_ref_housenumbers_streets("Ref Name 1 1 A"), expected)
+
+
+class TestSplitStreetsHousenumbersCsv(unittest.TestCase):
+    """Tests split_streets_housenumbers_csv()."""
+    def test_no_marker(self) -> None:
+        """Tests the case when the house numbers marker is missing, e.g. the result is truncated."""
+        with self.assertRaises(ValueError):
+            header = "\t".join(util.STREETS_COLUMNS + util.HOUSENUMBERS_COLUMNS[1:-2])
+            result_from_overpass = io.StringIO(header + "\n1\tTűzkő utca\tresidential\t\t\t\tway\n")
+            util.split_streets_housenumbers_csv(result_from_overpass, io.StringIO(), io.StringIO())
+
+
 if __name__ == '__main__':
     unittest.main()
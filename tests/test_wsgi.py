@@ -6,6 +6,7 @@
 
 """The test_wsgi module covers the wsgi module."""
 
+from typing import Dict
 from typing import List
 from typing import TYPE_CHECKING
 from typing import Tuple
@@ -16,6 +17,8 @@ import unittest
 import unittest.mock
 import xml.etree.ElementTree as ET
 
+import helpers
+import stats
 import wsgi
 
 if TYPE_CHECKING:
@@ -23,6 +26,13 @@ if TYPE_CHECKING:
     from wsgiref.types import StartResponse
 
 
+def get_relations() -> helpers.Relations:
+    """Returns a Relations object that uses the test data and workdir."""
+    datadir = os.path.join(os.path.dirname(__file__), "data")
+    workdir = os.path.join(os.path.dirname(__file__), "workdir")
+    return helpers.Relations(datadir, workdir)
+
+
 class TestWsgi(unittest.TestCase):
     """Base class for wsgi tests."""
     def get_dom_for_path(self, path: str) -> ET.Element:
@@ -75,6 +85,13 @@ class TestMissingHousenumbers(TestWsgi):
         results = root.findall("body/table")
         self.assertEqual(len(results), 1)
 
+    def test_no_stats_write(self) -> None:
+        """Tests that viewing the result doesn't write the stats index of the main page."""
+        with unittest.mock.patch("stats.write_stats") as mock_write_stats:
+            self.get_dom_for_path("/osm/missing-housenumbers/gazdagret/view-result")
+            self.get_dom_for_path("/osm/missing-streets/gazdagret/view-result")
+        self.assertFalse(mock_write_stats.called)
+
 
 class TestStreetHousenumbers(TestWsgi):
     """Tests handle_street_housenumbers()."""
@@ -109,6 +126,68 @@ class TestMain(TestWsgi):
         self.assertEqual(len(results), 1)
 
 
+class TestHousenumberStats(TestWsgi):
+    """Tests handle_housenumber_stats()."""
+    def test_well_formed(self) -> None:
+        """Tests if the output is well-formed."""
+        relations = get_relations()
+        stats.write_missing_housenumbers(relations.get_relation("gazdagret"))
+        stats.write_stats(relations, ["gazdagret"])
+        root = self.get_dom_for_path("/osm/housenumber-stats/")
+        results = root.findall("body/table")
+        self.assertEqual(len(results), 3)
+        results = root.findall("body/table/tr/td/a[@href='/osm/missing-housenumbers/gazdagret/view-result']")
+        self.assertTrue(results)
+        results = root.findall("body/table/tr/td/a[@href='/osm/filter-for/refmegye/01']")
+        self.assertTrue(results)
+
+
+class TestPageCache(unittest.TestCase):
+    """Tests the page cache of our_application()."""
+    def get_response(self, environ: Dict[str, str]) -> Tuple[str, Dict[str, str]]:
+        """Gets the status and the headers for a request."""
+        responses = []  # type: List[Tuple[str, List[Tuple[str, str]]]]
+
+        def start_response(status: str, response_headers: List[Tuple[str, str]]) -> None:
+            responses.append((status, response_headers))
+
+        def get_abspath(path: str) -> str:
+            if os.path.isabs(path):
+                return path
+            return os.path.join(os.path.dirname(__file__), path)
+        with unittest.mock.patch('util.get_abspath', get_abspath):
+            callback = cast('StartResponse', start_response)  # type: StartResponse
+            wsgi.application(environ, callback)
+        status, response_headers = responses[0]
+        return status, dict(response_headers)
+
+    def test_not_modified(self) -> None:
+        """Tests that a page is not sent again if the client has it already."""
+        status, headers = self.get_response({"PATH_INFO": "/osm/missing-housenumbers/gazdagret/view-result"})
+        self.assertEqual(status, "200 OK")
+        environ = {
+            "PATH_INFO": "/osm/missing-housenumbers/gazdagret/view-result",
+            "HTTP_IF_NONE_MATCH": headers["ETag"],
+        }
+        with unittest.mock.patch('wsgi.our_application_html', side_effect=AssertionError):
+            status, _headers = self.get_response(environ)
+        self.assertEqual(status, "304 Not Modified")
+
+    def test_cached(self) -> None:
+        """Tests that a page is rendered only once."""
+        self.get_response({"PATH_INFO": "/osm/missing-streets/gazdagret/view-result.txt"})
+        with unittest.mock.patch('wsgi.our_application_txt', side_effect=AssertionError):
+            status, headers = self.get_response({"PATH_INFO": "/osm/missing-streets/gazdagret/view-result.txt"})
+        self.assertEqual(status, "200 OK")
+        self.assertEqual(headers["Content-type"], "text/plain; charset=utf-8")
+
+    def test_uncached(self) -> None:
+        """Tests that pages with side effects are not cached."""
+        self.assertIsNone(wsgi.get_page_dependencies(get_relations(), "/osm/streets/gazdagret/update-result"))
+        self.assertIsNone(wsgi.get_page_dependencies(get_relations(), "/osm/webhooks/github"))
+        self.assertTrue(wsgi.get_page_dependencies(get_relations(), "/osm/filter-for/incomplete"))
+
+
 class TestGetStaticdir(unittest.TestCase):
     """Tests get_staticdir()."""
     def test_happy(self) -> None:
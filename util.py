@@ -7,26 +7,53 @@
 """The util module contains free functions shared between other modules."""
 
 from typing import Any
+from typing import BinaryIO
 from typing import Callable
 from typing import Dict
 from typing import List
 from typing import Iterable
+from typing import Iterator
 from typing import Optional
 from typing import Sequence
 from typing import TextIO
 from typing import Tuple
 from typing import cast
+import collections
+import contextlib
+import functools
+import hashlib
+import heapq
+import itertools
+import logging
 import os
 import pickle
 import re
+import sys
+import tempfile
+import threading
+import time
 import urllib.error
 
+import yaml
 import yattag  # type: ignore
 
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    # Windows: FileLock does no locking.
+    fcntl = None  # type: ignore
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    # Windows: the peak memory usage is not reported.
+    resource = None  # type: ignore
+
 import accept_language
 from i18n import translate as _
 import i18n
 import overpass_query
+import refcache
 
 
 class HouseNumber:
@@ -34,9 +61,14 @@ class HouseNumber:
     A house number is a string which remembers what was its provider range.  E.g. the "1-3" string
     can generate 3 house numbers, all of them with the same range.
     """
+    # A large relation has hundreds of thousands of house numbers, don't have a __dict__ for each.
+    __slots__ = ["__number", "__source", "__sort_key"]
+
     def __init__(self, number: str, source: str) -> None:
-        self.__number = number
-        self.__source = source
+        # Interned: the same numbers and sources are repeated in OSM and in the reference.
+        self.__number = sys.intern(number)
+        self.__source = sys.intern(source)
+        self.__sort_key = None  # type: Optional[Tuple[int, str]]
 
     def get_number(self) -> str:
         """Returns the house number string."""
@@ -46,13 +78,20 @@ class HouseNumber:
         """Returns the source range."""
         return self.__source
 
+    def get_sort_key(self) -> Tuple[int, str]:
+        """Returns the numerical sort key of the house number, see split_house_number()."""
+        if self.__sort_key is None:
+            self.__sort_key = split_house_number(self.__number)
+        return self.__sort_key
+
     def __repr__(self) -> str:
         return "HouseNumber(number=%s, source=%s)" % (self.__number, self.__source)
 
     def __eq__(self, other: object) -> bool:
         """Source is explicitly non-interesting."""
-        other_house_number = cast(HouseNumber, other)
-        return self.__number == other_house_number.get_number()
+        if not isinstance(other, HouseNumber):
+            return NotImplemented
+        return self.__number == other.get_number()
 
     def __hash__(self) -> int:
         """Source is explicitly non-interesting."""
@@ -77,11 +116,23 @@ class HouseNumber:
         return house_number in invalids
 
 
+def split_even_odd(house_numbers: List[str]) -> Tuple[List[str], List[str]]:
+    """Partitions house numbers into numerically sorted even and odd lists, in one pass."""
+    even = []  # type: List[str]
+    odd = []  # type: List[str]
+    for house_number in house_numbers:
+        if split_house_number(house_number)[0] % 2:
+            odd.append(house_number)
+        else:
+            even.append(house_number)
+    even.sort(key=split_house_number)
+    odd.sort(key=split_house_number)
+    return even, odd
+
+
 def format_even_odd(only_in_ref: List[str], doc: Optional[yattag.Doc]) -> List[str]:
     """Separate even and odd numbers, this helps survey in most cases."""
-    key = split_house_number
-    even = sorted([i for i in only_in_ref if int(split_house_number(i)[0]) % 2 == 0], key=key)
-    odd = sorted([i for i in only_in_ref if int(split_house_number(i)[0]) % 2 == 1], key=key)
+    even, odd = split_even_odd(only_in_ref)
     if doc:
         if odd:
             for index, elem in enumerate(odd):
@@ -118,16 +169,157 @@ def color_house_number(fro: str) -> yattag.Doc:
     return doc
 
 
-def build_street_reference_cache(local_streets: str) -> Dict[str, Dict[str, List[str]]]:
-    """Builds an in-memory cache from the reference on-disk TSV (street version)."""
-    memory_cache = {}  # type: Dict[str, Dict[str, List[str]]]
+# Bump this when the in-memory layout of the street reference cache changes.
+STREET_REFERENCE_CACHE_VERSION = 1
+
+
+# The libyaml based loader is much faster, if it's available.
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)  # pylint: disable=invalid-name
+
+
+class YamlCache:
+    """
+    A YAML cache keeps parsed YAML files for the lifetime of the process, a file is only parsed
+    again if its modification time changed. The returned data is shared, callers must not modify
+    it.
+    """
+    def __init__(self) -> None:
+        # Path -> (mtime, data).
+        self.__files = {}  # type: Dict[str, Tuple[float, Any]]
+        self.__lock = threading.Lock()
+
+    def load(self, path: str) -> Any:
+        """Gets the parsed contents of a YAML file."""
+        mtime = os.path.getmtime(path)
+        with self.__lock:
+            entry = self.__files.get(path)
+        if entry is None or entry[0] != mtime:
+            with open(path) as stream:
+                entry = (mtime, yaml.load(stream, Loader=YAML_LOADER))
+            with self.__lock:
+                self.__files[path] = entry
+        return entry[1]
+
+
+# Shared by all helpers.Relations objects of this process.
+YAML_CACHE = YamlCache()
+
+
+class FileLock:
+    """An exclusive lock on a lock file, so e.g. parallel WSGI workers don't do the same expensive
+    work at the same time."""
+    def __init__(self, path: str) -> None:
+        self.__path = path
+        self.__stream = None  # type: Optional[TextIO]
+
+    def __enter__(self) -> 'FileLock':
+        self.__stream = cast(TextIO, open(self.__path, "w"))
+        if fcntl:  # pragma: no branch
+            fcntl.flock(self.__stream.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, _exc_type: Any, _exc_value: Any, _traceback: Any) -> None:
+        stream = cast(TextIO, self.__stream)
+        if fcntl:  # pragma: no branch
+            fcntl.flock(stream.fileno(), fcntl.LOCK_UN)
+        stream.close()
+
+
+def write_atomically(path: str, write: Callable[[BinaryIO], Any]) -> None:
+    """Writes a file via a temporary file and a rename, so readers never see a partial file."""
+    handle, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + ".")
+    try:
+        with os.fdopen(handle, "wb") as stream:
+            write(stream)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def get_file_hash(path: str) -> bytes:
+    """Gets the SHA-256 digest of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as stream:
+        while True:
+            buf = stream.read(1024 * 1024)
+            if not buf:
+                break
+            digest.update(buf)
+    return digest.digest()
+
+
+def get_cache_stamp(local: str) -> Tuple[int, int, bytes]:
+    """Gets the size, mtime (ns) and content hash of a reference, to be stored in its cache."""
+    stat = os.stat(local)
+    return stat.st_size, stat.st_mtime_ns, get_file_hash(local)
+
+
+def is_cache_fresh(
+        local: str,
+        version: int,
+        stamp: Optional[Tuple[int, int, int, bytes]],
+        update_mtime: Callable[[int], None]
+) -> bool:
+    """Decides if a cache with a given (format version, size, mtime, hash) stamp is still up to date
+    for a reference. If the reference was only touched, update_mtime() is called with its new mtime,
+    so the next check doesn't have to hash it again."""
+    if not stamp:
+        return False
+    cache_version, size, mtime, digest = stamp
+    if cache_version != version:
+        return False
+    stat = os.stat(local)
+    if size != stat.st_size:
+        return False
+    if mtime == stat.st_mtime_ns:
+        return True
+    # Touched, but the content may be still the same.
+    if digest != get_file_hash(local):
+        return False
+    update_mtime(stat.st_mtime_ns)
+    return True
+
 
+def read_street_reference_cache(local_streets: str) -> Optional[Dict[str, Dict[str, List[str]]]]:
+    """Reads the on-disk street reference cache, returns None if it's missing, corrupted or
+    stale."""
     disk_cache = local_streets + ".pickle"
-    if os.path.exists(disk_cache):
-        with open(disk_cache, "rb") as sock_cache:
-            memory_cache = pickle.load(sock_cache)
-            return memory_cache
+    if not os.path.exists(disk_cache):
+        return None
+    touched = []  # type: List[int]
+    with open(disk_cache, "rb") as sock_cache:
+        try:
+            stamp = pickle.load(sock_cache)
+            if not isinstance(stamp, tuple) or len(stamp) != 4:
+                # Cache from before stamps were introduced.
+                return None
+            if not is_cache_fresh(local_streets, STREET_REFERENCE_CACHE_VERSION, stamp, touched.append):
+                return None
+            memory_cache = cast(Dict[str, Dict[str, List[str]]], pickle.load(sock_cache))
+        except (EOFError, pickle.UnpicklingError):
+            return None
+    if touched:
+        _version, size, _mtime, digest = stamp
+        write_street_reference_cache(local_streets, (size, touched[0], digest), memory_cache)
+    return memory_cache
+
+
+def write_street_reference_cache(
+        local_streets: str,
+        stamp: Tuple[int, int, bytes],
+        memory_cache: Dict[str, Dict[str, List[str]]]
+) -> None:
+    """Writes the on-disk street reference cache, stamp is the size, mtime and hash of the reference."""
+    def write(stream: BinaryIO) -> None:
+        pickle.dump((STREET_REFERENCE_CACHE_VERSION,) + stamp, stream)
+        pickle.dump(memory_cache, stream)
+    write_atomically(local_streets + ".pickle", write)
+
 
+def parse_street_reference(local_streets: str) -> Dict[str, Dict[str, List[str]]]:
+    """Parses the reference on-disk TSV (street version)."""
+    memory_cache = {}  # type: Dict[str, Dict[str, List[str]]]
     with open(local_streets, "r") as sock:
         first = True
         while True:
@@ -147,54 +339,156 @@ def build_street_reference_cache(local_streets: str) -> Dict[str, Dict[str, List
             if reftelepules not in memory_cache[refmegye].keys():
                 memory_cache[refmegye][reftelepules] = []
             memory_cache[refmegye][reftelepules].append(street)
-    with open(disk_cache, "wb") as sock_cache:
-        pickle.dump(memory_cache, sock_cache)
     return memory_cache
 
 
-def build_reference_cache(local: str) -> Dict[str, Dict[str, Dict[str, List[str]]]]:
-    """Builds an in-memory cache from the reference on-disk TSV (house number version)."""
-    memory_cache = {}  # type: Dict[str, Dict[str, Dict[str, List[str]]]]
+def build_street_reference_cache(local_streets: str) -> Dict[str, Dict[str, List[str]]]:
+    """Builds an in-memory cache from the reference on-disk TSV (street version). The on-disk
+    pickle cache is rebuilt if it's missing or the reference changed."""
+    memory_cache = read_street_reference_cache(local_streets)
+    if memory_cache is not None:
+        return memory_cache
 
-    disk_cache = local + ".pickle"
-    if os.path.exists(disk_cache):
-        with open(disk_cache, "rb") as sock_cache:
-            memory_cache = pickle.load(sock_cache)
+    disk_cache = local_streets + ".pickle"
+    with FileLock(disk_cache + ".lock"):
+        # Another process may have rebuilt it while we were waiting for the lock.
+        memory_cache = read_street_reference_cache(local_streets)
+        if memory_cache is not None:
             return memory_cache
 
-    with open(local, "r") as sock:
-        first = True
-        while True:
-            line = sock.readline()
-            if first:
-                first = False
-                continue
-
-            if not line:
-                break
-
-            refmegye, reftelepules, street, num = line.strip().split("\t")
-            if refmegye not in memory_cache.keys():
-                memory_cache[refmegye] = {}
-            if reftelepules not in memory_cache[refmegye].keys():
-                memory_cache[refmegye][reftelepules] = {}
-            if street not in memory_cache[refmegye][reftelepules].keys():
-                memory_cache[refmegye][reftelepules][street] = []
-            memory_cache[refmegye][reftelepules][street].append(num)
-    with open(disk_cache, "wb") as sock_cache:
-        pickle.dump(memory_cache, sock_cache)
+        stamp = get_cache_stamp(local_streets)
+        memory_cache = parse_street_reference(local_streets)
+        write_street_reference_cache(local_streets, stamp, memory_cache)
     return memory_cache
 
 
-def build_reference_caches(references: List[str]) -> List[Dict[str, Dict[str, Dict[str, List[str]]]]]:
-    """Handles a list of references for build_reference_cache()."""
-    return [build_reference_cache(reference) for reference in references]
-
-
-def split_house_number(house_number: str) -> Tuple[int, str]:
+def is_reference_cache_fresh(local: str, refmegyes: Optional[List[str]]) -> bool:
+    """Decides if the on-disk cache of a reference is up to date and includes all of refmegyes
+    (None: all refmegyes)."""
+    disk_cache = local + ".cache"
+    if not is_cache_fresh(local, refcache.VERSION, refcache.read_stamp(disk_cache),
+                          lambda mtime: refcache.write_mtime(disk_cache, mtime)):
+        return False
+    included = refcache.read_refmegyes(disk_cache)
+    if included is None:
+        return True
+    if refmegyes is None:
+        return False
+    return set(refmegyes).issubset(included)
+
+
+def get_peak_memory() -> int:
+    """Gets the peak resident set size of this process in KiB, 0 if it's not known."""
+    if resource:  # pragma: no branch
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return 0  # pragma: no cover
+
+
+def build_reference_cache(local: str, refmegyes: Optional[List[str]] = None) -> refcache.ReferenceCache:
+    """Builds an indexed on-disk cache from the reference TSV (house number version) if it's missing,
+    the reference changed or it lacks some of refmegyes (None: all refmegyes), then opens it."""
+    disk_cache = local + ".cache"
+    if not is_reference_cache_fresh(local, refmegyes):
+        with FileLock(disk_cache + ".lock"):
+            # Another process may have rebuilt it while we were waiting for the lock.
+            if not is_reference_cache_fresh(local, refmegyes):
+                stamp = refcache.read_stamp(disk_cache)
+                if refmegyes is not None and is_cache_fresh(local, refcache.VERSION, stamp,
+                                                            lambda mtime: refcache.write_mtime(disk_cache, mtime)):
+                    # Only some refmegyes are missing: keep the existing ones, so users of different
+                    # refmegyes don't keep rebuilding it.
+                    included = cast(List[str], refcache.read_refmegyes(disk_cache))
+                    refmegyes = sorted(set(refmegyes).union(included))
+                source_stamp = get_cache_stamp(local)
+                start = time.time()
+                write_atomically(disk_cache, lambda stream: refcache.build(local, stream, source_stamp, refmegyes))
+                logging.info("build_reference_cache: built '%s' in %.3f seconds, peak memory: %s KiB",
+                             disk_cache, time.time() - start, get_peak_memory())
+    return refcache.ReferenceCache(disk_cache)
+
+
+class ReferenceCacheLru:
+    """
+    A least recently used cache of opened reference caches, keyed by the path and modification time
+    of the reference and the wanted refmegyes. The total size of the cached (memory-mapped) files is
+    capped. Evicted reference caches are not closed, as callers may still use them: they are released
+    once they are garbage collected.
+    """
+    def __init__(self, max_size: int) -> None:
+        self.__max_size = max_size
+        self.__size = 0
+        self.__hits = 0
+        self.__misses = 0
+        # (path, mtime, refmegyes) -> (reference cache, size), least recently used first.
+        self.__caches = collections.OrderedDict()  # type: collections.OrderedDict[Tuple[str, float, Any], Any]
+
+    def get(self, local: str, refmegyes: Optional[List[str]] = None) -> refcache.ReferenceCache:
+        """Gets the reference cache of a reference TSV, only builds or opens it on a miss."""
+        wanted = None
+        if refmegyes is not None:
+            wanted = tuple(sorted(refmegyes))
+        key = (local, os.path.getmtime(local), wanted)
+        if key in self.__caches:
+            self.__hits += 1
+            self.__caches.move_to_end(key)
+            return cast(refcache.ReferenceCache, self.__caches[key][0])
+
+        self.__misses += 1
+        # Older versions of the same reference will not be used anymore.
+        for stale_key in [i for i in self.__caches if i[0] == local and i[1] < key[1]]:
+            self.__evict(stale_key)
+        reference_cache = build_reference_cache(local, refmegyes)
+        size = os.path.getsize(local + ".cache")
+        self.__caches[key] = (reference_cache, size)
+        self.__size += size
+        while self.__size > self.__max_size and len(self.__caches) > 1:
+            self.__evict(next(iter(self.__caches)))
+        return reference_cache
+
+    def __evict(self, key: Tuple[str, float, Any]) -> None:
+        """Removes a reference cache from the LRU."""
+        _evicted_cache, evicted_size = self.__caches.pop(key)
+        self.__size -= evicted_size
+
+    def get_hits(self) -> int:
+        """Gets the number of lookups which found an already opened reference cache."""
+        return self.__hits
+
+    def get_misses(self) -> int:
+        """Gets the number of lookups which had to build or open a reference cache."""
+        return self.__misses
+
+
+# Shared by all relations of this process, so e.g. a nightly cron run opens each reference once.
+REFERENCE_CACHE_LRU = ReferenceCacheLru(max_size=1024 * 1024 * 1024)
+
+
+def build_reference_caches(
+        references: List[str],
+        refmegyes: Optional[List[str]] = None
+) -> List[refcache.ReferenceCache]:
+    """Handles a list of references for build_reference_cache(), using REFERENCE_CACHE_LRU."""
+    return [REFERENCE_CACHE_LRU.get(reference, refmegyes) for reference in references]
+
+
+# Number of distinct house numbers remembered by split_house_number().
+SPLIT_HOUSE_NUMBER_CACHE_SIZE = 64 * 1024
+
+DIGITS = "0123456789"
+
+
+def split_house_number_uncached(house_number: str) -> Tuple[int, str]:
     """Splits house_number into a numerical and a remainder part."""
+    # Fast path for the common '42' and '42a' cases, avoiding the regex.
+    remainder = house_number.lstrip(DIGITS)
+    if "\n" not in remainder:
+        digits = len(house_number) - len(remainder)
+        if digits:
+            return (int(house_number[:digits]), remainder)
+        return (0, remainder)
+
     match = re.search(r"^([0-9]*)([^0-9].*|)$", house_number)
-    if not match:  # pragma: no cover
+    if not match:
         return (0, '')
     number = 0
     try:
@@ -204,6 +498,12 @@ def split_house_number(house_number: str) -> Tuple[int, str]:
     return (number, match.group(2))
 
 
+@functools.lru_cache(maxsize=SPLIT_HOUSE_NUMBER_CACHE_SIZE)
+def split_house_number(house_number: str) -> Tuple[int, str]:
+    """Memoized split_house_number_uncached(): house numbers repeat a lot, OSM IDs don't."""
+    return split_house_number_uncached(house_number)
+
+
 def parse_filters(tokens: List[str]) -> Dict[str, str]:
     """Parses a filter description, like 'filter-for', 'refmegye', '42'."""
     ret = {}  # type: Dict[str, str]
@@ -409,18 +709,49 @@ def get_abspath(path: str) -> str:
 
 def sort_numerically(strings: Iterable[HouseNumber]) -> List[HouseNumber]:
     """Sorts strings according to their numerical value, not alphabetically."""
-    return sorted(strings, key=lambda x: split_house_number(x.get_number()))
+    return sorted(strings, key=HouseNumber.get_sort_key)
+
+
+# Number of lines sorted in memory at once by sort_csv_stream().
+SORT_CSV_RUN_SIZE = 256 * 1024
 
 
-def process_csv_body(fun: Callable[[Iterable[str]], List[str]], data: str) -> str:
+def split_lines(stream: TextIO) -> Iterator[str]:
+    """Yields the lines of stream without line endings, the same way as stream.read().split('\\n')."""
+    complete = True
+    for line in stream:
+        complete = line.endswith("\n")
+        yield line[:-1] if complete else line
+    if complete:
+        yield ""
+
+
+def sort_csv_stream(instream: TextIO, outstream: TextIO, key: Callable[[str], Any]) -> None:
     """
-    Process the body of a CSV/TSV with the given function while keeping the header intact.
+    Sorts the body of a CSV/TSV with the given key function while keeping the header intact. Memory
+    usage is bounded: sorted runs of SORT_CSV_RUN_SIZE lines are written
+    to temporary files, which are then merged.
     """
-    lines = data.split('\n')
-    header = lines[0] if lines else ''
-    body = lines[1:] if lines else ''
-    result = [header] + fun(body)
-    return '\n'.join(result)
+    lines = split_lines(instream)
+    outstream.write(next(lines))
+    with contextlib.ExitStack() as stack:
+        runs = []  # type: List[Iterable[str]]
+        while True:
+            run = sorted(itertools.islice(lines, SORT_CSV_RUN_SIZE), key=key)
+            if not runs and len(run) < SORT_CSV_RUN_SIZE:
+                # Fits into a single run, no need for temporary files.
+                break
+            run_file = stack.enter_context(tempfile.TemporaryFile("w+", encoding="utf-8", newline="\n"))
+            for line in run:
+                run_file.write(line + "\n")
+            run_file.seek(0)
+            runs.append(line[:-1] for line in run_file)
+            if len(run) < SORT_CSV_RUN_SIZE:
+                run = []
+                break
+        for line in heapq.merge(run, *runs, key=key):
+            outstream.write("\n")
+            outstream.write(line)
 
 
 def get_array_nth(arr: Sequence[str], index: int) -> str:
@@ -437,12 +768,79 @@ def split_street_line(line: str) -> Tuple[bool, str, str, str, Tuple[int, str]]:
     oid is interpreted numerically while other fields are taken alphabetically.
     """
     field = line.split('\t')
-    oid = get_array_nth(field, 0)
-    name = get_array_nth(field, 1)
-    highway = get_array_nth(field, 2)
-    service = get_array_nth(field, 3)
+    if len(field) < 4:
+        field += [''] * (4 - len(field))
+    oid, name, highway, service = field[:4]
     missing_name = name == ''
-    return (missing_name, name, highway, service, split_house_number(oid))
+    return (missing_name, name, highway, service, split_house_number_uncached(oid))
+
+
+def split_housenumber_line(line: str) -> Tuple[str, bool, bool, str, Tuple[int, str], str,
+                                               Tuple[int, str], Iterable[str], Tuple[int, str]]:
+    """
+    Augment TSV Overpass house numbers result lines to aid sorting.
+
+    It prepends two bools to indicate whether an entry is missing either a house number, a house name
+    or a conscription number.
+    Entries lacking either a house number or all of the above IDs come first.
+    The following fields are interpreted numerically: oid, house number, conscription number.
+    """
+    field = line.split('\t')
+    if len(field) < 6:
+        field += [''] * (6 - len(field))
+    oid, street, housenumber, postcode, housename, cons = field[:6]
+    tail = field[6:]
+
+    have_housenumber = housenumber != ''
+    have_houseid = have_housenumber or housename != '' or cons != ''
+    return (postcode, have_houseid, have_housenumber, street,
+            split_house_number(housenumber),
+            housename, split_house_number(cons), tail, split_house_number_uncached(oid))
+
+
+def get_ref_housenumbers_streets(line: str) -> List[str]:
+    """Gets the possible streets of a line in the reference house number list: both the street
+    name and the house number may contain spaces."""
+    ret = []  # type: List[str]
+    index = line.find(" ")
+    while index != -1:
+        ret.append(line[:index])
+        index = line.find(" ", index + 1)
+    return ret
+
+
+# Columns of streets-template.txt and street-housenumbers-template.txt.
+STREETS_COLUMNS = ["@id", "name", "highway", "service", "surface", "leisure", "@type"]
+HOUSENUMBERS_COLUMNS = [
+    "@id", "addr:street", "addr:housenumber", "addr:postcode", "addr:housename", "addr:conscriptionnumber",
+    "addr:flats", "addr:floor", "addr:door", "addr:unit", "name", "@type"
+]
+
+
+def split_streets_housenumbers_csv(result_from_overpass: TextIO, streets: TextIO, housenumbers: TextIO) -> None:
+    """
+    Splits TSV Overpass result of streets-housenumbers-template.txt into a street and a house
+    number result, as if they were produced by streets-template.txt and
+    street-housenumbers-template.txt.
+    """
+    lines = split_lines(result_from_overpass)
+    header = next(lines).split('\t')
+    type_index = header.index("@type")
+    streets.write('\t'.join(STREETS_COLUMNS) + '\n')
+    housenumbers.write('\t'.join(HOUSENUMBERS_COLUMNS) + '\n')
+    rows = streets
+    indexes = [header.index(i) for i in STREETS_COLUMNS]
+    for line in lines:
+        if not line:
+            continue
+        fields = line.split('\t')
+        if get_array_nth(fields, type_index) == "housenumbers":
+            rows = housenumbers
+            indexes = [header.index(i) for i in HOUSENUMBERS_COLUMNS]
+            continue
+        rows.write('\t'.join(get_array_nth(fields, i) for i in indexes) + '\n')
+    if rows is streets:
+        raise ValueError("no house numbers marker in the overpass result")
 
 
 # vim:set shiftwidth=4 softtabstop=4 expandtab:
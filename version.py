@@ -0,0 +1 @@
+VERSION = 'baseline'
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2019 Miklos Vajna and contributors.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""The webframe module provides the header, toolbar and footer code shared by all pages."""
+
+from typing import List
+from typing import Optional
+
+import yattag  # type: ignore
+
+from i18n import translate as _
+import helpers
+import util
+import version
+
+
+def fill_missing_header_items(streets: str, relation_name: str, items: List[yattag.Doc]) -> None:
+    """Generates the 'missing house numbers/streets' part of the header."""
+    if streets != "only":
+        doc = yattag.Doc()
+        with doc.tag("a", href="/osm/missing-housenumbers/" + relation_name + "/view-result"):
+            doc.text(_("Missing house numbers"))
+        doc.text(" (")
+        with doc.tag("a", href="/osm/missing-housenumbers/" + relation_name + "/view-result.txt"):
+            doc.text("txt")
+        doc.text(")")
+        items.append(doc)
+        doc = yattag.Doc()
+        with doc.tag("a", href="/osm/street-housenumbers/" + relation_name + "/view-result"):
+            doc.text(_("Existing house numbers"))
+        items.append(doc)
+    if streets != "no":
+        doc = yattag.Doc()
+        with doc.tag("a", href="/osm/missing-streets/" + relation_name + "/view-result"):
+            doc.text(_("Missing streets"))
+        doc.text(" (")
+        with doc.tag("a", href="/osm/missing-streets/" + relation_name + "/view-result.txt"):
+            doc.text("txt")
+        doc.text(")")
+        items.append(doc)
+
+
+def get_html_title(request_uri: str) -> str:
+    """Determines the HTML title for a given function and relation name."""
+    tokens = request_uri.split("/")
+    function = ""
+    relation_name = ""
+    if len(tokens) > 3:
+        function = tokens[2]
+        relation_name = tokens[3]
+    title = ""
+    if function == "missing-housenumbers":
+        title = " - " + _("{0} missing house numbers").format(relation_name)
+    elif function == "missing-streets":
+        title = " - " + relation_name + " " + _("missing streets")
+    elif function == "street-housenumbers":
+        title = " - " + relation_name + " " + _("existing house numbers")
+    elif function == "streets":
+        title = " - " + relation_name + " " + _("existing streets")
+    elif function == "housenumber-stats":
+        title = " - " + _("Missing house number statistics")
+    return title
+
+
+def fill_header_function(function: str, relation_name: str, items: List[yattag.Doc]) -> None:
+    """Fills items with function-specific links in the header. Returns a title."""
+    if function == "missing-housenumbers":
+        doc = yattag.Doc()
+        with doc.tag("a", href="/osm/missing-housenumbers/" + relation_name + "/update-result"):
+            doc.text(_("Update from reference"))
+        doc.text(" " + _("(may take seconds)"))
+        items.append(doc)
+        doc = yattag.Doc()
+        with doc.tag("a", href="https://overpass-turbo.eu/"):
+            doc.text(_("Overpass turbo"))
+        items.append(doc)
+    elif function == "missing-streets":
+        doc = yattag.Doc()
+        with doc.tag("a", href="/osm/missing-streets/" + relation_name + "/update-result"):
+            doc.text(_("Update from reference"))
+        items.append(doc)
+    elif function == "street-housenumbers":
+        doc = yattag.Doc()
+        with doc.tag("a", href="/osm/street-housenumbers/" + relation_name + "/update-result"):
+            doc.text(_("Call Overpass to update"))
+        doc.text(" " + _("(may take seconds)"))
+        items.append(doc)
+        doc = yattag.Doc()
+        with doc.tag("a", href="/osm/street-housenumbers/" + relation_name + "/view-query"):
+            doc.text(_("View query"))
+        items.append(doc)
+    elif function == "streets":
+        doc = yattag.Doc()
+        with doc.tag("a", href="/osm/streets/" + relation_name + "/update-result"):
+            doc.text(_("Call Overpass to update"))
+        doc.text(" " + _("(may take seconds)"))
+        items.append(doc)
+        doc = yattag.Doc()
+        with doc.tag("a", href="/osm/streets/" + relation_name + "/view-query"):
+            doc.text(_("View query"))
+        items.append(doc)
+
+
+def write_html_head(doc: yattag.Doc, title: str) -> None:
+    """Produces the <head> tag and its contents."""
+    with doc.tag("head"):
+        with doc.tag("title"):
+            doc.text(_("Where to map?") + title)
+        doc.stag("meta", charset="UTF-8")
+        doc.stag("link", rel="stylesheet", type="text/css", href="/osm/static/osm.css")
+        with doc.tag("script", src="/osm/static/sorttable.js"):
+            pass
+        doc.stag("meta", name="viewport", content="width=device-width, initial-scale=1")
+
+
+def get_toolbar(
+        relations: Optional[helpers.Relations] = None,
+        function: str = "",
+        relation_name: str = "",
+        relation_osmid: int = 0
+) -> yattag.Doc:
+    """Produces the start of the page. Note that the content depends on the function and the
+    relation, but not on the action to keep a balance between too generic and too specific
+    content."""
+    items = []  # type: List[yattag.Doc]
+
+    if relations and relation_name:
+        relation = relations.get_relation(relation_name)
+        streets = relation.get_config().should_check_missing_streets()
+
+    doc = yattag.Doc()
+    with doc.tag("a", href="/osm"):
+        doc.text(_("Area list"))
+    items.append(doc)
+    if not relation_name:
+        doc = yattag.Doc()
+        with doc.tag("a", href="/osm/housenumber-stats/"):
+            doc.text(_("Missing house number statistics"))
+        items.append(doc)
+    if relation_name:
+        fill_missing_header_items(streets, relation_name, items)
+        doc = yattag.Doc()
+        with doc.tag("a", href="/osm/streets/" + relation_name + "/view-result"):
+            doc.text(_("Existing streets"))
+        items.append(doc)
+
+    fill_header_function(function, relation_name, items)
+
+    if relation_osmid:
+        doc = yattag.Doc()
+        with doc.tag("a", href="https://www.openstreetmap.org/relation/" + str(relation_osmid)):
+            doc.text(_("Area boundary"))
+        items.append(doc)
+    doc = yattag.Doc()
+    with doc.tag("a", href="https://github.com/vmiklos/osm-gimmisn/tree/master/doc"):
+        doc.text(_("Documentation"))
+    items.append(doc)
+
+    doc = yattag.Doc()
+    with doc.tag("div", id="toolbar"):
+        for index, item in enumerate(items):
+            if index:
+                doc.text(" ¦ ")
+            doc.asis(item.getvalue())
+    doc.stag("hr")
+    return doc
+
+
+def get_footer(last_updated: str = "") -> yattag.Doc:
+    """Produces the end of the page."""
+    items = []  # type: List[yattag.Doc]
+    doc = yattag.Doc()
+    doc.text(_("Version: "))
+    doc.asis(util.git_link(version.VERSION, "https://github.com/vmiklos/osm-gimmisn/commit/").getvalue())
+    items.append(doc)
+    items.append(util.html_escape(_("OSM data © OpenStreetMap contributors.")))
+    if last_updated:
+        items.append(util.html_escape(_("Last update: ") + last_updated))
+    doc = yattag.Doc()
+    doc.stag("hr")
+    with doc.tag("div"):
+        for index, item in enumerate(items):
+            if index:
+                doc.text(" ¦ ")
+            doc.asis(item.getvalue())
+    return doc
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab:
@@ -32,20 +32,26 @@ import yattag  # type: ignore
 import helpers
 from i18n import translate as _
 import overpass_query
+import pagecache
+import settings
+import stats
 import version
 import util
+import webframe
 
 if TYPE_CHECKING:
     # pylint: disable=no-name-in-module,import-error,unused-import
     from wsgiref.types import StartResponse
 
 
+# Number of streets and relations shown by handle_housenumber_stats().
+HOUSENUMBER_STATS_COUNT = 20
+
+
 def get_config() -> configparser.ConfigParser:
-    """Gets access to information which are specific to this installation."""
-    config = configparser.ConfigParser()
-    config_path = util.get_abspath("wsgi.ini")
-    config.read(config_path)
-    return config
+    """Gets access to information which are specific to this installation, see
+    settings.get_config(). The returned config must not be modified."""
+    return settings.get_config(util.get_abspath("wsgi.ini"))
 
 
 def get_datadir() -> str:
@@ -68,19 +74,20 @@ def handle_streets(relations: helpers.Relations, request_uri: str) -> yattag.Doc
     osmrelation = relation.get_config().get_osmrelation()
 
     doc = yattag.Doc()
-    doc.asis(get_toolbar(relations, "streets", relation_name, osmrelation).getvalue())
+    doc.asis(webframe.get_toolbar(relations, "streets", relation_name, osmrelation).getvalue())
 
     if action == "view-query":
         with doc.tag("pre"):
-            doc.text(relation.get_osm_streets_query())
+            doc.text(relation.get_queries().get_osm_streets_query())
     elif action == "view-result":
         with relation.get_files().get_osm_streets_stream("r") as sock:
             table = util.tsv_to_list(sock)
             doc.asis(util.html_table_from_list(table).getvalue())
     elif action == "update-result":
-        query = relation.get_osm_streets_query()
         try:
-            relation.get_files().write_osm_streets(overpass_query.overpass_query(query))
+            with overpass_query.overpass_query_file(relation.get_queries().get_osm_streets_query()) as result:
+                relation.get_files().write_osm_streets(result)
+            update_derived_files(relations, relation)
             streets = relation.get_config().should_check_missing_streets()
             if streets != "only":
                 doc.text(_("Update successful: "))
@@ -92,7 +99,7 @@ def handle_streets(relations: helpers.Relations, request_uri: str) -> yattag.Doc
             doc.asis(util.handle_overpass_error(http_error).getvalue())
 
     date = get_streets_last_modified(relation)
-    doc.asis(get_footer(date).getvalue())
+    doc.asis(webframe.get_footer(date).getvalue())
     return doc
 
 
@@ -106,19 +113,21 @@ def handle_street_housenumbers(relations: helpers.Relations, request_uri: str) -
     osmrelation = relation.get_config().get_osmrelation()
 
     doc = yattag.Doc()
-    doc.asis(get_toolbar(relations, "street-housenumbers", relation_name, osmrelation).getvalue())
+    doc.asis(webframe.get_toolbar(relations, "street-housenumbers", relation_name, osmrelation).getvalue())
 
     if action == "view-query":
         with doc.tag("pre"):
-            doc.text(relation.get_osm_housenumbers_query())
+            doc.text(relation.get_queries().get_osm_housenumbers_query())
     elif action == "view-result":
         with relation.get_files().get_osm_housenumbers_stream(mode="r") as sock:
             table = util.tsv_to_list(sock)
             doc.asis(util.html_table_from_list(table).getvalue())
     elif action == "update-result":
-        query = relation.get_osm_housenumbers_query()
+        query = relation.get_queries().get_osm_housenumbers_query()
         try:
-            relation.get_files().write_osm_housenumbers(overpass_query.overpass_query(query))
+            with overpass_query.overpass_query_file(query) as result:
+                relation.get_files().write_osm_housenumbers(result)
+            update_derived_files(relations, relation)
             doc.text(_("Update successful: "))
             link = "/osm/missing-housenumbers/" + relation_name + "/view-result"
             doc.asis(util.gen_link(link, _("View missing house numbers")).getvalue())
@@ -126,7 +135,7 @@ def handle_street_housenumbers(relations: helpers.Relations, request_uri: str) -
             doc.asis(util.handle_overpass_error(http_error).getvalue())
 
     date = get_housenumbers_last_modified(relation)
-    doc.asis(get_footer(date).getvalue())
+    doc.asis(webframe.get_footer(date).getvalue())
     return doc
 
 
@@ -137,7 +146,7 @@ def missing_housenumbers_view_turbo(relations: helpers.Relations, request_uri: s
 
     doc = yattag.Doc()
     relation = relations.get_relation(relation_name)
-    ret = relation.write_missing_housenumbers()
+    ret = stats.read_missing_housenumbers(relation)
     _todo_street_count, _todo_count, _done_count, _percent, table = ret
     query = helpers.make_turbo_query_for_streets(relation, table)
 
@@ -153,20 +162,20 @@ def missing_housenumbers_view_res(relations: helpers.Relations, request_uri: str
 
     doc = yattag.Doc()
     relation = relations.get_relation(relation_name)
-    if not os.path.exists(relation.get_files().get_osm_streets_path()):
+    if not relation.get_files().exists(relation.get_files().get_osm_streets_path()):
         doc.text(_("No existing streets: "))
         link = "/osm/streets/" + relation_name + "/update-result"
         doc.asis(util.gen_link(link, _("Call Overpass to create")).getvalue())
-    elif not os.path.exists(relation.get_files().get_osm_housenumbers_path()):
+    elif not relation.get_files().exists(relation.get_files().get_osm_housenumbers_path()):
         doc.text(_("No existing house numbers: "))
         link = "/osm/street-housenumbers/" + relation_name + "/update-result"
         doc.asis(util.gen_link(link, _("Call Overpass to create")).getvalue())
-    elif not os.path.exists(relation.get_files().get_ref_housenumbers_path()):
+    elif not relation.get_files().exists(relation.get_files().get_ref_housenumbers_path()):
         doc.text(_("No missing house numbers: "))
         link = "/osm/missing-housenumbers/" + relation_name + "/update-result"
         doc.asis(util.gen_link(link, _("Create from reference")).getvalue())
     else:
-        ret = relation.write_missing_housenumbers()
+        ret = stats.read_missing_housenumbers(relation)
         todo_street_count, todo_count, done_count, percent, table = ret
 
         with doc.tag("p"):
@@ -193,11 +202,11 @@ def missing_relations_view_result(relations: helpers.Relations, request_uri: str
     relation = relations.get_relation(relation_name)
 
     doc = yattag.Doc()
-    if not os.path.exists(relation.get_files().get_osm_streets_path()):
+    if not relation.get_files().exists(relation.get_files().get_osm_streets_path()):
         doc.text(_("No existing streets: "))
         with doc.tag("a", href="/osm/streets/" + relation_name + "/update-result"):
             doc.text(_("Call Overpass to create"))
-    elif not os.path.exists(relation.get_files().get_ref_streets_path()):
+    elif not relation.get_files().exists(relation.get_files().get_ref_streets_path()):
         doc.text(_("No street list: "))
         with doc.tag("a", href="/osm/missing-streets/" + relation_name + "/update-result"):
             doc.text(_("Create from reference"))
@@ -224,14 +233,14 @@ def missing_housenumbers_view_txt(relations: helpers.Relations, request_uri: str
     relation = relations.get_relation(relation_name)
 
     output = ""
-    if not os.path.exists(relation.get_files().get_osm_streets_path()):
+    if not relation.get_files().exists(relation.get_files().get_osm_streets_path()):
         output += _("No existing streets")
-    elif not os.path.exists(relation.get_files().get_osm_housenumbers_path()):
+    elif not relation.get_files().exists(relation.get_files().get_osm_housenumbers_path()):
         output += _("No existing house numbers")
-    elif not os.path.exists(relation.get_files().get_ref_housenumbers_path()):
+    elif not relation.get_files().exists(relation.get_files().get_ref_housenumbers_path()):
         output += _("No reference house numbers")
     else:
-        ongoing_streets, _ignore = relation.get_missing_housenumbers()
+        ongoing_streets, _ignore = stats.get_missing_housenumbers_cached(relation)
 
         table = []
         for result in ongoing_streets:
@@ -256,9 +265,9 @@ def missing_streets_view_txt(relations: helpers.Relations, request_uri: str) ->
     relation = relations.get_relation(relation_name)
 
     output = ""
-    if not os.path.exists(relation.get_files().get_osm_streets_path()):
+    if not relation.get_files().exists(relation.get_files().get_osm_streets_path()):
         output += _("No existing streets")
-    elif not os.path.exists(relation.get_files().get_ref_streets_path()):
+    elif not relation.get_files().exists(relation.get_files().get_ref_streets_path()):
         output += _("No reference streets")
     else:
         todo_streets, _ignore = relation.get_missing_streets()
@@ -267,12 +276,23 @@ def missing_streets_view_txt(relations: helpers.Relations, request_uri: str) ->
     return output
 
 
+def update_derived_files(relations: helpers.Relations, relation: helpers.Relation) -> None:
+    """Updates the missing house numbers cache and the stats index entry of a relation after one of
+    its inputs changed, so the next view doesn't have to do it."""
+    files = relation.get_files()
+    paths = [files.get_osm_streets_path(), files.get_osm_housenumbers_path(), files.get_ref_housenumbers_path()]
+    if all(files.exists(path) for path in paths):
+        stats.write_missing_housenumbers(relation)
+    stats.write_stats(relations, [relation.get_name()])
+
+
 def missing_housenumbers_update(relations: helpers.Relations, relation_name: str) -> yattag.Doc:
     """Expected request_uri: e.g. /osm/missing-housenumbers/ormezo/update-result."""
     reference = get_config().get('wsgi', 'reference_housenumbers').strip().split(' ')
     reference = [util.get_abspath(i) for i in reference]
     relation = relations.get_relation(relation_name)
-    relation.write_ref_housenumbers(reference)
+    relation.write_ref_housenumbers(reference, relations.get_refmegyes())
+    update_derived_files(relations, relation)
     doc = yattag.Doc()
     doc.text(_("Update successful: "))
     link = "/osm/missing-housenumbers/" + relation_name + "/view-result"
@@ -285,6 +305,7 @@ def missing_streets_update(relations: helpers.Relations, relation_name: str) ->
     reference = util.get_abspath(get_config().get('wsgi', 'reference_street').strip())
     relation = relations.get_relation(relation_name)
     relation.write_ref_streets(reference)
+    stats.write_stats(relations, [relation_name])
     return util.html_escape(_("Update successful."))
 
 
@@ -298,7 +319,7 @@ def handle_missing_housenumbers(relations: helpers.Relations, request_uri: str)
     relation = relations.get_relation(relation_name)
     osmrelation = relation.get_config().get_osmrelation()
     doc = yattag.Doc()
-    doc.asis(get_toolbar(relations, "missing-housenumbers", relation_name, osmrelation).getvalue())
+    doc.asis(webframe.get_toolbar(relations, "missing-housenumbers", relation_name, osmrelation).getvalue())
 
     if action == "view-result":
         doc.asis(missing_housenumbers_view_res(relations, request_uri).getvalue())
@@ -308,13 +329,14 @@ def handle_missing_housenumbers(relations: helpers.Relations, request_uri: str)
         with doc.tag("pre"):
             with relation.get_files().get_ref_housenumbers_stream("r") as sock:
                 doc.text(sock.read())
-        date = get_last_modified(relation.get_files().get_ref_housenumbers_path())
+        files = relation.get_files()
+        date = format_timestamp(files.get_storage().get_timestamp(files.get_ref_housenumbers_path()))
     elif action == "update-result":
         doc.asis(missing_housenumbers_update(relations, relation_name).getvalue())
 
     if not date:
         date = ref_housenumbers_last_modified(relations, relation_name)
-    doc.asis(get_footer(date).getvalue())
+    doc.asis(webframe.get_footer(date).getvalue())
     return doc
 
 
@@ -328,7 +350,7 @@ def handle_missing_streets(relations: helpers.Relations, request_uri: str) -> ya
     osmrelation = relation.get_config().get_osmrelation()
 
     doc = yattag.Doc()
-    doc.asis(get_toolbar(relations, "missing-streets", relation_name, osmrelation).getvalue())
+    doc.asis(webframe.get_toolbar(relations, "missing-streets", relation_name, osmrelation).getvalue())
 
     if action == "view-result":
         doc.asis(missing_relations_view_result(relations, request_uri).getvalue())
@@ -340,7 +362,7 @@ def handle_missing_streets(relations: helpers.Relations, request_uri: str) -> ya
         doc.asis(missing_streets_update(relations, relation_name).getvalue())
 
     date = ref_streets_last_modified(relation)
-    doc.asis(get_footer(date).getvalue())
+    doc.asis(webframe.get_footer(date).getvalue())
     return doc
 
 
@@ -355,27 +377,6 @@ def local_to_ui_tz(local_dt: datetime.datetime) -> datetime.datetime:
     return local_dt.astimezone(ui_tz)
 
 
-def get_last_modified(workdir: str, path: str = "") -> str:
-    """Gets the update date of a file in workdir."""
-    if path:
-        path = os.path.join(workdir, path)
-    else:
-        path = workdir
-    return format_timestamp(get_timestamp(path))
-
-
-def get_timestamp(workdir: str, path: str = "") -> float:
-    """Gets the timestamp of a file in workdir."""
-    if path:
-        path = os.path.join(workdir, path)
-    else:
-        path = workdir
-    try:
-        return os.path.getmtime(path)
-    except FileNotFoundError:
-        return 0
-
-
 def format_timestamp(timestamp: float) -> str:
     """Formats timestamp as UI date-time."""
     local_dt = datetime.datetime.fromtimestamp(timestamp)
@@ -387,38 +388,43 @@ def format_timestamp(timestamp: float) -> str:
 def ref_housenumbers_last_modified(relations: helpers.Relations, name: str) -> str:
     """Gets the update date for missing house numbers."""
     relation = relations.get_relation(name)
-    t_ref = get_timestamp(relation.get_files().get_ref_housenumbers_path())
-    t_housenumbers = get_timestamp(relation.get_files().get_osm_housenumbers_path())
+    files = relation.get_files()
+    t_ref = files.get_storage().get_timestamp(files.get_ref_housenumbers_path())
+    t_housenumbers = files.get_storage().get_timestamp(files.get_osm_housenumbers_path())
     return format_timestamp(max(t_ref, t_housenumbers))
 
 
 def ref_streets_last_modified(relation: helpers.Relation) -> str:
     """Gets the update date for missing streets."""
-    t_ref = get_timestamp(relation.get_files().get_ref_streets_path())
-    t_osm = get_timestamp(relation.get_files().get_osm_streets_path())
+    files = relation.get_files()
+    t_ref = files.get_storage().get_timestamp(files.get_ref_streets_path())
+    t_osm = files.get_storage().get_timestamp(files.get_osm_streets_path())
     return format_timestamp(max(t_ref, t_osm))
 
 
 def get_housenumbers_last_modified(relation: helpers.Relation) -> str:
     """Gets the update date of house numbers for a relation."""
-    return get_last_modified(relation.get_files().get_osm_housenumbers_path())
+    files = relation.get_files()
+    return format_timestamp(files.get_storage().get_timestamp(files.get_osm_housenumbers_path()))
 
 
 def get_streets_last_modified(relation: helpers.Relation) -> str:
     """Gets the update date of streets for a relation."""
-    return get_last_modified(relation.get_files().get_osm_streets_path())
+    files = relation.get_files()
+    return format_timestamp(files.get_storage().get_timestamp(files.get_osm_streets_path()))
 
 
-def handle_main_housenr_percent(relation: helpers.Relation) -> Tuple[yattag.Doc, str]:
-    """Handles the house number percent part of the main page."""
+def handle_main_housenr_percent(relation: helpers.Relation, relation_stats: Dict[str, Any]) -> Tuple[yattag.Doc, str]:
+    """Handles the house number percent part of the main page, relation_stats is the stats index
+    entry of the relation."""
     url = "/osm/missing-housenumbers/" + relation.get_name() + "/view-result"
     percent = "N/A"
-    if os.path.exists(relation.get_files().get_housenumbers_percent_path()):
-        percent = helpers.get_content(relation.get_files().get_housenumbers_percent_path())
+    if relation_stats["housenumbers_percent"] is not None:
+        percent = relation_stats["housenumbers_percent"]
 
     doc = yattag.Doc()
     if percent != "N/A":
-        date = get_last_modified(relation.get_files().get_housenumbers_percent_path())
+        date = format_timestamp(relation_stats["housenumbers_percent_mtime"])
         with doc.tag("strong"):
             with doc.tag("a", href=url, title=_("updated") + " " + date):
                 doc.text(percent + "%")
@@ -430,16 +436,17 @@ def handle_main_housenr_percent(relation: helpers.Relation) -> Tuple[yattag.Doc,
     return doc, "0"
 
 
-def handle_main_street_percent(relation: helpers.Relation) -> Tuple[yattag.Doc, str]:
-    """Handles the street percent part of the main page."""
+def handle_main_street_percent(relation: helpers.Relation, relation_stats: Dict[str, Any]) -> Tuple[yattag.Doc, str]:
+    """Handles the street percent part of the main page, relation_stats is the stats index entry of
+    the relation."""
     url = "/osm/missing-streets/" + relation.get_name() + "/view-result"
     percent = "N/A"
-    if os.path.exists(relation.get_files().get_streets_percent_path()):
-        percent = helpers.get_content(relation.get_files().get_streets_percent_path())
+    if relation_stats["streets_percent"] is not None:
+        percent = relation_stats["streets_percent"]
 
     doc = yattag.Doc()
     if percent != "N/A":
-        date = get_last_modified(relation.get_files().get_streets_percent_path())
+        date = format_timestamp(relation_stats["streets_percent_mtime"])
         with doc.tag("strong"):
             with doc.tag("a", href=url, title=_("updated") + " " + date):
                 doc.text(percent + "%")
@@ -553,9 +560,11 @@ def setup_main_filter_for(request_uri: str) -> Tuple[Callable[[bool, helpers.Rel
 def handle_main_relation(
         relations: helpers.Relations,
         filter_for: Callable[[bool, helpers.Relation], bool],
-        relation_name: str
+        relation_name: str,
+        relation_stats: Dict[str, Any]
 ) -> List[yattag.Doc]:
-    """Handles one relation (one table row) on the main page."""
+    """Handles one relation (one table row) on the main page, relation_stats is the stats index
+    entry of the relation."""
     relation = relations.get_relation(relation_name)
     complete = True
 
@@ -565,14 +574,14 @@ def handle_main_relation(
     row.append(util.html_escape(relation_name))
 
     if streets != "only":
-        cell, percent = handle_main_housenr_percent(relation)
+        cell, percent = handle_main_housenr_percent(relation, relation_stats)
         doc = yattag.Doc()
         doc.asis(cell.getvalue())
         row.append(doc)
         if float(percent) < 100.0:
             complete = False
 
-        date = get_housenumbers_last_modified(relation)
+        date = format_timestamp(relation_stats["osm_housenumbers_mtime"])
         doc = yattag.Doc()
         href = "/osm/street-housenumbers/" + relation_name + "/view-result"
         with doc.tag("a", href=href, title=_("updated") + " " + date):
@@ -584,14 +593,14 @@ def handle_main_relation(
         row.append(yattag.Doc())
 
     if streets != "no":
-        cell, percent = handle_main_street_percent(relation)
+        cell, percent = handle_main_street_percent(relation, relation_stats)
         row.append(cell)
         if float(percent) < 100.0:
             complete = False
     else:
         row.append(yattag.Doc())
 
-    date = get_streets_last_modified(relation)
+    date = format_timestamp(relation_stats["osm_streets_mtime"])
     doc = yattag.Doc()
     with doc.tag("a", href="/osm/streets/" + relation_name + "/view-result", title=_("updated") + " " + date):
         doc.text(_("existing streets"))
@@ -615,7 +624,7 @@ def handle_main(request_uri: str, relations: helpers.Relations) -> yattag.Doc:
     filter_for, refmegye = setup_main_filter_for(request_uri)
 
     doc = yattag.Doc()
-    doc.asis(get_toolbar(relations).getvalue())
+    doc.asis(webframe.get_toolbar(relations).getvalue())
 
     doc.asis(handle_main_filters(relations, refmegye).getvalue())
     table = []
@@ -625,8 +634,10 @@ def handle_main(request_uri: str, relations: helpers.Relations) -> yattag.Doc:
                   util.html_escape(_("Street coverage")),
                   util.html_escape(_("Existing streets")),
                   util.html_escape(_("Area boundary"))])
+    # One file read instead of reading and checking the files of each relation.
+    stats_index = stats.get_stats(relations)
     for relation_name in relations.get_names():
-        row = handle_main_relation(relations, filter_for, relation_name)
+        row = handle_main_relation(relations, filter_for, relation_name, stats_index[relation_name])
         if row:
             table.append(row)
     doc.asis(util.html_table_from_list(table).getvalue())
@@ -634,172 +645,22 @@ def handle_main(request_uri: str, relations: helpers.Relations) -> yattag.Doc:
         with doc.tag("a", href="https://github.com/vmiklos/osm-gimmisn/tree/master/doc"):
             doc.text(_("Add new area"))
 
-    doc.asis(get_footer().getvalue())
+    doc.asis(webframe.get_footer().getvalue())
     return doc
 
 
-def fill_missing_header_items(streets: str, relation_name: str, items: List[yattag.Doc]) -> None:
-    """Generates the 'missing house numbers/streets' part of the header."""
-    if streets != "only":
-        doc = yattag.Doc()
-        with doc.tag("a", href="/osm/missing-housenumbers/" + relation_name + "/view-result"):
-            doc.text(_("Missing house numbers"))
-        doc.text(" (")
-        with doc.tag("a", href="/osm/missing-housenumbers/" + relation_name + "/view-result.txt"):
-            doc.text("txt")
-        doc.text(")")
-        items.append(doc)
-        doc = yattag.Doc()
-        with doc.tag("a", href="/osm/street-housenumbers/" + relation_name + "/view-result"):
-            doc.text(_("Existing house numbers"))
-        items.append(doc)
-    if streets != "no":
-        doc = yattag.Doc()
-        with doc.tag("a", href="/osm/missing-streets/" + relation_name + "/view-result"):
-            doc.text(_("Missing streets"))
-        doc.text(" (")
-        with doc.tag("a", href="/osm/missing-streets/" + relation_name + "/view-result.txt"):
-            doc.text("txt")
-        doc.text(")")
-        items.append(doc)
-
-
-def get_html_title(request_uri: str) -> str:
-    """Determines the HTML title for a given function and relation name."""
-    tokens = request_uri.split("/")
-    function = ""
-    relation_name = ""
-    if len(tokens) > 3:
-        function = tokens[2]
-        relation_name = tokens[3]
-    title = ""
-    if function == "missing-housenumbers":
-        title = " - " + _("{0} missing house numbers").format(relation_name)
-    elif function == "missing-streets":
-        title = " - " + relation_name + " " + _("missing streets")
-    elif function == "street-housenumbers":
-        title = " - " + relation_name + " " + _("existing house numbers")
-    elif function == "streets":
-        title = " - " + relation_name + " " + _("existing streets")
-    return title
-
-
-def fill_header_function(function: str, relation_name: str, items: List[yattag.Doc]) -> None:
-    """Fills items with function-specific links in the header. Returns a title."""
-    if function == "missing-housenumbers":
-        doc = yattag.Doc()
-        with doc.tag("a", href="/osm/missing-housenumbers/" + relation_name + "/update-result"):
-            doc.text(_("Update from reference"))
-        doc.text(" " + _("(may take seconds)"))
-        items.append(doc)
-        doc = yattag.Doc()
-        with doc.tag("a", href="https://overpass-turbo.eu/"):
-            doc.text(_("Overpass turbo"))
-        items.append(doc)
-    elif function == "missing-streets":
-        doc = yattag.Doc()
-        with doc.tag("a", href="/osm/missing-streets/" + relation_name + "/update-result"):
-            doc.text(_("Update from reference"))
-        items.append(doc)
-    elif function == "street-housenumbers":
-        doc = yattag.Doc()
-        with doc.tag("a", href="/osm/street-housenumbers/" + relation_name + "/update-result"):
-            doc.text(_("Call Overpass to update"))
-        doc.text(" " + _("(may take seconds)"))
-        items.append(doc)
-        doc = yattag.Doc()
-        with doc.tag("a", href="/osm/street-housenumbers/" + relation_name + "/view-query"):
-            doc.text(_("View query"))
-        items.append(doc)
-    elif function == "streets":
-        doc = yattag.Doc()
-        with doc.tag("a", href="/osm/streets/" + relation_name + "/update-result"):
-            doc.text(_("Call Overpass to update"))
-        doc.text(" " + _("(may take seconds)"))
-        items.append(doc)
-        doc = yattag.Doc()
-        with doc.tag("a", href="/osm/streets/" + relation_name + "/view-query"):
-            doc.text(_("View query"))
-        items.append(doc)
-
-
-def write_html_head(doc: yattag.Doc, title: str) -> None:
-    """Produces the <head> tag and its contents."""
-    with doc.tag("head"):
-        with doc.tag("title"):
-            doc.text(_("Where to map?") + title)
-        doc.stag("meta", charset="UTF-8")
-        doc.stag("link", rel="stylesheet", type="text/css", href="/osm/static/osm.css")
-        with doc.tag("script", src="/osm/static/sorttable.js"):
-            pass
-        doc.stag("meta", name="viewport", content="width=device-width, initial-scale=1")
-
-
-def get_toolbar(
-        relations: Optional[helpers.Relations] = None,
-        function: str = "",
-        relation_name: str = "",
-        relation_osmid: int = 0
-) -> yattag.Doc:
-    """Produces the start of the page. Note that the content depends on the function and the
-    relation, but not on the action to keep a balance between too generic and too specific
-    content."""
-    items = []  # type: List[yattag.Doc]
-
-    if relations and relation_name:
-        relation = relations.get_relation(relation_name)
-        streets = relation.get_config().should_check_missing_streets()
-
-    doc = yattag.Doc()
-    with doc.tag("a", href="/osm"):
-        doc.text(_("Area list"))
-    items.append(doc)
-    if relation_name:
-        fill_missing_header_items(streets, relation_name, items)
-        doc = yattag.Doc()
-        with doc.tag("a", href="/osm/streets/" + relation_name + "/view-result"):
-            doc.text(_("Existing streets"))
-        items.append(doc)
-
-    fill_header_function(function, relation_name, items)
-
-    if relation_osmid:
-        doc = yattag.Doc()
-        with doc.tag("a", href="https://www.openstreetmap.org/relation/" + str(relation_osmid)):
-            doc.text(_("Area boundary"))
-        items.append(doc)
+def handle_housenumber_stats(relations: helpers.Relations) -> yattag.Doc:
+    """Handles the missing house number counts across all relations, see
+    stats.get_housenumber_stats_tables()."""
     doc = yattag.Doc()
-    with doc.tag("a", href="https://github.com/vmiklos/osm-gimmisn/tree/master/doc"):
-        doc.text(_("Documentation"))
-    items.append(doc)
-
-    doc = yattag.Doc()
-    with doc.tag("div", id="toolbar"):
-        for index, item in enumerate(items):
-            if index:
-                doc.text(" ¦ ")
-            doc.asis(item.getvalue())
-    doc.stag("hr")
-    return doc
+    doc.asis(webframe.get_toolbar(relations).getvalue())
 
+    for title, table in stats.get_housenumber_stats_tables(relations, HOUSENUMBER_STATS_COUNT):
+        with doc.tag("h2"):
+            doc.text(title)
+        doc.asis(util.html_table_from_list(table).getvalue())
 
-def get_footer(last_updated: str = "") -> yattag.Doc:
-    """Produces the end of the page."""
-    items = []  # type: List[yattag.Doc]
-    doc = yattag.Doc()
-    doc.text(_("Version: "))
-    doc.asis(util.git_link(version.VERSION, "https://github.com/vmiklos/osm-gimmisn/commit/").getvalue())
-    items.append(doc)
-    items.append(util.html_escape(_("OSM data © OpenStreetMap contributors.")))
-    if last_updated:
-        items.append(util.html_escape(_("Last update: ") + last_updated))
-    doc = yattag.Doc()
-    doc.stag("hr")
-    with doc.tag("div"):
-        for index, item in enumerate(items):
-            if index:
-                doc.text(" ¦ ")
-            doc.asis(item.getvalue())
+    doc.asis(webframe.get_footer().getvalue())
     return doc
 
 
@@ -831,27 +692,62 @@ def handle_static(request_uri: str) -> Tuple[str, str]:
     return "", ""
 
 
-def send_response(start_response: 'StartResponse', content_type: str, status: str, output: str) -> Iterable[bytes]:
+def send_response(
+        start_response: 'StartResponse',
+        content_type: str,
+        status: str,
+        output: str,
+        extra_headers: Optional[List[Tuple[str, str]]] = None
+) -> Iterable[bytes]:
     """Turns an output string into a byte array and sends it."""
     output_bytes = output.encode('utf-8')
     response_headers = [('Content-type', content_type + '; charset=utf-8'),
                         ('Content-Length', str(len(output_bytes)))]
+    if extra_headers:
+        response_headers += extra_headers
     start_response(status, response_headers)
     return [output_bytes]
 
 
-def our_application_txt(
-        start_response: 'StartResponse',
-        relations: helpers.Relations,
-        request_uri: str
-) -> Iterable[bytes]:
-    """Dispatches plain text requests based on their URIs."""
+def our_application_txt(relations: helpers.Relations, request_uri: str) -> Tuple[str, str]:
+    """Dispatches plain text requests based on their URIs, returns a content type and an output."""
     content_type = "text/plain"
     if request_uri.startswith("/osm/missing-streets/"):
         output = missing_streets_view_txt(relations, request_uri)
     elif request_uri.startswith("/osm/missing-housenumbers/"):
         output = missing_housenumbers_view_txt(relations, request_uri)
-    return send_response(start_response, content_type, "200 OK", output)
+    return content_type, output
+
+
+def our_application_html(
+        environ: Dict[str, Any],
+        relations: helpers.Relations,
+        request_uri: str,
+        language: str
+) -> Tuple[str, str]:
+    """Dispatches HTML requests based on their URIs, returns a content type and an output."""
+    doc = yattag.Doc()
+    util.write_html_header(doc)
+    with doc.tag("html", lang=language):
+        webframe.write_html_head(doc, webframe.get_html_title(request_uri))
+
+        with doc.tag("body"):
+            if request_uri.startswith("/osm/streets/"):
+                doc.asis(handle_streets(relations, request_uri).getvalue())
+            elif request_uri.startswith("/osm/missing-streets/"):
+                doc.asis(handle_missing_streets(relations, request_uri).getvalue())
+            elif request_uri.startswith("/osm/street-housenumbers/"):
+                doc.asis(handle_street_housenumbers(relations, request_uri).getvalue())
+            elif request_uri.startswith("/osm/missing-housenumbers/"):
+                doc.asis(handle_missing_housenumbers(relations, request_uri).getvalue())
+            elif request_uri.startswith("/osm/housenumber-stats/"):
+                doc.asis(handle_housenumber_stats(relations).getvalue())
+            elif request_uri.startswith("/osm/webhooks/github"):
+                doc.asis(handle_github_webhook(environ).getvalue())
+            else:
+                doc.asis(handle_main(request_uri, relations).getvalue())
+
+    return "text/html", doc.getvalue()
 
 
 def get_request_uri(environ: Dict[str, Any]) -> str:
@@ -871,6 +767,60 @@ def get_request_uri(environ: Dict[str, Any]) -> str:
     return request_uri
 
 
+def get_page_dependencies(relations: helpers.Relations, request_uri: str) -> Optional[List[str]]:
+    """Gets the files a page is rendered from, or None if the page can't be cached, e.g. because
+    it has side effects."""
+    datadir = relations.get_datadir()
+    paths = [os.path.join(datadir, i) for i in ("relations.yaml", "refmegye-names.yaml", "reftelepules-names.yaml")]
+    tokens = request_uri.split("/")
+    if len(tokens) == 5 and tokens[2] in ("streets", "missing-streets", "street-housenumbers", "missing-housenumbers"):
+        # Relation pages read their inputs only, the derived files are written by them if needed.
+        if tokens[4] not in ("view-query", "view-result", "view-result.txt", "view-turbo"):
+            return None
+        files = relations.get_relation(tokens[3]).get_files()
+        paths += [
+            files.get_config_path(),
+            files.get_osm_streets_path(),
+            files.get_osm_housenumbers_path(),
+            files.get_ref_streets_path(),
+            files.get_ref_housenumbers_path(),
+            os.path.join(datadir, "streets-template.txt"),
+            os.path.join(datadir, "street-housenumbers-template.txt"),
+        ]
+        return paths
+
+    if request_uri.startswith("/osm/webhooks/") or request_uri.startswith("/osm/static/"):
+        return None
+
+    # The main page reads the stats index instead of the derived files of all relations.
+    paths.append(stats.get_stats_path(relations))
+    paths += [relation.get_files().get_config_path() for relation in relations.get_relations()]
+    return paths
+
+
+# Rendered pages, valid while the files returned by get_page_dependencies() are unchanged.
+PAGE_CACHE = pagecache.PageCache()
+
+
+def send_page(
+        environ: Dict[str, Any],
+        start_response: 'StartResponse',
+        relations: helpers.Relations,
+        key: Tuple[str, str, str, str],
+        render: Callable[[], Tuple[str, str]]
+) -> Iterable[bytes]:
+    """Sends a page using PAGE_CACHE if possible, key starts with the request URI, render() returns
+    a content type and an output."""
+    paths = get_page_dependencies(relations, key[0])
+    if paths is None or environ.get("REQUEST_METHOD", "GET") not in ("GET", "HEAD"):
+        content_type, output = render()
+        return send_response(start_response, content_type, "200 OK", output)
+
+    status, headers, body = PAGE_CACHE.serve(environ, key, paths, render, relations.get_storage().getmtime)
+    start_response(status, headers)
+    return [body]
+
+
 def our_application(
         environ: Dict[str, Any],
         start_response: 'StartResponse'
@@ -894,35 +844,19 @@ def our_application(
     request_uri = get_request_uri(environ)
     _ignore, _ignore, ext = request_uri.partition('.')
 
-    relations = helpers.Relations(get_datadir(), helpers.get_workdir(config))
-
-    if ext == "txt":
-        return our_application_txt(start_response, relations, request_uri)
+    relations = helpers.Relations(get_datadir(), helpers.get_workdir(config), helpers.get_storage_name(config))
 
     if request_uri.startswith("/osm/static/"):
         output, content_type = handle_static(request_uri)
         return send_response(start_response, content_type, "200 OK", output)
 
-    doc = yattag.Doc()
-    util.write_html_header(doc)
-    with doc.tag("html", lang=language):
-        write_html_head(doc, get_html_title(request_uri))
-
-        with doc.tag("body"):
-            if request_uri.startswith("/osm/streets/"):
-                doc.asis(handle_streets(relations, request_uri).getvalue())
-            elif request_uri.startswith("/osm/missing-streets/"):
-                doc.asis(handle_missing_streets(relations, request_uri).getvalue())
-            elif request_uri.startswith("/osm/street-housenumbers/"):
-                doc.asis(handle_street_housenumbers(relations, request_uri).getvalue())
-            elif request_uri.startswith("/osm/missing-housenumbers/"):
-                doc.asis(handle_missing_housenumbers(relations, request_uri).getvalue())
-            elif request_uri.startswith("/osm/webhooks/github"):
-                doc.asis(handle_github_webhook(environ).getvalue())
-            else:
-                doc.asis(handle_main(request_uri, relations).getvalue())
+    def render() -> Tuple[str, str]:
+        if ext == "txt":
+            return our_application_txt(relations, request_uri)
+        return our_application_html(environ, relations, request_uri, language)
 
-    return send_response(start_response, "text/html", "200 OK", doc.getvalue())
+    key = (request_uri, language, ui_locale, version.VERSION)
+    return send_page(environ, start_response, relations, key, render)
 
 
 def handle_exception(